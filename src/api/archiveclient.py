@@ -0,0 +1,118 @@
+import asyncio
+import datetime
+import logging
+import os
+import re
+from pathlib import Path
+
+import polars as pl
+
+import influx2client
+
+logger = logging.getLogger(__name__)
+
+# Output path of the data_archiver (daily files in <path>/daily/<location>/), empty disables
+ARCHIVE_PATH = os.getenv("PQOPEN_API_ARCHIVE_PATH", "")
+# The archiver reads this bucket and measurement, other requests are never served from the archive
+ARCHIVE_BUCKET = os.getenv("PQOPEN_INFLUXDB_BUCKET_ST", "short_term")
+ARCHIVE_MEASUREMENT = os.getenv("PQOPEN_API_ARCHIVE_MEASUREMENT", "cycle-by-cycle")
+
+ONE_DAY = datetime.timedelta(days=1)
+
+def clean_string(string_to_clean: str):
+    # Same as the location directory names of the data_archiver
+    return re.sub(r'[^a-zA-Z0-9_]', '_', string_to_clean)
+
+def _to_utc(dt: datetime.datetime) -> datetime.datetime:
+    # Same truncation to seconds (and wall clock as UTC) as the Flux range of influx2client
+    return dt.replace(microsecond=0, tzinfo=datetime.UTC)
+
+def find_day_file(location: str, channels: list, day: datetime.date) -> str | None:
+    """
+    Archive file of the day containing all channels, None if the day isn't archived
+    """
+    location_path = Path(ARCHIVE_PATH) / "daily" / clean_string(location)
+    for file_path in location_path.glob(day.strftime("%Y-%m-%d_") + "*.parquet"):
+        file_channels = file_path.stem.split("_", 1)[1].split(",")
+        if set(channels) <= set(file_channels):
+            return file_path.as_posix()
+    return None
+
+def split_range(start_dt: datetime.datetime, stop_dt: datetime.datetime, location: str, channels: list) -> list:
+    """
+    Split the range into consecutive (start, stop, archive files) segments
+
+    Whole UTC days with an archive file of all channels get the list of files, the other
+    parts None (to be read from the database).
+    """
+    start_dt, stop_dt = _to_utc(start_dt), _to_utc(stop_dt)
+    segments = []
+    segment_start, segment_files = start_dt, None
+    day_start = datetime.datetime.combine(start_dt.date(), datetime.time(), tzinfo=datetime.UTC)
+    if day_start < start_dt:
+        day_start += ONE_DAY
+    while day_start + ONE_DAY <= stop_dt:
+        day_file = find_day_file(location, channels, day_start.date())
+        if (day_file is None) != (segment_files is None) and day_start > segment_start:
+            segments.append((segment_start, day_start, segment_files))
+            segment_start, segment_files = day_start, None
+        if day_file is not None:
+            segment_files = (segment_files or []) + [day_file]
+        day_start += ONE_DAY
+    if segment_files is not None:
+        segments.append((segment_start, day_start, segment_files))
+        segment_start, segment_files = day_start, None
+    if segment_start < stop_dt:
+        segments.append((segment_start, stop_dt, None))
+    return segments
+
+async def iter_archive_frames(files: list, channels: list, start_dt: datetime.datetime, stop_dt: datetime.datetime,
+                              batch_rows: int):
+    """
+    Data of the daily archive files in [start_dt, stop_dt) as DataFrames of batch_rows rows
+
+    Lazy scan, only the channel columns and row groups of the range are read.
+    """
+    lazy_df = (pl.scan_parquet(files)
+               .select([pl.col("_time").cast(pl.Datetime("us", "UTC"))] + [pl.col(channel) for channel in channels])
+               .filter((pl.col("_time") >= start_dt) & (pl.col("_time") < stop_dt)))
+    batches = lazy_df.collect_batches(chunk_size=batch_rows)
+    while (pl_df := await asyncio.to_thread(next, batches, None)) is not None:
+        yield pl_df
+
+def is_archived(bucket: str, measurement: str, channels: list, window_ms: int | None = None) -> bool:
+    """
+    Requests that may be served (partly) from the archive
+
+    The archive holds only the configured channels of the raw data, so the channels must
+    be given explicitly and window aggregation is left to the database.
+    """
+    return (bool(ARCHIVE_PATH) and bucket == ARCHIVE_BUCKET and measurement == ARCHIVE_MEASUREMENT
+            and bool(channels) and window_ms is None)
+
+async def iter_data_frames_tiered(start_dt, stop_dt, location, bucket, measurement = "cycle-by-cycle", channels = [],
+                                  interval_sec = None, columns = None, chunk_sec = 3600, concurrency = 4,
+                                  window_ms = None, window_fn = "mean", batch_rows = None):
+    """
+    Like influx2client.iter_data_frames_chunked, but whole archived days are read from the archive files
+
+    The range is split into segments by day, returned in time order. Archived segments are
+    scanned locally, the remaining ones (usually only the recent days) are queried from the
+    database. All DataFrames are normalized to the requested channels.
+    """
+    if not is_archived(bucket, measurement, channels, window_ms):
+        async for pl_df in influx2client.iter_data_frames_chunked(start_dt, stop_dt, location, bucket, measurement,
+                                                                  channels, interval_sec, columns, chunk_sec,
+                                                                  concurrency, window_ms, window_fn):
+            yield pl_df
+        return
+    batch_rows = batch_rows or influx2client.INFLUXDB_BATCH_ROWS
+    for segment_start, segment_stop, files in await asyncio.to_thread(split_range, start_dt, stop_dt, location, channels):
+        if files is None:
+            frames = influx2client.iter_data_frames_chunked(segment_start, segment_stop, location, bucket, measurement,
+                                                            channels, interval_sec, channels, chunk_sec, concurrency)
+        else:
+            logger.debug(f"Read {location} {segment_start} - {segment_stop} from {len(files):d} archive files")
+            frames = iter_archive_frames(files, channels, segment_start, segment_stop, batch_rows)
+        async for pl_df in frames:
+            yield influx2client.normalize_columns(pl_df, channels)
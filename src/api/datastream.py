@@ -0,0 +1,209 @@
+import asyncio
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+import polars as pl
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.parquet as pq
+
+# Schema of a result without any data
+EMPTY_SCHEMA = pa.schema([("_time", pa.timestamp("us", tz="UTC"))])
+
+# Media type and file extension per format, CSV is compressed as a whole
+FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "csv": ("text/csv", "csv"),
+}
+COMPRESSED_CSV = {
+    "zstd": ("application/zstd", "csv.zst"),
+    "lz4": ("application/x-lz4", "csv.lz4"),
+}
+COMPRESSIONS = ("zstd", "lz4", "none")
+TIME_UNITS = ("s", "ms", "us", "ns")
+
+@dataclass(frozen=True)
+class OutputOptions:
+    """
+    File format of the data endpoints
+
+    compression is applied inside the file for Parquet and Arrow IPC (per column chunk
+    or record batch) and to the whole file for CSV. compression_level None is the codec
+    default. float32 downcasts all float64 columns, time_unit is the unit of _time.
+    """
+    format: str = "parquet"
+    compression: str = "zstd"
+    compression_level: int | None = None
+    float32: bool = False
+    time_unit: str = "us"
+
+    def __post_init__(self):
+        if self.format not in FORMATS:
+            raise ValueError(f"Unknown format {self.format}, allowed: {list(FORMATS)}")
+        if self.compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {self.compression}, allowed: {list(COMPRESSIONS)}")
+        if self.time_unit not in TIME_UNITS:
+            raise ValueError(f"Unknown time unit {self.time_unit}, allowed: {list(TIME_UNITS)}")
+        if self.compression != "none" and self.compression_level is not None:
+            max_level = pa.Codec.maximum_compression_level(self.compression)
+            if not 1 <= self.compression_level <= max_level:
+                raise ValueError(f"Compression level of {self.compression} must be 1-{max_level:d}, "
+                                 f"got {self.compression_level:d}")
+
+    @property
+    def codec(self) -> pa.Codec | None:
+        if self.compression == "none":
+            return None
+        return pa.Codec(self.compression, self.compression_level)
+
+    @property
+    def media_type(self) -> str:
+        if self.format == "csv" and self.compression in COMPRESSED_CSV:
+            return COMPRESSED_CSV[self.compression][0]
+        return FORMATS[self.format][0]
+
+    @property
+    def file_extension(self) -> str:
+        if self.format == "csv" and self.compression in COMPRESSED_CSV:
+            return COMPRESSED_CSV[self.compression][1]
+        return FORMATS[self.format][1]
+
+    def file_name(self, prefix: str) -> str:
+        if self.format == "csv":
+            return f"{prefix}.{self.file_extension}"
+        return f"{prefix}.{self.compression}.{self.file_extension}"
+
+    def output_schema(self, schema: pa.Schema) -> pa.Schema:
+        fields = []
+        for field in schema:
+            if pa.types.is_timestamp(field.type):
+                field = field.with_type(pa.timestamp(self.time_unit, tz=field.type.tz))
+            elif self.float32 and pa.types.is_float64(field.type):
+                field = field.with_type(pa.float32())
+            fields.append(field)
+        return pa.schema(fields)
+
+DEFAULT_OUTPUT_OPTIONS = OutputOptions()
+
+class ChunkSink:
+    """
+    Write-only file object for the pyarrow writers, collects the written bytes until drained
+    """
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def writable(self) -> bool:
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+class _ParquetWriter:
+    # One row group per table
+    def __init__(self, schema: pa.Schema, options: OutputOptions):
+        self.sink = ChunkSink()
+        self.writer = pq.ParquetWriter(self.sink, schema, compression=options.compression,
+                                       compression_level=options.compression_level)
+
+    def write(self, table: pa.Table) -> bytes:
+        self.writer.write_table(table, row_group_size=max(len(table), 1))
+        return self.sink.drain()
+
+    def close(self) -> bytes:
+        self.writer.close()
+        return self.sink.drain()
+
+class _ArrowWriter:
+    # Arrow IPC stream, record batches with compressed buffers
+    def __init__(self, schema: pa.Schema, options: OutputOptions):
+        self.sink = ChunkSink()
+        self.writer = pa.ipc.new_stream(self.sink, schema, options=pa.ipc.IpcWriteOptions(compression=options.codec))
+
+    def write(self, table: pa.Table) -> bytes:
+        self.writer.write_table(table)
+        return self.sink.drain()
+
+    def close(self) -> bytes:
+        self.writer.close()
+        return self.sink.drain()
+
+class _CsvWriter:
+    # Each written part is compressed as an own frame, concatenated frames are a valid zstd/lz4 file
+    def __init__(self, schema: pa.Schema, options: OutputOptions):
+        self.sink = ChunkSink()
+        self.codec = options.codec
+        self.writer = pyarrow.csv.CSVWriter(self.sink, schema)
+
+    def _drain(self) -> bytes:
+        data = self.sink.drain()
+        if self.codec is None or not data:
+            return data
+        return self.codec.compress(data, asbytes=True)
+
+    def write(self, table: pa.Table) -> bytes:
+        self.writer.write_table(table)
+        return self._drain()
+
+    def close(self) -> bytes:
+        self.writer.close()
+        return self._drain()
+
+WRITERS = {"parquet": _ParquetWriter, "arrow": _ArrowWriter, "csv": _CsvWriter}
+
+async def iter_slices(pl_df: pl.DataFrame, batch_rows: int) -> AsyncIterator[pl.DataFrame]:
+    """
+    Already loaded DataFrame as batches for open_data_stream()
+    """
+    for offset in range(0, len(pl_df), batch_rows):
+        yield pl_df.slice(offset, batch_rows)
+
+async def open_data_stream(frames: AsyncIterator[pl.DataFrame],
+                           options: OutputOptions = DEFAULT_OUTPUT_OPTIONS) -> AsyncIterator[bytes]:
+    """
+    File of the DataFrame batches in the requested format, streamed batch by batch
+
+    The first batch is read before returning, so errors of the data source are raised
+    here (before a response is started) and not in the middle of the stream.
+    """
+    first_frame = await anext(frames, None)
+    return _generate(first_frame, frames, options)
+
+def _write_table(writer, schema: pa.Schema, table: pa.Table) -> bytes:
+    # Unsafe cast truncates timestamps to a coarser unit instead of raising
+    return writer.write(table.cast(schema, safe=False))
+
+async def _generate(first_frame: pl.DataFrame | None, frames: AsyncIterator[pl.DataFrame],
+                    options: OutputOptions) -> AsyncIterator[bytes]:
+    if first_frame is None:
+        writer = WRITERS[options.format](options.output_schema(EMPTY_SCHEMA), options)
+        yield await asyncio.to_thread(writer.close)
+        return
+    table = first_frame.to_arrow()
+    schema = options.output_schema(table.schema)
+    writer = WRITERS[options.format](schema, options)
+    try:
+        yield await asyncio.to_thread(_write_table, writer, schema, table)
+        async for pl_df in frames:
+            yield await asyncio.to_thread(_write_table, writer, schema, pl_df.to_arrow())
+    finally:
+        await frames.aclose()
+    yield await asyncio.to_thread(writer.close)
@@ -0,0 +1,97 @@
+import asyncio
+import math
+
+import numpy as np
+import polars as pl
+
+def window_ms(duration_sec: float, max_points: int) -> int:
+    """
+    Window length (ms) giving at most max_points windows for the duration
+    """
+    return max(math.ceil(duration_sec * 1000 / max_points), 1)
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Indices of the points selected by Largest-Triangle-Three-Buckets
+
+    The first and last point are kept, the points between are split into threshold - 2
+    buckets of equal count. Per bucket the point forming the largest triangle with the
+    point selected in the previous bucket and the mean of the next bucket is selected.
+    The areas of a bucket are computed vectorized, only the buckets are iterated.
+    """
+    num_points = len(x)
+    if threshold >= num_points or threshold < 3:
+        return np.arange(num_points)
+    x = x.astype(np.float64) - float(x[0])
+    y = y.astype(np.float64)
+    edges = np.linspace(1, num_points - 1, threshold - 1).astype(np.int64)
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[1:-1], edges[:-1] - 1) / counts
+    mean_y = np.add.reduceat(y[1:-1], edges[:-1] - 1) / counts
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = num_points - 1
+    a_x, a_y = x[0], y[0]
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        bucket_x, bucket_y = x[start:stop], y[start:stop]
+        areas = np.abs((a_x - next_x[bucket]) * (bucket_y - a_y) - (a_x - bucket_x) * (next_y[bucket] - a_y))
+        idx = start + int(np.argmax(areas))
+        selected[bucket + 1] = idx
+        a_x, a_y = x[idx], y[idx]
+    return selected
+
+def lttb_pl(pl_df: pl.DataFrame, max_points: int) -> pl.DataFrame:
+    """
+    Reduce every column to max_points with LTTB, returns the rows selected for any column
+    """
+    if len(pl_df) <= max_points:
+        return pl_df
+    timestamps = pl_df["_time"].dt.epoch("us").to_numpy()
+    rows = []
+    for column in pl_df.columns:
+        if column == "_time" or not pl_df[column].dtype.is_numeric():
+            continue
+        values = pl_df[column].cast(pl.Float64).to_numpy()
+        valid = np.flatnonzero(np.isfinite(values))
+        rows.append(valid[lttb_indices(timestamps[valid], values[valid], max_points)])
+    if not rows:
+        return pl_df.head(max_points)
+    return pl_df[np.unique(np.concatenate(rows))]
+
+def window_pl(pl_df: pl.DataFrame, window_ms: int, window_fn: str) -> pl.DataFrame:
+    """
+    Same window aggregation as aggregateWindow(timeSrc: "_start") for already loaded data
+    """
+    if pl_df.is_empty():
+        return pl_df
+    columns = [column for column in pl_df.columns if column != "_time"]
+    aggregation = {"mean": pl.mean, "min": pl.min, "max": pl.max}[window_fn]
+    return (pl_df.sort("_time")
+            .group_by_dynamic("_time", every=f"{window_ms:d}ms")
+            .agg(aggregation(columns)))
+
+async def iter_lttb(frames, max_points: int, batch_rows: int):
+    """
+    LTTB of all DataFrame batches, returned as batches again
+
+    The range is reduced in stages, so memory doesn't grow with its length: whenever
+    2 * stage_points new rows arrived, the held rows are reduced to stage_points (4 times
+    max_points, at least batch_rows) per field. The result is reduced to max_points.
+    """
+    stage_points = max(4 * max_points, batch_rows)
+    pending = []
+    num_new = 0
+    async for pl_df in frames:
+        pending.append(pl_df)
+        num_new += len(pl_df)
+        if num_new >= 2 * stage_points:
+            pending = [await asyncio.to_thread(lttb_pl, pl.concat(pending, how="diagonal_relaxed"), stage_points)]
+            num_new = 0
+    if not pending:
+        return
+    pl_df = await asyncio.to_thread(lttb_pl, pl.concat(pending, how="diagonal_relaxed"), max_points)
+    for offset in range(0, len(pl_df), batch_rows):
+        yield pl_df.slice(offset, batch_rows)
@@ -0,0 +1,331 @@
+import asyncio
+import datetime
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from dataclasses import dataclass, asdict
+from typing import AsyncIterator, BinaryIO
+
+import polars as pl
+
+import datastream
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 1 << 20
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+FINISHED_STATES = ("done", "failed")
+
+class QueueFullError(Exception):
+    pass
+
+class _JobDeleted(Exception):
+    pass
+
+def owner_digest(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+def is_job_owner(job: "ExportJob", api_key: str) -> bool:
+    """
+    Check in constant time if the job was submitted with the API key
+    """
+    return hmac.compare_digest(job.owner, owner_digest(api_key))
+
+@dataclass
+class ExportJob:
+    """
+    State of an export job, stored as <job_id>.json in the export directory
+
+    range_start and range_stop (POSIX timestamps) are used for the progress, which is the
+    part of the range already written. worker_id is the API process holding the job,
+    updated_at its last heartbeat. owner is the sha256 digest of the API key, the key
+    itself is never written to the export directory.
+    """
+    job_id: str
+    owner: str
+    file_name: str
+    media_type: str
+    range_start: float
+    range_stop: float
+    created_at: float
+    worker_id: str
+    updated_at: float
+    state: str = "queued"
+    started_at: float | None = None
+    finished_at: float | None = None
+    progress: float = 0.0
+    rows: int = 0
+    size: int = 0
+    error: str | None = None
+
+def _iso(timestamp: float | None) -> str | None:
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.UTC).isoformat()
+
+def parse_range(range_header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    First byte and length of a single byte range header, None for the whole file
+
+    Malformed headers and multiple ranges are ignored (whole file), a range starting
+    after the end of the file raises ValueError.
+    """
+    if not range_header:
+        return None
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", range_header)
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+    if match.group(1) == "":
+        # Suffix range, the last n bytes
+        length = min(int(match.group(2)), size)
+        if length == 0:
+            raise ValueError(f"Range {range_header} not satisfiable")
+        return size - length, length
+    first = int(match.group(1))
+    last = int(match.group(2)) if match.group(2) else size - 1
+    if first >= size:
+        raise ValueError(f"Range {range_header} not satisfiable")
+    if last < first:
+        return None
+    return first, min(last, size - 1) - first + 1
+
+async def iter_file_range(result_file: BinaryIO, offset: int, length: int) -> AsyncIterator[bytes]:
+    try:
+        await asyncio.to_thread(result_file.seek, offset)
+        while length > 0:
+            chunk = await asyncio.to_thread(result_file.read, min(READ_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        result_file.close()
+
+class ExportManager:
+    """
+    Queue of export jobs written to files by a bounded pool of background workers
+
+    Jobs are queued in the process accepting them and run by num_workers workers, at most
+    max_queued jobs wait. The job state is kept in files, so every API worker sharing the
+    directory can report and serve the jobs. Finished jobs are deleted by gc() after
+    max_age_sec, and the oldest ones earlier if the results exceed max_bytes.
+
+    Every process has its own random worker id (PIDs repeat after container restarts and
+    differ between PID namespaces) and refreshes the heartbeat of its unfinished jobs with
+    every progress update and gc() run. Unfinished jobs of other workers without heartbeat
+    for stale_sec are marked failed, e.g. after a restart.
+    """
+    def __init__(self, path: str, num_workers: int = 2, max_queued: int = 20, max_age_sec: float = 86400,
+                 max_bytes: int = 10 << 30, stale_sec: float = 300):
+        self.path = path
+        self.num_workers = num_workers
+        self.max_age_sec = max_age_sec
+        self.max_bytes = max_bytes
+        self.stale_sec = stale_sec
+        self.worker_id = uuid.uuid4().hex
+        self._queue = asyncio.Queue(max_queued)
+        self._workers = []
+        self._active = {}
+        os.makedirs(path, exist_ok=True)
+
+    def _state_path(self, job_id: str) -> str:
+        return os.path.join(self.path, f"{job_id}.json")
+
+    def result_path(self, job_id: str) -> str:
+        return os.path.join(self.path, f"{job_id}.bin")
+
+    def _save(self, job: ExportJob):
+        tmp_path = os.path.join(self.path, f".{job.job_id}.{uuid.uuid4().hex}.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(asdict(job), f)
+        os.replace(tmp_path, self._state_path(job.job_id))
+
+    def _update(self, job: ExportJob):
+        if not os.path.exists(self._state_path(job.job_id)):
+            raise _JobDeleted(job.job_id)
+        job.updated_at = time.time()
+        self._save(job)
+
+    def get(self, job_id: str) -> ExportJob | None:
+        if not JOB_ID_PATTERN.match(job_id):
+            return None
+        try:
+            with open(self._state_path(job_id)) as f:
+                return ExportJob(**json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def status(self, job: ExportJob) -> dict:
+        """
+        Public state of the job
+        """
+        return {
+            "job_id": job.job_id,
+            "state": job.state,
+            "progress": round(job.progress, 4),
+            "rows": job.rows,
+            "size": job.size,
+            "error": job.error,
+            "file_name": job.file_name,
+            "created_at": _iso(job.created_at),
+            "finished_at": _iso(job.finished_at),
+            "expires_at": _iso(job.finished_at + self.max_age_sec if job.finished_at is not None else None),
+        }
+
+    def submit(self, owner: str, frames: AsyncIterator[pl.DataFrame], output_options: datastream.OutputOptions,
+               file_name: str, range_start: datetime.datetime, range_stop: datetime.datetime) -> ExportJob:
+        """
+        Queue the export of frames (not started yet) for the API key owner, raises QueueFullError
+        if too many jobs wait
+        """
+        if self._queue.full():
+            raise QueueFullError(f"{self._queue.maxsize:d} export jobs already queued")
+        now = time.time()
+        job = ExportJob(job_id=uuid.uuid4().hex, owner=owner_digest(owner), file_name=file_name,
+                        media_type=output_options.media_type,
+                        range_start=range_start.replace(tzinfo=datetime.UTC).timestamp(),
+                        range_stop=range_stop.replace(tzinfo=datetime.UTC).timestamp(),
+                        created_at=now, worker_id=self.worker_id, updated_at=now)
+        self._save(job)
+        self._active[job.job_id] = job
+        self._queue.put_nowait((job, frames, output_options))
+        logger.info(f"Export {job.job_id} queued")
+        return job
+
+    def delete(self, job_id: str):
+        """
+        Delete state and result, a running job stops with its next batch
+        """
+        for file_path in (self._state_path(job_id), self.result_path(job_id)):
+            try:
+                os.unlink(file_path)
+            except FileNotFoundError:
+                pass
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._run_worker()) for _ in range(self.num_workers)]
+
+    async def _run_worker(self):
+        while True:
+            job, frames, output_options = await self._queue.get()
+            try:
+                await self._run_job(job, frames, output_options)
+            except _JobDeleted:
+                logger.info(f"Export {job.job_id} deleted")
+            except Exception as e:
+                logger.warning(f"Export {job.job_id} failed: {str(e)}")
+            finally:
+                self._active.pop(job.job_id, None)
+                self._queue.task_done()
+
+    async def _track(self, job: ExportJob, frames: AsyncIterator[pl.DataFrame]) -> AsyncIterator[pl.DataFrame]:
+        duration = max(job.range_stop - job.range_start, 1e-6)
+        async for pl_df in frames:
+            job.rows += len(pl_df)
+            if len(pl_df) and "_time" in pl_df.columns:
+                last_ts = pl_df["_time"].max().timestamp()
+                job.progress = min(max((last_ts - job.range_start) / duration, job.progress), 1.0)
+            await asyncio.to_thread(self._update, job)
+            yield pl_df
+
+    async def _run_job(self, job: ExportJob, frames: AsyncIterator[pl.DataFrame],
+                       output_options: datastream.OutputOptions):
+        job.state = "running"
+        job.started_at = time.time()
+        self._update(job)
+        tmp_path = os.path.join(self.path, f".{job.job_id}.bin.tmp")
+        try:
+            data_stream = await datastream.open_data_stream(self._track(job, frames), output_options)
+            with open(tmp_path, "wb") as f:
+                async for chunk in data_stream:
+                    job.size += len(chunk)
+                    if job.size > self.max_bytes:
+                        raise ValueError(f"Export exceeds the maximum size of {self.max_bytes:d} bytes")
+                    await asyncio.to_thread(f.write, chunk)
+            os.replace(tmp_path, self.result_path(job.job_id))
+            job.state = "done"
+            job.progress = 1.0
+        except _JobDeleted:
+            raise
+        except asyncio.CancelledError:
+            job.state = "failed"
+            job.error = "Export interrupted"
+            raise
+        except Exception as e:
+            job.state = "failed"
+            job.error = str(e)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            job.finished_at = time.time()
+            try:
+                self._update(job)
+            except _JobDeleted:
+                self.delete(job.job_id)
+                raise
+        logger.info(f"Export {job.job_id} {job.state}, {job.rows:d} rows, {job.size:d} bytes")
+
+    def gc(self):
+        """
+        Delete expired jobs, the oldest results above max_bytes and mark jobs of dead workers failed
+        """
+        for job in list(self._active.values()):
+            # Heartbeat of the own queued and running jobs
+            try:
+                self._update(job)
+            except _JobDeleted:
+                pass
+        now = time.time()
+        finished = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".tmp") and entry.stat().st_mtime < now - self.max_age_sec:
+                # Left by a killed worker
+                os.unlink(entry.path)
+                continue
+            if not entry.name.endswith(".json"):
+                continue
+            job = self.get(entry.name.removesuffix(".json"))
+            if job is None:
+                continue
+            if job.state not in FINISHED_STATES:
+                if job.worker_id != self.worker_id and job.updated_at < now - self.stale_sec:
+                    job.state, job.error, job.finished_at = "failed", "Export interrupted", now
+                    self._save(job)
+                continue
+            if job.finished_at < now - self.max_age_sec:
+                self.delete(job.job_id)
+                logger.debug(f"Deleted expired export {job.job_id}")
+            elif job.state == "done":
+                finished.append(job)
+        total_size = sum(job.size for job in finished)
+        for job in sorted(finished, key=lambda job: job.finished_at):
+            if total_size <= self.max_bytes:
+                break
+            self.delete(job.job_id)
+            total_size -= job.size
+            logger.debug(f"Deleted export {job.job_id}, exports exceed {self.max_bytes:d} bytes")
+
+    async def run_gc(self, interval: float):
+        """
+        Run gc() every interval seconds until cancelled
+        """
+        while True:
+            try:
+                await asyncio.to_thread(self.gc)
+            except Exception as e:
+                logger.warning(f"Export cleanup failed: {str(e)}")
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        """
+        Stop the workers, running jobs are marked failed
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
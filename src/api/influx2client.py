@@ -5,12 +5,16 @@ Created on Wed Dec 10 14:29:27 2025
 @author: Standard
 """
 
-import requests
+import asyncio
+import collections
+import httpx
 import polars as pl
 from io import BytesIO
 import datetime
 import logging
+import math
 import os
+import random
 
 logger = logging.getLogger(__name__)
 
@@ -22,54 +26,317 @@ if app_env == "development":
 INFLUXDB_URL = os.getenv("PQOPEN_INFLUXDB_URL", "http://localhost:8086")
 INFLUXDB_TOKEN = os.getenv("PQOPEN_INFLUXDB_TOKEN", "")
 INFLUXDB_ORG = os.getenv("PQOPEN_INFLUXDB_ORG", "pqopen")
+# Connection pool and timeouts (seconds) of the shared client
+INFLUXDB_POOL_SIZE = int(os.getenv("PQOPEN_INFLUXDB_POOL_SIZE", 20))
+INFLUXDB_POOL_KEEPALIVE = int(os.getenv("PQOPEN_INFLUXDB_POOL_KEEPALIVE", 10))
+INFLUXDB_CONNECT_TIMEOUT = float(os.getenv("PQOPEN_INFLUXDB_CONNECT_TIMEOUT", 5.0))
+INFLUXDB_READ_TIMEOUT = float(os.getenv("PQOPEN_INFLUXDB_READ_TIMEOUT", 120.0))
+INFLUXDB_POOL_TIMEOUT = float(os.getenv("PQOPEN_INFLUXDB_POOL_TIMEOUT", 30.0))
+# Retries of failed queries (connection errors, 429, 5xx) with exponential backoff and full jitter
+INFLUXDB_RETRIES = int(os.getenv("PQOPEN_INFLUXDB_RETRIES", 3))
+INFLUXDB_RETRY_BACKOFF = float(os.getenv("PQOPEN_INFLUXDB_RETRY_BACKOFF", 0.5))
+INFLUXDB_RETRY_MAX_BACKOFF = float(os.getenv("PQOPEN_INFLUXDB_RETRY_MAX_BACKOFF", 8.0))
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# Rows per DataFrame batch of streamed data and read size of the response body
+INFLUXDB_BATCH_ROWS = int(os.getenv("PQOPEN_INFLUXDB_BATCH_ROWS", 65_536))
+INFLUXDB_CHUNK_SIZE = 1 << 20
 
 headers = {
     "Authorization": f"Token {INFLUXDB_TOKEN}",
     "Accept": "application/csv",
-    "Content-type": "application/vnd.flux"
+    "Content-type": "application/json"
 }
 
-def read_data_pl(start_dt, stop_dt, location, bucket, measurement = "aggregated-data", channels = [], interval_sec = None):
-    # Check max. Lenght of query
+_client = None
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Shared client with keep-alive connection pool, created on first use
+    """
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(base_url=INFLUXDB_URL,
+                                    headers=headers,
+                                    params={"org": INFLUXDB_ORG},
+                                    limits=httpx.Limits(max_connections=INFLUXDB_POOL_SIZE,
+                                                        max_keepalive_connections=INFLUXDB_POOL_KEEPALIVE),
+                                    timeout=httpx.Timeout(INFLUXDB_READ_TIMEOUT,
+                                                          connect=INFLUXDB_CONNECT_TIMEOUT,
+                                                          pool=INFLUXDB_POOL_TIMEOUT))
+    return _client
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _build_query_request(flux_query: str, annotations: list) -> httpx.Request:
+    body = {"query": flux_query, "dialect": {"header": True, "annotations": annotations}}
+    return get_client().build_request("POST", "/api/v2/query", json=body)
+
+async def _send_query(flux_query: str, annotations: list = []) -> httpx.Response:
+    """
+    Send Flux query and return the (not yet read) streaming response
+
+    Failed requests (connection errors, 429, 5xx) are retried up to INFLUXDB_RETRIES times,
+    only before the response body is read, so no data is returned twice.
+    """
+    for attempt in range(INFLUXDB_RETRIES + 1):
+        try:
+            response = await get_client().send(_build_query_request(flux_query, annotations), stream=True)
+            if response.status_code not in RETRY_STATUS_CODES:
+                if response.is_error:
+                    await response.aread()
+                    await response.aclose()
+                    response.raise_for_status()
+                return response
+            await response.aclose()
+            error = f"HTTP {response.status_code:d}"
+        except httpx.TransportError as e:
+            error = str(e) or type(e).__name__
+        if attempt == INFLUXDB_RETRIES:
+            raise ConnectionError(f"InfluxDB query failed after {attempt + 1:d} attempts: {error}")
+        backoff = random.uniform(0, min(INFLUXDB_RETRY_MAX_BACKOFF, INFLUXDB_RETRY_BACKOFF * 2**attempt))
+        logger.warning(f"InfluxDB query failed ({error}), retry in {backoff:.2f} s")
+        await asyncio.sleep(backoff)
+
+async def run_query(flux_query: str) -> bytes:
+    """
+    Run Flux query and return the whole CSV response
+    """
+    response = await _send_query(flux_query)
+    try:
+        return await response.aread()
+    finally:
+        await response.aclose()
+
+def _parse_schema_pl(content: bytes, column_name: str) -> dict:
+    pl_df = pl.read_csv(BytesIO(content))
+    pl_df = pl_df.drop(["", "result", "table"])
+    pl_df = pl_df.filter(pl.col("_value").is_not_null())
+    pl_df = pl_df.rename({"_value": column_name})
+    return pl_df.to_dict(as_series=False)
+
+# Polars types of the annotated CSV datatypes (dateTime is parsed from string)
+CSV_DATATYPES = {
+    "double": pl.Float64,
+    "long": pl.Int64,
+    "unsignedLong": pl.UInt64,
+    "boolean": pl.Boolean,
+    "duration": pl.Int64,
+}
+
+class AnnotatedCsvParser:
+    """
+    Incremental parser of the InfluxDB annotated CSV (with datatype annotation)
+
+    feed() takes the response body in arbitrary chunks and returns DataFrames of the
+    complete data rows, typed by the datatype annotation, without the result and
+    table columns. Only the unfinished last line of a chunk is kept.
+    """
+    def __init__(self):
+        self._buffer = b""
+        self._datatypes = []
+        self._columns = None
+        self._schema = None
+        self._error = False
+
+    def feed(self, chunk: bytes) -> list[pl.DataFrame]:
+        self._buffer += chunk
+        frames = []
+        while True:
+            if self._columns is None:
+                # Annotations and header line of the next table
+                line_end = self._buffer.find(b"\n")
+                if line_end < 0:
+                    break
+                line = self._buffer[:line_end].rstrip(b"\r").decode()
+                self._buffer = self._buffer[line_end + 1:]
+                if line.startswith("#datatype,"):
+                    self._datatypes = line.split(",")
+                elif line and not line.startswith("#"):
+                    self._start_table(line.split(","))
+                continue
+            # Data rows up to the empty line ending the table or the last complete line
+            table_end = min((pos for pos in (self._buffer.find(b"\n\r\n"), self._buffer.find(b"\n\n")) if pos >= 0),
+                            default=-1)
+            if table_end >= 0:
+                block = self._buffer[:table_end + 1]
+                self._buffer = self._buffer[self._buffer.index(b"\n", table_end + 1) + 1:]
+            else:
+                block_end = self._buffer.rfind(b"\n")
+                block = self._buffer[:block_end + 1]
+                self._buffer = self._buffer[block_end + 1:]
+            if block.strip():
+                frames.append(self._parse_block(block))
+            if table_end < 0:
+                break
+            self._columns = None
+        return frames
+
+    def _start_table(self, columns: list):
+        self._error = "error" in columns
+        self._columns = columns
+        self._schema = {}
+        for idx, column in enumerate(columns):
+            datatype = self._datatypes[idx] if idx < len(self._datatypes) else "string"
+            self._schema[column] = CSV_DATATYPES.get(datatype, pl.String)
+        self._datatypes = []
+
+    def _parse_block(self, block: bytes) -> pl.DataFrame:
+        if self._error:
+            raise RuntimeError(f"InfluxDB query error: {block.decode().strip()}")
+        pl_df = pl.read_csv(block, has_header=False, new_columns=self._columns, schema=self._schema)
+        pl_df = pl_df.drop(["", "result", "table"], strict=False)
+        if "_time" in pl_df.columns:
+            pl_df = pl_df.with_columns(pl.col("_time").str.to_datetime(time_unit="us", time_zone="UTC"))
+        return pl_df
+
+def build_data_query(start_dt, stop_dt, location, bucket, measurement = "aggregated-data", channels = [], interval_sec = None,
+                     window_ms = None, window_fn = "mean", layout = "long"):
+    """
+    Flux query of the data, pivoted by InfluxDB to one row per timestamp and one column per field
+
+    With window_ms, every field is aggregated with window_fn (mean, min, max) in windows of
+    window_ms, timestamped with the window start. location may be a list of locations read
+    in one query, with layout "long" as one row per timestamp and location (column
+    location_name) or "wide" as one row per timestamp and columns <location>_<field>.
+    The rows are sorted by time (and location), the output order of group() is undefined.
+    """
+    metadata = {'start_time': start_dt.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                'stop_time': stop_dt.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                'loc': location,
+                'additional_filter': f'|> filter(fn: (r) => r["interval_sec"] == "{interval_sec:d}")\n' if interval_sec else ""}
     if channels:
-        metadata = {'start_time': start_dt.strftime("%Y-%m-%dT%H:%M:%SZ"), 
-                    'stop_time': stop_dt.strftime("%Y-%m-%dT%H:%M:%SZ"),
-                    'loc': location,
-                    'channels': '" or r["_field"] == "'.join(channels),
-                    'additional_filter': f'|> filter(fn: (r) => r["interval_sec"] == "{interval_sec:d}")\n' if interval_sec else ""
-                  }
-        
-        query = f"""
-        from(bucket: "{bucket}")
-          |> range(start: {metadata['start_time']:s}, stop: {metadata['stop_time']:s})
-          |> filter(fn: (r) => r["_measurement"] == "{measurement}" and r["location_name"] == "{metadata['loc']:s}")
-          {metadata['additional_filter']:s}
-          |> filter(fn: (r) => r["_field"] == "{metadata['channels']:s}")
-          |> keep(columns: ["_time", "_field", "_value"])
-        """
+        channels_filter = '|> filter(fn: (r) => r["_field"] == "' + '" or r["_field"] == "'.join(channels) + '")'
     else:
-        metadata = {'start_time': start_dt.strftime("%Y-%m-%dT%H:%M:%SZ"), 
-                    'stop_time': stop_dt.strftime("%Y-%m-%dT%H:%M:%SZ"),
-                    'loc': location,
-                    'additional_filter': f'|> filter(fn: (r) => r["interval_sec"] == "{interval_sec:d}")\n' if interval_sec else ""}
-        
-        query = f"""
-        from(bucket: "{bucket}")
-          |> range(start: {metadata['start_time']:s}, stop: {metadata['stop_time']:s})
-          |> filter(fn: (r) => r["_measurement"] == "{measurement}" and r["location_name"] == "{metadata['loc']:s}")
-          {metadata['additional_filter']:s}
-          |> keep(columns: ["_time", "_field", "_value"])
-        """
-    response = requests.post(INFLUXDB_URL+"/api/v2/query", params={"org": INFLUXDB_ORG}, headers=headers, data=query)
-    # Load Response with Polars CSV Reader
-    pl_df = pl.read_csv(BytesIO(response.content))
-    pl_df = pl_df.drop(["", "result", "table"])
-    pl_df = pl_df.filter(pl.col("_field").is_not_null())
-    pl_df = pl_df.with_columns(pl.col("_time").str.to_datetime(time_zone="UTC"))
-    pl_df = pl_df.pivot(index="_time", on="_field", values="_value").sort("_time")
-    return pl_df
+        channels_filter = ""
+    if window_ms:
+        window = f'|> aggregateWindow(every: {window_ms:d}ms, fn: {window_fn:s}, timeSrc: "_start", createEmpty: false)'
+    else:
+        window = ""
+    if isinstance(location, str):
+        location_filter = f'r["location_name"] == "{metadata["loc"]:s}"'
+        keep_columns = '"_time", "_field", "_value"'
+        pivot = 'pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")'
+        sort_columns = '"_time"'
+    else:
+        location_filter = 'contains(value: r["location_name"], set: ["' + '", "'.join(location) + '"])'
+        keep_columns = '"_time", "_field", "_value", "location_name"'
+        if layout == "wide":
+            pivot = 'pivot(rowKey: ["_time"], columnKey: ["location_name", "_field"], valueColumn: "_value")'
+            sort_columns = '"_time"'
+        else:
+            pivot = 'pivot(rowKey: ["_time", "location_name"], columnKey: ["_field"], valueColumn: "_value")'
+            sort_columns = '"_time", "location_name"'
+    query = f"""
+    from(bucket: "{bucket}")
+      |> range(start: {metadata['start_time']:s}, stop: {metadata['stop_time']:s})
+      |> filter(fn: (r) => r["_measurement"] == "{measurement}" and {location_filter:s})
+      {metadata['additional_filter']:s}
+      {channels_filter:s}
+      {window:s}
+      |> keep(columns: [{keep_columns:s}])
+      |> group()
+      |> {pivot:s}
+      |> sort(columns: [{sort_columns:s}])
+    """
+    return query
+
+async def iter_data_frames(start_dt, stop_dt, location, bucket, measurement = "aggregated-data", channels = [],
+                           interval_sec = None, batch_rows = None, window_ms = None, window_fn = "mean",
+                           layout = "long"):
+    """
+    Read the data as DataFrames of batch_rows rows (the last one shorter), sorted by time
+
+    The response is read in chunks and parsed incrementally, so only about one batch is
+    held in memory at a time.
+    """
+    batch_rows = batch_rows or INFLUXDB_BATCH_ROWS
+    query = build_data_query(start_dt, stop_dt, location, bucket, measurement, channels, interval_sec, window_ms, window_fn,
+                             layout)
+    response = await _send_query(query, annotations=["datatype"])
+    try:
+        parser = AnnotatedCsvParser()
+        pending = []
+        num_pending = 0
+        async for chunk in response.aiter_bytes(INFLUXDB_CHUNK_SIZE):
+            # Parse in a thread, keeps the event loop responsive
+            for pl_df in await asyncio.to_thread(parser.feed, chunk):
+                pending.append(pl_df)
+                num_pending += len(pl_df)
+            while num_pending >= batch_rows:
+                pl_df = pl.concat(pending, how="diagonal_relaxed") if len(pending) > 1 else pending[0]
+                yield pl_df.slice(0, batch_rows)
+                pending = [pl_df.slice(batch_rows)]
+                num_pending -= batch_rows
+        if num_pending:
+            yield pl.concat(pending, how="diagonal_relaxed") if len(pending) > 1 else pending[0]
+    finally:
+        await response.aclose()
+
+def normalize_columns(pl_df: pl.DataFrame, columns: list) -> pl.DataFrame:
+    """
+    DataFrame with _time and exactly the columns in the given order, missing ones as null
+    """
+    return pl_df.select([pl.col("_time")] + [pl.col(column) if column in pl_df.columns
+                                             else pl.lit(None, dtype=pl.Float64).alias(column)
+                                             for column in columns])
+
+async def iter_data_frames_chunked(start_dt, stop_dt, location, bucket, measurement = "aggregated-data", channels = [],
+                                   interval_sec = None, columns = None, chunk_sec = 3600, concurrency = 4,
+                                   window_ms = None, window_fn = "mean", layout = "long"):
+    """
+    Read a long range as consecutive time chunks of chunk_sec seconds, sorted by time
+
+    Up to concurrency chunks are queried at the same time, each chunk is read completely
+    and its DataFrames are returned when all previous chunks are done, so at most
+    concurrency chunks are held in memory. With columns given, all DataFrames are
+    normalized to these columns (chunks of a range may not contain all fields). With
+    window_ms, the chunks are whole windows on the window grid, so no window is split.
+    """
+    chunk = datetime.timedelta(seconds=max(int(chunk_sec), 1))
+    epoch = None
+    if window_ms:
+        # aggregateWindow aligns the windows to the epoch, chunk bounds also on whole seconds
+        grid_ms = math.lcm(int(window_ms), 1000)
+        chunk = datetime.timedelta(milliseconds=math.ceil(chunk / datetime.timedelta(milliseconds=grid_ms)) * grid_ms)
+        epoch = datetime.datetime(1970, 1, 1, tzinfo=start_dt.tzinfo)
+    bounds = []
+    chunk_start = start_dt
+    while chunk_start < stop_dt:
+        chunk_stop = chunk_start + chunk if epoch is None else epoch + ((chunk_start - epoch) // chunk + 1) * chunk
+        bounds.append((chunk_start, min(chunk_stop, stop_dt)))
+        chunk_start = chunk_stop
+
+    async def read_chunk(chunk_start, chunk_stop) -> list[pl.DataFrame]:
+        return [pl_df async for pl_df in iter_data_frames(chunk_start, chunk_stop, location, bucket, measurement,
+                                                          channels, interval_sec, window_ms=window_ms,
+                                                          window_fn=window_fn, layout=layout)]
 
-def read_fields(bucket, measurement = "aggregated-data"):
+    running = collections.deque()
+    next_chunk = 0
+    try:
+        while next_chunk < len(bounds) or running:
+            while next_chunk < len(bounds) and len(running) < concurrency:
+                running.append(asyncio.create_task(read_chunk(*bounds[next_chunk])))
+                next_chunk += 1
+            for pl_df in await running.popleft():
+                yield normalize_columns(pl_df, columns) if columns is not None else pl_df
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+async def read_data_pl(start_dt, stop_dt, location, bucket, measurement = "aggregated-data", channels = [], interval_sec = None):
+    frames = [pl_df async for pl_df in iter_data_frames(start_dt, stop_dt, location, bucket, measurement,
+                                                        channels, interval_sec)]
+    if not frames:
+        return pl.DataFrame(schema={"_time": pl.Datetime("us", "UTC")})
+    return pl.concat(frames, how="diagonal_relaxed")
+
+async def read_fields(bucket, measurement = "aggregated-data"):
     query = f"""
     import "influxdata/influxdb/schema"
 
@@ -78,15 +345,9 @@ def read_fields(bucket, measurement = "aggregated-data"):
       measurement: "{measurement}"
     )
     """
-    response = requests.post(INFLUXDB_URL+"/api/v2/query", params={"org": INFLUXDB_ORG}, headers=headers, data=query)
-    pl_df = pl.read_csv(BytesIO(response.content))
-    pl_df = pl_df.drop(["", "result", "table"])
-    pl_df = pl_df.filter(pl.col("_value").is_not_null())
-    pl_df = pl_df.rename({"_value": "fields"})
+    return _parse_schema_pl(await run_query(query), "fields")
 
-    return pl_df.to_dict(as_series=False)
-
-def read_locations(bucket, measurement = "aggregated-data"):
+async def read_locations(bucket, measurement = "aggregated-data"):
     query = f"""
     import "influxdata/influxdb/schema"
 
@@ -96,15 +357,9 @@ def read_locations(bucket, measurement = "aggregated-data"):
       tag: "location_name"
     )
     """
-    response = requests.post(INFLUXDB_URL+"/api/v2/query", params={"org": INFLUXDB_ORG}, headers=headers, data=query)
-    pl_df = pl.read_csv(BytesIO(response.content))
-    pl_df = pl_df.drop(["", "result", "table"])
-    pl_df = pl_df.filter(pl.col("_value").is_not_null())
-    pl_df = pl_df.rename({"_value": "locations"})
+    return _parse_schema_pl(await run_query(query), "locations")
 
-    return pl_df.to_dict(as_series=False)
-
-def read_agg_intervals(bucket, measurement = "aggregated-data"):
+async def read_agg_intervals(bucket, measurement = "aggregated-data"):
     query = f"""
     import "influxdata/influxdb/schema"
 
@@ -114,18 +369,16 @@ def read_agg_intervals(bucket, measurement = "aggregated-data"):
       tag: "interval_sec"
     )
     """
-    response = requests.post(INFLUXDB_URL+"/api/v2/query", params={"org": INFLUXDB_ORG}, headers=headers, data=query)
-    pl_df = pl.read_csv(BytesIO(response.content))
-    pl_df = pl_df.drop(["", "result", "table"])
-    pl_df = pl_df.filter(pl.col("_value").is_not_null())
-    pl_df = pl_df.rename({"_value": "interval_sec"})
-
-    return pl_df.to_dict(as_series=False)
+    return _parse_schema_pl(await run_query(query), "interval_sec")
     
 if __name__ == "__main__":
     start_time = datetime.datetime(2025,11,23,0, tzinfo=datetime.UTC)
     stop_time = datetime.datetime(2025,11,24,0, tzinfo=datetime.UTC)
 
-    data = read_data_pl(start_time, stop_time, "DE/Berlin", "test", channels=["P1", "P2", "P3"])
-    fields = read_fields( "test", "aggregated-data")
-    print(fields)
\ No newline at end of file
+    async def main():
+        data = await read_data_pl(start_time, stop_time, "DE/Berlin", "test", channels=["P1", "P2", "P3"])
+        fields = await read_fields( "test", "aggregated-data")
+        print(fields)
+        await close_client()
+
+    asyncio.run(main())
\ No newline at end of file
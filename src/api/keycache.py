@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, UTC
+from typing import Callable
+
+import keydatabase
+from ttlcache import TtlCache
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class KeyInfo:
+    """
+    Cached columns of an active API key used by the endpoints
+    """
+    key_hash: str
+    owner: str
+    allowed_bucket_st: str
+    allowed_bucket_lt: str
+
+class TokenBucket:
+    """
+    Rate limiter of capacity requests, refilled continuously with refill_per_sec
+    """
+    def __init__(self, capacity: float, refill_per_sec: float, tokens: float | None = None):
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.tokens = capacity if tokens is None else tokens
+        self.updated_at = time.monotonic()
+
+    def acquire(self) -> float:
+        """
+        Take one token, returns 0 on success or the seconds until a token is available
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_sec)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.refill_per_sec
+
+class ApiKeyCache:
+    """
+    Process-local cache of the active API keys with token bucket rate limiting
+
+    Keys are reloaded from the key database after ttl seconds (in the background while the
+    cached entry is used for another max_stale seconds), so deactivated keys are rejected
+    after at most ttl + max_stale. Unknown keys are not cached. Every key may do
+    rate_limit_per_hour requests per hour. The requests are counted in memory and written
+    to the key database in batches by run_writeback(), which refreshes the buckets from the
+    counters of the key database shared by all API workers, so all workers together exceed
+    the limit at most by the requests of one writeback interval.
+    """
+    def __init__(self, rate_limit_per_hour: float, ttl: float = 60.0, max_stale: float = 60.0,
+                 load_key: Callable[[str], dict | None] = keydatabase.load_active_key,
+                 record_usage: Callable[..., dict] = keydatabase.record_usage):
+        self.rate_limit_per_hour = rate_limit_per_hour
+        self._keys = TtlCache(ttl, max_stale)
+        self._load_key = load_key
+        self._record_usage = record_usage
+        self._buckets = {}
+        self._usage = {}
+
+    async def lookup(self, api_key: str) -> KeyInfo | None:
+        key_info = await self._keys.get(api_key, lambda: self._load(api_key))
+        if key_info is None:
+            self._keys.invalidate(api_key)
+        return key_info
+
+    async def _load(self, api_key: str) -> KeyInfo | None:
+        row = await asyncio.to_thread(self._load_key, api_key)
+        if row is None:
+            return None
+        if api_key not in self._buckets:
+            # Start with the requests already counted in the database for the current hour
+            tokens = self._tokens_left(row.get("rate_limit_counter"), row.get("rate_limit_reseted_at"))
+            self._buckets[api_key] = TokenBucket(self.rate_limit_per_hour, self.rate_limit_per_hour / 3600, tokens)
+        return KeyInfo(key_hash=row["key_hash"], owner=row["owner"],
+                       allowed_bucket_st=row["allowed_bucket_st"], allowed_bucket_lt=row["allowed_bucket_lt"])
+
+    def _tokens_left(self, counter: int | None, reseted_at: datetime | None) -> float:
+        """
+        Requests left of the rate limit with counter requests of all workers since reseted_at
+        """
+        if reseted_at is None or reseted_at <= datetime.now(UTC).replace(tzinfo=None) - timedelta(hours=1):
+            return self.rate_limit_per_hour
+        return max(0.0, self.rate_limit_per_hour - (counter or 0))
+
+    def acquire(self, key_info: KeyInfo) -> float:
+        """
+        Count a request of the key, returns 0 if allowed or the seconds to wait
+        """
+        retry_after = self._buckets[key_info.key_hash].acquire()
+        if retry_after == 0:
+            num_requests, _ = self._usage.get(key_info.key_hash, (0, None))
+            self._usage[key_info.key_hash] = (num_requests + 1, datetime.now(UTC).replace(tzinfo=None))
+        return retry_after
+
+    async def flush(self):
+        """
+        Write the counted requests to the key database and refresh the buckets from its counters
+        """
+        if not self._usage and not self._buckets:
+            return
+        usage, self._usage = self._usage, {}
+        try:
+            counters = await asyncio.to_thread(self._record_usage, usage, list(self._buckets))
+        except Exception as e:
+            logger.warning(f"Writing API key usage failed: {str(e)}")
+            # Keep the counts for the next write
+            for key_hash, (num_requests, last_used) in usage.items():
+                pending, pending_last_used = self._usage.get(key_hash, (0, last_used))
+                self._usage[key_hash] = (pending + num_requests, max(last_used, pending_last_used))
+            return
+        for key_hash, (counter, reseted_at) in counters.items():
+            if key_hash not in self._buckets:
+                continue
+            # Requests allowed meanwhile are not written yet
+            pending, _ = self._usage.get(key_hash, (0, None))
+            bucket = self._buckets[key_hash]
+            bucket.tokens = max(0.0, self._tokens_left(counter, reseted_at) - pending)
+            bucket.updated_at = time.monotonic()
+
+    async def run_writeback(self, interval: float):
+        """
+        Write the usage every interval seconds until cancelled, then a last time
+        """
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.flush()
+        finally:
+            await self.flush()
+
+    async def close(self):
+        await self._keys.close()
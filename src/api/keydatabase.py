@@ -1,4 +1,6 @@
-from sqlalchemy import create_engine, Column, String, Boolean, Integer, DateTime, func
+from datetime import datetime, timedelta, UTC
+
+from sqlalchemy import create_engine, event, case, or_, select, update, Column, String, Boolean, Integer, DateTime, func
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -9,6 +11,14 @@ engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL: readers of several API workers don't block on the usage writes
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -28,4 +38,35 @@ class ApiKey(Base):
     rate_limit_reseted_at = Column(DateTime, nullable=True)
 
 def create_db_tables():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+
+def load_active_key(key_hash: str) -> dict | None:
+    """
+    Columns of the active key or None
+    """
+    with engine.connect() as connection:
+        row = connection.execute(select(ApiKey.__table__).where(ApiKey.key_hash == key_hash,
+                                                                 ApiKey.is_active == True)).mappings().first()
+    return dict(row) if row else None
+
+def record_usage(usage: dict, key_hashes=()) -> dict:
+    """
+    Add the requests of several keys {key_hash: (num_requests, last_used)} in one transaction
+
+    The counters are incremented in SQL (atomic with other API workers) and restarted
+    when the counting hour since rate_limit_reseted_at is over. Times are naive UTC.
+    Returns the counters {key_hash: (rate_limit_counter, rate_limit_reseted_at)} of the
+    keys in usage and key_hashes including the requests of all workers.
+    """
+    now = datetime.now(UTC).replace(tzinfo=None)
+    with engine.begin() as connection:
+        for key_hash, (num_requests, last_used) in usage.items():
+            expired = or_(ApiKey.rate_limit_reseted_at.is_(None),
+                          ApiKey.rate_limit_reseted_at < now - timedelta(hours=1))
+            connection.execute(update(ApiKey).where(ApiKey.key_hash == key_hash).values(
+                rate_limit_counter=case((expired, num_requests), else_=ApiKey.rate_limit_counter + num_requests),
+                rate_limit_reseted_at=case((expired, now), else_=ApiKey.rate_limit_reseted_at),
+                last_used=last_used))
+        rows = connection.execute(select(ApiKey.key_hash, ApiKey.rate_limit_counter, ApiKey.rate_limit_reseted_at)
+                                  .where(ApiKey.key_hash.in_(set(usage) | set(key_hashes))))
+        return {key_hash: (counter, reseted_at) for key_hash, counter, reseted_at in rows}
@@ -1,20 +1,27 @@
-from datetime import datetime, timedelta, timezone, UTC
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from datetime import datetime, timedelta, UTC
 import logging
+import math
 import os
+import time
 
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, Header, HTTPException, status
 from fastapi.security import APIKeyHeader
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
+from typing import Literal
 
-from sqlalchemy import func
-from sqlalchemy.orm import Session
-from keydatabase import SessionLocal, ApiKey
-
-import polars as pl
-from io import BytesIO
-
+import archiveclient
 import influx2client
+import datastream
+import downsampling
+from exportjobs import ExportManager, QueueFullError, is_job_owner, iter_file_range, parse_range
+from keycache import ApiKeyCache, KeyInfo
+import recentbufferclient
+from resultcache import ResultCache, etag_matches
+from ttlcache import TtlCache
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -28,29 +35,90 @@ if app_env == "development":
 
 INFLUXDB_BUCKET_ST = os.getenv("PQOPEN_INFLUXDB_BUCKET_ST", "short_term")
 INFLUXDB_BUCKET_LT = os.getenv("PQOPEN_INFLUXDB_BUCKET_LT", "long_term")
+# Elements per query chunk, requests above are split into time chunks queried concurrently
 MAX_ELEMENTS = int(os.getenv("PQOPEN_API_MAX_REQUEST_ELEMENTS", 1_000_000))
+MAX_TOTAL_ELEMENTS = int(os.getenv("PQOPEN_API_MAX_TOTAL_ELEMENTS", 500_000_000))
+QUERY_CONCURRENCY = int(os.getenv("PQOPEN_API_QUERY_CONCURRENCY", 4))
+QUERY_MEMORY_BUDGET = int(os.getenv("PQOPEN_API_QUERY_MEMORY_BUDGET", 512 * 1024 * 1024))
+# Estimated memory of one element while a chunk is read and held (bytes)
+ELEMENT_BYTES = 32
+# Rate limit of every key, shared by all API workers through the key database
 RATE_LIMIT_PER_HOUR = int(os.getenv("PQOPEN_API_RATE_LIMIT_PER_HOUR", 50))
+# API keys are reloaded from the key database after the TTL, usage is written back periodically
+KEY_CACHE_TTL_SEC = float(os.getenv("PQOPEN_API_KEY_CACHE_TTL_SEC", 60))
+KEY_USAGE_WRITEBACK_SEC = float(os.getenv("PQOPEN_API_KEY_USAGE_WRITEBACK_SEC", 10))
+DEFAULT_INTERVAL_SEC = 600
+# Cache of data responses of ranges ending more than SETTLED_SEC ago (empty path disables),
+# SETTLED_SEC must exceed the maximum replay lag of the ingest spool (longest expected
+# database outage), entries are dropped after MAX_AGE_SEC in case data arrived even later
+RESULT_CACHE_PATH = os.getenv("PQOPEN_API_CACHE_PATH", "")
+RESULT_CACHE_MAX_BYTES = int(os.getenv("PQOPEN_API_CACHE_MAX_BYTES", 1 << 30))
+RESULT_CACHE_SETTLED_SEC = float(os.getenv("PQOPEN_API_CACHE_SETTLED_SEC", 3600))
+RESULT_CACHE_MAX_AGE_SEC = float(os.getenv("PQOPEN_API_CACHE_MAX_AGE_SEC", 86400))
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Export jobs written to files by background workers (empty path disables), deleted after max age
+EXPORT_PATH = os.getenv("PQOPEN_API_EXPORT_PATH", "")
+EXPORT_WORKERS = int(os.getenv("PQOPEN_API_EXPORT_WORKERS", 2))
+EXPORT_MAX_QUEUED = int(os.getenv("PQOPEN_API_EXPORT_MAX_QUEUED", 20))
+EXPORT_MAX_AGE_SEC = float(os.getenv("PQOPEN_API_EXPORT_MAX_AGE_SEC", 86400))
+EXPORT_MAX_BYTES = int(os.getenv("PQOPEN_API_EXPORT_MAX_BYTES", 10 << 30))
+EXPORT_MAX_ELEMENTS = int(os.getenv("PQOPEN_API_EXPORT_MAX_ELEMENTS", 5_000_000_000))
+# Exports query one chunk at a time, so interactive requests get the database connections
+EXPORT_QUERY_CONCURRENCY = int(os.getenv("PQOPEN_API_EXPORT_QUERY_CONCURRENCY", 1))
+EXPORT_GC_INTERVAL_SEC = 60
+
+# Schema metadata (fields, locations, intervals) is reloaded in the background after the TTL
+METADATA_TTL_SEC = float(os.getenv("PQOPEN_API_METADATA_TTL_SEC", 300))
+METADATA_MAX_STALE_SEC = float(os.getenv("PQOPEN_API_METADATA_MAX_STALE_SEC", 3600))
 
-class AggDataRequest(BaseModel):
+result_cache = ResultCache(RESULT_CACHE_PATH, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_SETTLED_SEC,
+                           RESULT_CACHE_MAX_AGE_SEC) if RESULT_CACHE_PATH else None
+metadata_cache = TtlCache(METADATA_TTL_SEC, METADATA_MAX_STALE_SEC)
+# Unfinished exports of other API workers are failed without heartbeat for several cleanup intervals
+export_manager = ExportManager(EXPORT_PATH, EXPORT_WORKERS, EXPORT_MAX_QUEUED, EXPORT_MAX_AGE_SEC,
+                               EXPORT_MAX_BYTES, stale_sec=5 * EXPORT_GC_INTERVAL_SEC) if EXPORT_PATH else None
+api_keys = ApiKeyCache(RATE_LIMIT_PER_HOUR, ttl=KEY_CACHE_TTL_SEC, max_stale=KEY_CACHE_TTL_SEC)
+
+class OutputRequest(BaseModel):
+    """
+    Output file options of the data requests
+    """
+    format: Literal["parquet", "arrow", "csv"] = "parquet"
+    compression: Literal["zstd", "lz4", "none"] = "zstd"
+    compression_level: int | None = Field(
+        default=None,
+        ge=1,
+        le=22,
+        description="Compression level (zstd 1-22, lz4 1-12), codec default if not set."
+    )
+    float32: bool = False
+    time_unit: Literal["s", "ms", "us", "ns"] = "us"
+
+class DownsamplingRequest(BaseModel):
+    """
+    Downsampling of the data requests for plotting
+    """
+    max_points: int | None = Field(
+        default=None,
+        ge=3,
+        le=20_000,
+        description="Maximum number of points per field, all points if not set."
+    )
+    downsampling: Literal["mean", "min", "max", "lttb"] = "mean"
+
+class AggDataRequest(OutputRequest, DownsamplingRequest):
     range_start: datetime = datetime.now(tz=UTC) - timedelta(hours=1)
     range_stop: datetime = datetime.now(tz=UTC)
     location: str
-    interval_sec: int = Field(
-        default=600, 
+    interval_sec: int | None = Field(
+        default=None,
         ge=1,     # greater than or equal (>= 1)
         le=600,    # less than or equal (<= 600)
-        description="Aggregation-Intervall in Seconds (1-600)."
+        description="Aggregation-Intervall in Seconds (1-600), with max_points the coarsest sufficient interval if not set, else 600."
     )
     fields: list[str] = []
 
-class CbcDataRequest(BaseModel):
+class CbcDataRequest(OutputRequest, DownsamplingRequest):
     """
     Data Model for Cycle-by-Cycle data request
     """
@@ -59,109 +127,215 @@ class CbcDataRequest(BaseModel):
     location: str
     fields: list[str] = []
 
+class BatchDataRequest(OutputRequest):
+    """
+    Data Model for the data of several locations in one table
+    """
+    family: Literal["cbc", "aggregated"] = "cbc"
+    range_start: datetime = datetime.now(tz=UTC) - timedelta(hours=1)
+    range_stop: datetime = datetime.now(tz=UTC)
+    locations: list[str] | Literal["all"] = Field(
+        default="all",
+        description="Locations to read, all locations of the data family if 'all'."
+    )
+    interval_sec: int | None = Field(
+        default=None,
+        ge=1,
+        le=600,
+        description="Aggregation-Intervall in Seconds (1-600) of the aggregated family, 600 if not set."
+    )
+    fields: list[str] = []
+    layout: Literal["long", "wide"] = Field(
+        default="long",
+        description="'long': one row per timestamp and location (column location_name), 'wide': one row per timestamp with columns <location>_<field>."
+    )
 
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    background_tasks = [asyncio.create_task(api_keys.run_writeback(KEY_USAGE_WRITEBACK_SEC))]
+    if export_manager is not None:
+        export_manager.start()
+        background_tasks.append(asyncio.create_task(export_manager.run_gc(EXPORT_GC_INTERVAL_SEC)))
+    yield
+    # Write the last key usage, stop exports and metadata refreshes and close the pooled InfluxDB connections
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    if export_manager is not None:
+        await export_manager.close()
+    await api_keys.close()
+    await metadata_cache.close()
+    await influx2client.close_client()
+
+app = FastAPI(lifespan=lifespan)
 
-def get_api_key(api_key: str = Depends(api_key_header), 
-                db: Session = Depends(get_db)):
+async def check_api_key(api_key: str = Depends(api_key_header)) -> KeyInfo:
     """
-    Check API Key and return api key object or error
+    Check API Key without rate limit (polling and downloads of exports), return the cached key info or error
     """
     if api_key is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Missing API-Key in Header 'X-API-Key'."
         )
-        
-    # Search Database for Key
-    key_record = db.query(ApiKey).filter(
-        ApiKey.key_hash == api_key,
-        ApiKey.is_active == True 
-    ).first()
-
-    if key_record:
-        seconds_since_limit_reset = (datetime.now(timezone.utc).replace(tzinfo=None) - key_record.rate_limit_reseted_at).total_seconds()
-        if key_record.rate_limit_counter < RATE_LIMIT_PER_HOUR:
-            # Success, write last_used entry in database
-            key_record.last_used = func.now()
-            key_record.rate_limit_counter += 1
-            db.commit()
-        elif seconds_since_limit_reset > 3600:
-            key_record.last_used = func.now()
-            key_record.rate_limit_counter = 0
-            key_record.rate_limit_reseted_at = func.now()
-            db.commit()
-        else:
-            # Rate Limit Exceeded
-            raise HTTPException(
-            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail=f"Rate limit exceeded for Api-Key. Will be reseted at {(key_record.rate_limit_reseted_at+timedelta(hours=1)).strftime('%H:%M')} UTC"
-        )    
-        return key_record
-
-
-    else:
+    # Cached key, the database is only read on a cache miss
+    key_info = await api_keys.lookup(api_key)
+    if key_info is None:
         # Invalid or inactive Key
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Invalid or inactive API-Key."
         )
-    
-def parquet_stream_generator(df: pl.DataFrame):
+    return key_info
+
+async def get_api_key(key_info: KeyInfo = Depends(check_api_key)) -> KeyInfo:
     """
-    Generate in-memory stream object for parquet file
+    Check API Key and rate limit, return the cached key info or error
     """
-    parquet_buffer = BytesIO()
-    df.write_parquet(parquet_buffer)
-    parquet_buffer.seek(0)
-    yield parquet_buffer.read()
+    retry_after = api_keys.acquire(key_info)
+    if retry_after > 0:
+        # Rate Limit Exceeded
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Rate limit exceeded for Api-Key. Next request allowed in {math.ceil(retry_after):d} s.",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+    return key_info
+
+def query_chunk_sec(duration_sec: float, num_elements: float) -> int:
+    """
+    Duration of the query chunks, sized so QUERY_CONCURRENCY chunks fit into the memory budget
+    """
+    chunk_elements = min(MAX_ELEMENTS, QUERY_MEMORY_BUDGET // (QUERY_CONCURRENCY * ELEMENT_BYTES))
+    if num_elements <= chunk_elements:
+        return max(math.ceil(duration_sec), 1)
+    return max(int(duration_sec * chunk_elements / num_elements), 1)
+
+def select_interval_sec(agg_intervals: list, duration_sec: float, max_points: int | None) -> int:
+    """
+    Coarsest available aggregation interval still giving max_points points (else the finest)
+    """
+    intervals = sorted(int(interval_sec) for interval_sec in agg_intervals)
+    if max_points is None or not intervals:
+        return DEFAULT_INTERVAL_SEC
+    sufficient = [interval_sec for interval_sec in intervals if duration_sec / interval_sec >= max_points]
+    return sufficient[-1] if sufficient else intervals[0]
+
+def get_window_ms(data_request: DownsamplingRequest, duration_sec: float, num_points: float) -> int | None:
+    """
+    Window of the window downsampling modes, None if no window aggregation is needed
+    """
+    if data_request.max_points is None or data_request.downsampling == "lttb" or num_points <= data_request.max_points:
+        return None
+    return downsampling.window_ms(duration_sec, data_request.max_points)
+
+def get_output_options(data_request: OutputRequest) -> datastream.OutputOptions:
+    """
+    Output options of the request or error on unsupported combinations
+    """
+    try:
+        return datastream.OutputOptions(format=data_request.format,
+                                        compression=data_request.compression,
+                                        compression_level=data_request.compression_level,
+                                        float32=data_request.float32,
+                                        time_unit=data_request.time_unit)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid output options: {str(e)}"
+        )
+
+def get_cache_key(data_request: AggDataRequest | CbcDataRequest, bucket: str, measurement: str, interval_sec: int | None,
+                  output_options: datastream.OutputOptions) -> str | None:
+    """
+    Result cache key of the request, None if not cacheable
+    """
+    if result_cache is None or not result_cache.is_settled(data_request.range_stop):
+        return None
+    return result_cache.make_key(bucket, measurement, data_request.location, data_request.fields, interval_sec,
+                                 data_request.range_start, data_request.range_stop,
+                                 {**asdict(output_options), "max_points": data_request.max_points,
+                                  "downsampling": data_request.downsampling})
+
+def cached_response(cache_key: str | None, if_none_match: str | None, output_options: datastream.OutputOptions,
+                    file_name: str) -> Response | None:
+    """
+    Not Modified or the cached file, None if the data has to be read
+    """
+    if cache_key is None:
+        return None
+    entry = result_cache.open(cache_key)
+    if entry is None:
+        return None
+    entry_file, created = entry
+    etag = ResultCache.etag(cache_key, created)
+    if etag_matches(if_none_match, etag):
+        entry_file.close()
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return StreamingResponse(
+        result_cache.iter_file(entry_file),
+        media_type=output_options.media_type,
+        headers={
+            "Content-Disposition": f"attachment; filename={file_name}",
+            "Content-Length": str(os.fstat(entry_file.fileno()).st_size),
+            "ETag": etag
+        }
+    )
+
+def data_response(data_stream, cache_key: str | None, output_options: datastream.OutputOptions,
+                  file_name: str) -> StreamingResponse:
+    headers = {"Content-Disposition": f"attachment; filename={file_name}"}
+    if cache_key is not None:
+        created = time.time()
+        data_stream = result_cache.store_stream(cache_key, data_stream, created)
+        headers["ETag"] = ResultCache.etag(cache_key, created)
+    return StreamingResponse(data_stream, media_type=output_options.media_type, headers=headers)
 
 @app.get("/v1/meta/locations/{family}")
-def read_locations(family: str, auth_data: ApiKey = Depends(get_api_key)):
+async def read_locations(family: str, auth_data: KeyInfo = Depends(get_api_key)):
     if family == "cbc":
-        locations = influx2client.read_locations(bucket=auth_data.allowed_bucket_st,
-                                                 measurement="cycle-by-cycle")
+        bucket, measurement = auth_data.allowed_bucket_st, "cycle-by-cycle"
     elif family == "aggregated":
-        locations = influx2client.read_locations(bucket=auth_data.allowed_bucket_lt,
-                                                 measurement="aggregated-data")
+        bucket, measurement = auth_data.allowed_bucket_lt, "aggregated-data"
     else:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Data family of ['cbc', 'aggregated'] allowed. Requested: {family}."
         )
+    locations = await metadata_cache.get(("locations", bucket, measurement),
+                                         lambda: influx2client.read_locations(bucket=bucket, measurement=measurement))
     return locations
 
 @app.get("/v1/meta/fields/{family}")
-def read_fields(family: str, auth_data: ApiKey = Depends(get_api_key)):
+async def read_fields(family: str, auth_data: KeyInfo = Depends(get_api_key)):
     if family == "cbc":
-        fields = influx2client.read_fields(auth_data.allowed_bucket_st, measurement="cycle-by-cycle")
+        bucket, measurement = auth_data.allowed_bucket_st, "cycle-by-cycle"
     elif family == "aggregated":
-        fields = influx2client.read_fields(auth_data.allowed_bucket_lt, measurement="aggregated-data")
+        bucket, measurement = auth_data.allowed_bucket_lt, "aggregated-data"
     else:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Data family of ['cbc', 'aggregated'] allowed. Requested: {family}."
         )
+    fields = await metadata_cache.get(("fields", bucket, measurement),
+                                      lambda: influx2client.read_fields(bucket, measurement=measurement))
     return fields
 
 @app.get("/v1/meta/aggintervals")
-def read_intervals(auth_data: ApiKey = Depends(get_api_key)):
-    agg_intervals = influx2client.read_agg_intervals(auth_data.allowed_bucket_lt, measurement="aggregated-data")
+async def read_intervals(auth_data: KeyInfo = Depends(get_api_key)):
+    bucket = auth_data.allowed_bucket_lt
+    agg_intervals = await metadata_cache.get(("agg_intervals", bucket, "aggregated-data"),
+                                             lambda: influx2client.read_agg_intervals(bucket, measurement="aggregated-data"))
     return agg_intervals
 
-# Read aggregated data with fixed aggregation interval
-@app.post("/v1/data/aggregated")
-def read_aggregated_data(data_request: AggDataRequest, auth_data: ApiKey = Depends(get_api_key)):
-    duration = data_request.range_stop - data_request.range_start
-    num_fields = len(data_request.fields) if data_request.fields else len(read_fields(family="aggregated", auth_data=auth_data)["fields"])
-    num_elements = (duration.total_seconds() * num_fields) / data_request.interval_sec
-    if num_elements > MAX_ELEMENTS:
+def check_num_elements(num_elements: float, max_elements: int):
+    if num_elements > max_elements:
         # Errror on max number of elements are exceeded (HTTP 400 Bad Request)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"The data range is too big. Maximum 1 Mio elements allowed ({MAX_ELEMENTS:d}). Requested: {num_elements}."
+            detail=f"The data range is too big. Maximum {max_elements:d} elements allowed. Requested: {num_elements}."
         )
     if num_elements < 0:
         # Check negative time range
@@ -169,54 +343,284 @@ def read_aggregated_data(data_request: AggDataRequest, auth_data: ApiKey = Depen
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Requested a negative number of elements"
         )
-    df = influx2client.read_data_pl(start_dt=data_request.range_start,
-                                      stop_dt=data_request.range_stop,
-                                      location=data_request.location,
-                                      bucket=auth_data.allowed_bucket_lt,
-                                      measurement="aggregated-data",
-                                      channels=data_request.fields,
-                                      interval_sec=data_request.interval_sec)
-    parquet_stream = parquet_stream_generator(df)
-    return StreamingResponse(
-        parquet_stream,
-        media_type="application/octet-stream",
-        headers={
-            "Content-Disposition": f"attachment; filename=agg_{data_request.range_start.strftime('%Y%m%dT%H%M%S')}_{data_request.range_stop.strftime('%Y%m%dT%H%M%S')}.parquet"
-        }
-    )
+
+async def get_agg_interval_sec(data_request: AggDataRequest, auth_data: KeyInfo) -> int:
+    if data_request.interval_sec is not None:
+        return data_request.interval_sec
+    duration = data_request.range_stop - data_request.range_start
+    agg_intervals = await read_intervals(auth_data=auth_data)
+    return select_interval_sec(agg_intervals["interval_sec"], duration.total_seconds(), data_request.max_points)
+
+async def get_agg_frames(data_request: AggDataRequest, auth_data: KeyInfo, interval_sec: int, max_elements: int,
+                         concurrency: int):
+    """
+    Check the size of the aggregated data request and return its (not yet started) DataFrame batches
+    """
+    duration = data_request.range_stop - data_request.range_start
+    fields = data_request.fields or (await read_fields(family="aggregated", auth_data=auth_data))["fields"]
+    num_points = duration.total_seconds() / interval_sec
+    window_ms = get_window_ms(data_request, duration.total_seconds(), num_points)
+    num_elements = num_points * len(fields)
+    check_num_elements(data_request.max_points * len(fields) if window_ms is not None else num_elements, max_elements)
+    # Large ranges in time chunks sized by the raw data (window aggregations too, on the
+    # window grid), all chunks with the same columns
+    chunk_sec = query_chunk_sec(duration.total_seconds(), num_elements)
+    frames = influx2client.iter_data_frames_chunked(start_dt=data_request.range_start,
+                                                    stop_dt=data_request.range_stop,
+                                                    location=data_request.location,
+                                                    bucket=auth_data.allowed_bucket_lt,
+                                                    measurement="aggregated-data",
+                                                    channels=data_request.fields,
+                                                    interval_sec=interval_sec,
+                                                    columns=fields if chunk_sec < duration.total_seconds() else None,
+                                                    chunk_sec=chunk_sec,
+                                                    concurrency=concurrency,
+                                                    window_ms=window_ms,
+                                                    window_fn=data_request.downsampling)
+    if data_request.max_points is not None and data_request.downsampling == "lttb" and num_points > data_request.max_points:
+        frames = downsampling.iter_lttb(frames, data_request.max_points, influx2client.INFLUXDB_BATCH_ROWS)
+    return frames
+
+async def iter_cbc_frames(data_request: CbcDataRequest, auth_data: KeyInfo, fields: list, num_elements: float,
+                          window_ms: int | None, concurrency: int):
+    duration = data_request.range_stop - data_request.range_start
+    # Read recent data from the ingest ring buffers, data not fully covered from influxdb
+    df = await recentbufferclient.read_data_pl(start_dt=data_request.range_start,
+                                               stop_dt=data_request.range_stop,
+                                               location=data_request.location,
+                                               bucket=auth_data.allowed_bucket_st,
+                                               channels=data_request.fields)
+    if df is None:
+        chunk_sec = query_chunk_sec(duration.total_seconds(), num_elements)
+        # Archived days from the local parquet files, the rest from influxdb
+        frames = archiveclient.iter_data_frames_tiered(start_dt=data_request.range_start,
+                                                       stop_dt=data_request.range_stop,
+                                                       location=data_request.location,
+                                                       bucket=auth_data.allowed_bucket_st,
+                                                       measurement="cycle-by-cycle",
+                                                       channels=data_request.fields,
+                                                       columns=fields if chunk_sec < duration.total_seconds() else None,
+                                                       chunk_sec=chunk_sec,
+                                                       concurrency=concurrency,
+                                                       window_ms=window_ms,
+                                                       window_fn=data_request.downsampling)
+    else:
+        if window_ms is not None:
+            df = downsampling.window_pl(df, window_ms, data_request.downsampling)
+        frames = datastream.iter_slices(df, influx2client.INFLUXDB_BATCH_ROWS)
+    async for pl_df in frames:
+        yield pl_df
+
+async def get_cbc_frames(data_request: CbcDataRequest, auth_data: KeyInfo, max_elements: int, concurrency: int):
+    """
+    Check the size of the cycle-by-cycle data request and return its (not yet started) DataFrame batches
+    """
+    duration = data_request.range_stop - data_request.range_start
+    fields = data_request.fields or (await read_fields(family="cbc", auth_data=auth_data))["fields"]
+    num_points = duration.total_seconds() * 50
+    window_ms = get_window_ms(data_request, duration.total_seconds(), num_points)
+    num_elements = num_points * len(fields)
+    check_num_elements(data_request.max_points * len(fields) if window_ms is not None else num_elements, max_elements)
+    frames = iter_cbc_frames(data_request, auth_data, fields, num_elements, window_ms, concurrency)
+    if data_request.max_points is not None and data_request.downsampling == "lttb" and num_points > data_request.max_points:
+        frames = downsampling.iter_lttb(frames, data_request.max_points, influx2client.INFLUXDB_BATCH_ROWS)
+    return frames
+
+def data_file_name(prefix: str, data_request: AggDataRequest | CbcDataRequest,
+                   output_options: datastream.OutputOptions) -> str:
+    return output_options.file_name(f"{prefix}_{data_request.range_start.strftime('%Y%m%dT%H%M%S')}_{data_request.range_stop.strftime('%Y%m%dT%H%M%S')}")
+
+# Read aggregated data with fixed (or automatically selected) aggregation interval
+@app.post("/v1/data/aggregated")
+async def read_aggregated_data(data_request: AggDataRequest, auth_data: KeyInfo = Depends(get_api_key),
+                               if_none_match: str | None = Header(default=None)):
+    output_options = get_output_options(data_request)
+    interval_sec = await get_agg_interval_sec(data_request, auth_data)
+    file_name = data_file_name("agg", data_request, output_options)
+    # Settled ranges from the result cache without querying the database
+    cache_key = get_cache_key(data_request, auth_data.allowed_bucket_lt, "aggregated-data",
+                              interval_sec, output_options)
+    response = cached_response(cache_key, if_none_match, output_options, file_name)
+    if response is not None:
+        return response
+    frames = await get_agg_frames(data_request, auth_data, interval_sec, MAX_TOTAL_ELEMENTS, QUERY_CONCURRENCY)
+    # Stream the file batch by batch while reading the data
+    data_stream = await datastream.open_data_stream(frames, output_options)
+    return data_response(data_stream, cache_key, output_options, file_name)
 
 # Read cycle-by-cycle raw data
 @app.post("/v1/data/cbc")
-def read_cbc_data(data_request: CbcDataRequest, auth_data: ApiKey = Depends(get_api_key)):
+async def read_cbc_data(data_request: CbcDataRequest, auth_data: KeyInfo = Depends(get_api_key),
+                        if_none_match: str | None = Header(default=None)):
+    output_options = get_output_options(data_request)
+    file_name = data_file_name("cbc", data_request, output_options)
+    cache_key = get_cache_key(data_request, auth_data.allowed_bucket_st, "cycle-by-cycle", None, output_options)
+    response = cached_response(cache_key, if_none_match, output_options, file_name)
+    if response is not None:
+        return response
+    frames = await get_cbc_frames(data_request, auth_data, MAX_TOTAL_ELEMENTS, QUERY_CONCURRENCY)
+    # Create file stream object
+    data_stream = await datastream.open_data_stream(frames, output_options)
+    # Return Stream Object
+    return data_response(data_stream, cache_key, output_options, file_name)
+
+# Read several locations with one query, as one table with a location column or aligned on _time
+@app.post("/v1/data/batch")
+async def read_batch_data(data_request: BatchDataRequest, auth_data: KeyInfo = Depends(get_api_key),
+                          if_none_match: str | None = Header(default=None)):
+    output_options = get_output_options(data_request)
+    if data_request.family == "cbc":
+        bucket, measurement, interval_sec = auth_data.allowed_bucket_st, "cycle-by-cycle", None
+    else:
+        bucket, measurement = auth_data.allowed_bucket_lt, "aggregated-data"
+        interval_sec = data_request.interval_sec or DEFAULT_INTERVAL_SEC
+    allowed_locations = (await read_locations(family=data_request.family, auth_data=auth_data))["locations"]
+    if data_request.locations == "all":
+        locations = sorted(allowed_locations)
+    else:
+        locations = list(dict.fromkeys(data_request.locations))
+        unknown_locations = [location for location in locations if location not in allowed_locations]
+        if unknown_locations or not locations:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown locations: {unknown_locations}." if unknown_locations else "No locations requested."
+            )
+    file_name = data_file_name(f"batch_{data_request.family}", data_request, output_options)
+    cache_key = None
+    if result_cache is not None and result_cache.is_settled(data_request.range_stop):
+        cache_key = result_cache.make_key(bucket, measurement, ",".join(locations), data_request.fields, interval_sec,
+                                          data_request.range_start, data_request.range_stop,
+                                          {**asdict(output_options), "layout": data_request.layout})
+    response = cached_response(cache_key, if_none_match, output_options, file_name)
+    if response is not None:
+        return response
     duration = data_request.range_stop - data_request.range_start
-    num_fields = len(data_request.fields) if data_request.fields else len(read_fields(family="cbc", auth_data=auth_data)["fields"])
-    num_elements = (duration.total_seconds() * 50 * num_fields)
-    if num_elements > MAX_ELEMENTS:
+    fields = data_request.fields or (await read_fields(family=data_request.family, auth_data=auth_data))["fields"]
+    num_points = duration.total_seconds() / interval_sec if interval_sec else duration.total_seconds() * 50
+    num_elements = num_points * len(fields) * len(locations)
+    check_num_elements(num_elements, MAX_TOTAL_ELEMENTS)
+    # All chunks with the same columns, locations or fields without data as null
+    if data_request.layout == "wide":
+        columns = [f"{location}_{field}" for location in locations for field in fields]
+    else:
+        columns = ["location_name"] + fields
+    frames = influx2client.iter_data_frames_chunked(start_dt=data_request.range_start,
+                                                    stop_dt=data_request.range_stop,
+                                                    location=locations,
+                                                    bucket=bucket,
+                                                    measurement=measurement,
+                                                    channels=data_request.fields,
+                                                    interval_sec=interval_sec,
+                                                    columns=columns,
+                                                    chunk_sec=query_chunk_sec(duration.total_seconds(), num_elements),
+                                                    concurrency=QUERY_CONCURRENCY,
+                                                    layout=data_request.layout)
+    data_stream = await datastream.open_data_stream(frames, output_options)
+    return data_response(data_stream, cache_key, output_options, file_name)
+
+def submit_export(frames, data_request: AggDataRequest | CbcDataRequest, auth_data: KeyInfo,
+                  output_options: datastream.OutputOptions, file_name: str, response: Response) -> dict:
+    try:
+        job = export_manager.submit(auth_data.key_hash, frames, output_options, file_name,
+                                    data_request.range_start, data_request.range_stop)
+    except QueueFullError as e:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"The data range is too big. Maximum 1 Mio elements allowed ({MAX_ELEMENTS:d}). Requested: {num_elements}."
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Too many exports queued ({str(e)}), try again later.",
+            headers={"Retry-After": str(EXPORT_GC_INTERVAL_SEC)}
         )
-    if num_elements < 0:
-        # Check negative time range
+    response.headers["Location"] = f"/v1/exports/{job.job_id}"
+    return export_manager.status(job)
+
+def get_export_manager() -> ExportManager:
+    if export_manager is None:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Requested a negative number of elements"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Exports are not enabled."
         )
-    # Read data from influxdb
-    df = influx2client.read_data_pl(start_dt=data_request.range_start,
-                                      stop_dt=data_request.range_stop,
-                                      location=data_request.location,
-                                      bucket=auth_data.allowed_bucket_st,
-                                      measurement="cycle-by-cycle",
-                                      channels=data_request.fields)
-    # Create parquet stream object
-    parquet_stream = parquet_stream_generator(df)
-    # Return Stream Object
-    return StreamingResponse(
-        parquet_stream,
-        media_type="application/octet-stream", # Standard für Binärdateien
-        headers={
-            "Content-Disposition": f"attachment; filename=cbc_{data_request.range_start.strftime('%Y%m%dT%H%M%S')}_{data_request.range_stop.strftime('%Y%m%dT%H%M%S')}.parquet"
-        }
-    )
+    return export_manager
+
+def get_export_job(job_id: str, auth_data: KeyInfo):
+    """
+    Job of the API key or error
+    """
+    job = get_export_manager().get(job_id)
+    if job is None or not is_job_owner(job, auth_data.key_hash):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Export {job_id} not found."
+        )
+    return job
+
+# Export aggregated data to a file in the background (no result cache, larger size limit)
+@app.post("/v1/exports/aggregated", status_code=status.HTTP_202_ACCEPTED)
+async def export_aggregated_data(data_request: AggDataRequest, response: Response,
+                                 auth_data: KeyInfo = Depends(get_api_key)):
+    get_export_manager()
+    output_options = get_output_options(data_request)
+    interval_sec = await get_agg_interval_sec(data_request, auth_data)
+    frames = await get_agg_frames(data_request, auth_data, interval_sec, EXPORT_MAX_ELEMENTS, EXPORT_QUERY_CONCURRENCY)
+    return submit_export(frames, data_request, auth_data, output_options,
+                         data_file_name("agg", data_request, output_options), response)
+
+# Export cycle-by-cycle data to a file in the background
+@app.post("/v1/exports/cbc", status_code=status.HTTP_202_ACCEPTED)
+async def export_cbc_data(data_request: CbcDataRequest, response: Response,
+                          auth_data: KeyInfo = Depends(get_api_key)):
+    get_export_manager()
+    output_options = get_output_options(data_request)
+    frames = await get_cbc_frames(data_request, auth_data, EXPORT_MAX_ELEMENTS, EXPORT_QUERY_CONCURRENCY)
+    return submit_export(frames, data_request, auth_data, output_options,
+                         data_file_name("cbc", data_request, output_options), response)
+
+@app.get("/v1/exports/{job_id}")
+async def read_export(job_id: str, auth_data: KeyInfo = Depends(check_api_key)):
+    job = get_export_job(job_id, auth_data)
+    return export_manager.status(job)
 
+@app.delete("/v1/exports/{job_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_export(job_id: str, auth_data: KeyInfo = Depends(check_api_key)):
+    job = get_export_job(job_id, auth_data)
+    export_manager.delete(job.job_id)
+
+# Download the file of a finished export, resumable with Range requests
+@app.get("/v1/exports/{job_id}/file")
+async def download_export(job_id: str, auth_data: KeyInfo = Depends(check_api_key),
+                          range: str | None = Header(default=None), if_range: str | None = Header(default=None)):
+    job = get_export_job(job_id, auth_data)
+    if job.state != "done":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Export {job_id} is {job.state}."
+        )
+    try:
+        result_file = open(export_manager.result_path(job.job_id), "rb")
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Export {job_id} not found."
+        )
+    size = os.fstat(result_file.fileno()).st_size
+    etag = f'"{job.job_id}"'
+    headers = {
+        "Content-Disposition": f"attachment; filename={job.file_name}",
+        "Accept-Ranges": "bytes",
+        "ETag": etag
+    }
+    if if_range is not None and if_range.strip() != etag:
+        # Another file than the partly downloaded one, send it completely
+        range = None
+    try:
+        byte_range = parse_range(range, size)
+    except ValueError:
+        result_file.close()
+        return Response(status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE,
+                        headers={**headers, "Content-Range": f"bytes */{size:d}"})
+    if byte_range is None:
+        return StreamingResponse(iter_file_range(result_file, 0, size), media_type=job.media_type,
+                                 headers={**headers, "Content-Length": str(size)})
+    offset, length = byte_range
+    return StreamingResponse(iter_file_range(result_file, offset, length), media_type=job.media_type,
+                             status_code=status.HTTP_206_PARTIAL_CONTENT,
+                             headers={**headers, "Content-Length": str(length),
+                                      "Content-Range": f"bytes {offset:d}-{offset + length - 1:d}/{size:d}"})
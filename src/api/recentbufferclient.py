@@ -0,0 +1,66 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+
+import numpy as np
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+# Unix sockets of the ingest recent data buffers (one per ingest instance, empty disables)
+RECENT_BUFFER_SOCKETS = [path for path in os.getenv("PQOPEN_API_RECENT_BUFFER_SOCKETS", "").split(",") if path]
+RECENT_BUFFER_TIMEOUT = float(os.getenv("PQOPEN_API_RECENT_BUFFER_TIMEOUT", 2.0))
+
+def _to_us(dt: datetime.datetime) -> int:
+    # Same truncation to seconds (and wall clock as UTC) as the Flux range of influx2client
+    return int(dt.replace(microsecond=0, tzinfo=datetime.UTC).timestamp()) * 1_000_000
+
+async def _request(socket_path: str, request: dict):
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    try:
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        header = json.loads(await reader.readline())
+        if not header["covered"]:
+            return None
+        channels = []
+        for ch_name, num_samples in header["channels"]:
+            timestamps = np.frombuffer(await reader.readexactly(num_samples * 8), dtype="<i8")
+            values = np.frombuffer(await reader.readexactly(num_samples * 8), dtype="<f8")
+            channels.append((ch_name, timestamps, values))
+        return channels
+    finally:
+        writer.close()
+
+async def read_data_pl(start_dt, stop_dt, location, bucket, channels = []):
+    """
+    Read cycle-by-cycle data from the ingest recent data buffers
+
+    Returns a DataFrame like influx2client.read_data_pl or None if no buffer holds all
+    samples of the range (then the data has to be read from the database). Without
+    channels the database is used as well, the buffer only knows the channels received
+    since the ingest started and would return other columns.
+    """
+    if not channels:
+        return None
+    request = {"bucket": bucket, "location": location, "channels": channels,
+               "start_us": _to_us(start_dt), "stop_us": _to_us(stop_dt)}
+    for socket_path in RECENT_BUFFER_SOCKETS:
+        try:
+            result = await asyncio.wait_for(_request(socket_path, request), timeout=RECENT_BUFFER_TIMEOUT)
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            logger.warning(f"Recent data buffer {socket_path} not available: {str(e)}")
+            continue
+        if result is None:
+            continue
+        result.sort(key=lambda channel: channel[0])
+        if all(np.array_equal(timestamps, result[0][1]) for _, timestamps, _ in result):
+            pl_df = pl.DataFrame({"_time": result[0][1], **{ch_name: values for ch_name, _, values in result}})
+        else:
+            pl_df = pl.concat([pl.DataFrame({"_time": timestamps, ch_name: values}) for ch_name, timestamps, values in result],
+                              how="align")
+        pl_df = pl_df.with_columns(pl.col("_time").cast(pl.Datetime("us", "UTC")))
+        return pl_df.sort("_time")
+    return None
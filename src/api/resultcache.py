@@ -0,0 +1,164 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from typing import AsyncIterator, BinaryIO
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 1 << 20
+
+def _range_str(dt: datetime.datetime) -> str:
+    # Same truncation to seconds as the Flux range of influx2client
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Check the If-None-Match header (list of entity tags, weak comparison) against the etag
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+class ResultCache:
+    """
+    On-disk cache of encoded data responses of settled time ranges
+
+    Data of a range ending more than settled_sec in the past doesn't change anymore, so
+    the encoded file of a request is stored under the hash of the normalized request and
+    served without querying the database. settled_sec must exceed the maximum replay lag
+    of the ingest spool (data written late after a database outage), entries older than
+    max_age_sec are dropped to bound how long data completed later is hidden.
+    The entries are evicted least recently used (by file access time, set on hits, the
+    modification time is the creation time) when the cache exceeds max_bytes.
+    The cache directory may be shared by several API workers.
+    """
+    def __init__(self, path: str, max_bytes: int, settled_sec: float, max_age_sec: float = 86400):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.settled_sec = settled_sec
+        self.max_age_sec = max_age_sec
+        os.makedirs(path, exist_ok=True)
+        # Remove files of responses interrupted by a restart
+        for entry in os.scandir(path):
+            if entry.name.endswith(".tmp") and entry.stat().st_mtime < datetime.datetime.now().timestamp() - 3600:
+                os.unlink(entry.path)
+
+    def is_settled(self, stop_dt: datetime.datetime) -> bool:
+        stop_ts = stop_dt.replace(tzinfo=datetime.UTC).timestamp()
+        return stop_ts <= datetime.datetime.now(tz=datetime.UTC).timestamp() - self.settled_sec
+
+    @staticmethod
+    def make_key(bucket: str, measurement: str, location: str, fields: list, interval_sec: int | None,
+                 start_dt: datetime.datetime, stop_dt: datetime.datetime, output: dict) -> str:
+        """
+        Hash of the normalized request, output are the file format options
+        """
+        request = {"bucket": bucket, "measurement": measurement, "location": location,
+                   "fields": sorted(set(fields)), "interval_sec": interval_sec,
+                   "start": _range_str(start_dt), "stop": _range_str(stop_dt), "output": output}
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def etag(key: str, created: float) -> str:
+        """
+        Entity tag of an entry, a new entry of the same request after max age gets a new one
+        """
+        return f'"{key}-{int(created)}"'
+
+    def _expired(self, created: float) -> bool:
+        return created < time.time() - self.max_age_sec
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.bin")
+
+    def open(self, key: str) -> tuple[BinaryIO, float] | None:
+        """
+        Open the cached file of key with its creation time (or None if missing or expired),
+        an open file stays readable if evicted meanwhile
+        """
+        entry_path = self._entry_path(key)
+        try:
+            entry_file = open(entry_path, "rb")
+        except FileNotFoundError:
+            return None
+        created = os.fstat(entry_file.fileno()).st_mtime
+        if self._expired(created):
+            entry_file.close()
+            try:
+                os.unlink(entry_path)
+            except FileNotFoundError:
+                pass
+            return None
+        try:
+            os.utime(entry_path, (time.time(), created))
+        except OSError:
+            pass
+        return entry_file, created
+
+    async def iter_file(self, entry_file: BinaryIO) -> AsyncIterator[bytes]:
+        try:
+            while chunk := await asyncio.to_thread(entry_file.read, READ_CHUNK_SIZE):
+                yield chunk
+        finally:
+            entry_file.close()
+
+    async def store_stream(self, key: str, data_stream: AsyncIterator[bytes], created: float) -> AsyncIterator[bytes]:
+        """
+        Pass the data stream through and store it as entry of key when complete,
+        created is the creation time of the entry (part of the entity tag)
+        """
+        tmp_path = os.path.join(self.path, f".{key}.{uuid.uuid4().hex}.tmp")
+        tmp_file = open(tmp_path, "wb")
+        size = 0
+        try:
+            async for chunk in data_stream:
+                if tmp_file is not None:
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        # Too big for the cache, only stream
+                        tmp_file.close()
+                        os.unlink(tmp_path)
+                        tmp_file = None
+                    else:
+                        await asyncio.to_thread(tmp_file.write, chunk)
+                yield chunk
+            if tmp_file is not None:
+                tmp_file.close()
+                os.utime(tmp_path, (created, created))
+                os.replace(tmp_path, self._entry_path(key))
+                tmp_file = None
+                await asyncio.to_thread(self.evict)
+        finally:
+            if tmp_file is not None:
+                tmp_file.close()
+                os.unlink(tmp_path)
+
+    def evict(self):
+        """
+        Delete expired entries and least recently used ones until the cache size is within max_bytes
+        """
+        entries = []
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith(".bin"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, entry.path, stat.st_mtime))
+        total_size = sum(size for _, size, _, _ in entries)
+        for _, size, entry_path, created in sorted(entries):
+            if total_size <= self.max_bytes and not self._expired(created):
+                continue
+            try:
+                os.unlink(entry_path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            logger.debug(f"Evicted cache entry {entry_path}")
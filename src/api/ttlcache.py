@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+class _Entry:
+    __slots__ = ("value", "loaded_at", "task")
+
+    def __init__(self):
+        self.value = None
+        self.loaded_at = None
+        self.task = None
+
+class TtlCache:
+    """
+    In-memory cache of async loaded values with stale-while-revalidate
+
+    A value younger than ttl is returned as is. An older value is still returned for up
+    to max_stale seconds while it is reloaded in the background, so only the first
+    request of a key (or one after max_stale without requests) waits for the loader.
+    Concurrent requests of a missing key share one load. A failed background reload
+    keeps the stale value.
+    """
+    def __init__(self, ttl: float, max_stale: float):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._entries = {}
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = _Entry()
+            self._entries[key] = entry
+        if entry.loaded_at is not None:
+            age = time.monotonic() - entry.loaded_at
+            if age < self.ttl:
+                return entry.value
+            if age < self.ttl + self.max_stale:
+                self._start_load(key, entry, loader)
+                return entry.value
+        return await asyncio.shield(self._start_load(key, entry, loader))
+
+    def _start_load(self, key: Hashable, entry: _Entry, loader: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        if entry.task is None:
+            entry.task = asyncio.create_task(self._load(entry, loader))
+            entry.task.add_done_callback(lambda task: self._log_error(key, task))
+        return entry.task
+
+    async def _load(self, entry: _Entry, loader: Callable[[], Awaitable[Any]]):
+        try:
+            entry.value = await loader()
+            entry.loaded_at = time.monotonic()
+            return entry.value
+        finally:
+            entry.task = None
+
+    def _log_error(self, key: Hashable, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Loading {key} failed: {str(task.exception())}")
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    async def close(self):
+        """
+        Cancel running loads (at shutdown)
+        """
+        tasks = [entry.task for entry in self._entries.values() if entry.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from spool import WriteSpool
+import metrics
+
+logger = logging.getLogger(__name__)
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Write errors worth retrying: timeouts, connection errors, 429 and 5xx
+
+    Other HTTP errors (bad line protocol, field type conflicts, invalid token, too large
+    batches) are permanent, writing the same batch again fails again.
+    """
+    status = getattr(error, "status", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return True
+
+class BatchWriter:
+    """
+    Collects line protocol records of all messages per bucket and write precision and
+    writes them in batches
+
+    A buffer is flushed when its buffer exceeds max_bytes or max_lines, or when the
+    oldest buffered record is older than max_latency seconds. At most max_pending_flushes
+    writes are in flight, further flushes wait for a free slot (backpressure to the caller).
+
+    With a spool, batches go to disk instead when a write fails with a retryable error or
+    exceeds write_timeout, when all write slots are busy, or while the database is known
+    to be unavailable. run_replay() writes the spooled batches back once the database
+    accepts writes again. Batches rejected by the database are logged and dropped.
+    """
+    def __init__(self, write_api, max_bytes: int = 4_000_000, max_lines: int = 5000,
+                 max_latency: float = 1.0, max_pending_flushes: int = 4,
+                 spool: WriteSpool | None = None, write_timeout: float = 10.0):
+        self.write_api = write_api
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self.max_latency = max_latency
+        self.spool = spool
+        self.write_timeout = write_timeout
+        self._buffers = {}
+        self._flush_slots = asyncio.Semaphore(max_pending_flushes)
+        self._flush_tasks = set()
+        self._db_available = spool is None or spool.is_empty()
+        # All spool operations (write, seal with fsync, size check, replay) in one thread, off the
+        # event loop and never concurrent
+        self._spool_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spool")
+
+    async def _run_spool(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._spool_executor, func, *args)
+
+    async def _append_spool(self, bucket: str, batch: bytes, precision: str):
+        try:
+            await self._run_spool(self.spool.append, bucket, batch, precision)
+        except Exception as e:
+            metrics.ERRORS.inc(1, "spool")
+            logger.error(f"Spooling batch of {len(batch):d} bytes for {bucket} failed, dropped: {str(e)}")
+            return
+        metrics.SPOOLED_BYTES.inc(len(batch), bucket)
+
+    def _drop_rejected(self, bucket: str, batch: bytes, error: Exception):
+        metrics.ERRORS.inc(1, "rejected")
+        num_lines = batch.count(b"\n")
+        logger.error(f"Batch of {num_lines:d} lines ({len(batch):d} bytes) rejected by {bucket}, "
+                     f"dropped: {str(error) or type(error).__name__}")
+
+    async def write(self, bucket: str, record: bytes, precision: str = "ns"):
+        """
+        Add line protocol record (one or more lines, newline terminated) to the buffer of
+        the bucket and the write precision of its timestamps
+        """
+        buffer = self._buffers.get((bucket, precision))
+        if buffer is None:
+            buffer = {"records": [], "bytes": 0, "lines": 0, "since": time.monotonic()}
+            self._buffers[(bucket, precision)] = buffer
+        buffer["records"].append(record)
+        buffer["bytes"] += len(record)
+        buffer["lines"] += record.count(b"\n")
+        if buffer["bytes"] >= self.max_bytes or buffer["lines"] >= self.max_lines:
+            await self.flush(bucket, precision)
+
+    async def flush(self, bucket: str, precision: str = "ns"):
+        """
+        Start writing the buffer of the bucket and precision, waits if too many writes are pending
+        """
+        buffer = self._buffers.pop((bucket, precision), None)
+        if buffer is None:
+            return
+        batch = b"".join(buffer["records"])
+        if self.spool is not None and (not self._db_available or self._flush_slots.locked()):
+            await self._append_spool(bucket, batch, precision)
+            return
+        await self._flush_slots.acquire()
+        task = asyncio.create_task(self._write_batch(bucket, precision, batch, buffer["lines"]))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush_all(self):
+        """
+        Flush all buffers and wait until all pending writes are completed
+        """
+        for bucket, precision in list(self._buffers):
+            await self.flush(bucket, precision)
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks)
+
+    async def _write_batch(self, bucket: str, precision: str, batch: bytes, num_lines: int):
+        try:
+            start = time.perf_counter()
+            await asyncio.wait_for(self.write_api.write(bucket=bucket, record=batch, write_precision=precision),
+                                   timeout=self.write_timeout)
+            metrics.WRITE_SECONDS.observe(time.perf_counter() - start, bucket)
+            metrics.WRITE_BATCH_BYTES.observe(len(batch), bucket)
+            metrics.WRITE_BATCH_LINES.observe(num_lines, bucket)
+            logger.debug(f"Batch of {num_lines:d} lines ({len(batch):d} bytes) written to {bucket}")
+        except Exception as e:
+            if not is_retryable(e):
+                self._drop_rejected(bucket, batch, e)
+                return
+            metrics.ERRORS.inc(1, "write")
+            if self.spool is None:
+                logger.error(f"Error writing batch to {bucket}: {str(e)}")
+            else:
+                logger.warning(f"Error writing batch to {bucket}, spooled to disk: {str(e) or type(e).__name__}")
+                self._db_available = False
+                await self._append_spool(bucket, batch, precision)
+        finally:
+            self._flush_slots.release()
+
+    async def run(self, stop_event: asyncio.Event):
+        """
+        Flush buffers exceeding the max. latency until stop_event is set, then flush everything
+        """
+        while not stop_event.is_set():
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=self.max_latency / 4)
+            except asyncio.TimeoutError:
+                pass
+            now = time.monotonic()
+            for (bucket, precision), buffer in list(self._buffers.items()):
+                if now - buffer["since"] >= self.max_latency:
+                    await self.flush(bucket, precision)
+        await self.flush_all()
+        if self.spool is not None:
+            await self._run_spool(self.spool.close)
+        logger.info("Batch writer flushed.")
+
+    async def _write_replayed(self, bucket: str, precision: str, batch: bytes):
+        await asyncio.wait_for(self.write_api.write(bucket=bucket, record=batch, write_precision=precision),
+                               timeout=self.write_timeout)
+
+    async def _replay_segment(self, seg_path, max_batch_bytes: int):
+        # Merge consecutive records of the same bucket and precision up to max_batch_bytes
+        batches = []
+        records = await self._run_spool(lambda: list(self.spool.read_segment(seg_path)))
+        for bucket, precision, batch in records:
+            if batches and batches[-1][:2] == (bucket, precision) and sum(map(len, batches[-1][2])) + len(batch) <= max_batch_bytes:
+                batches[-1][2].append(batch)
+            else:
+                batches.append((bucket, precision, [batch]))
+        for bucket, precision, batch_records in batches:
+            try:
+                await self._write_replayed(bucket, precision, b"".join(batch_records))
+            except Exception as e:
+                if is_retryable(e):
+                    raise
+                # Find the rejected records of the merged batch, write the others
+                for record in batch_records:
+                    try:
+                        await self._write_replayed(bucket, precision, record)
+                    except Exception as record_error:
+                        if is_retryable(record_error):
+                            raise
+                        self._drop_rejected(bucket, record, record_error)
+
+    async def run_replay(self, stop_event: asyncio.Event, max_batch_bytes: int = 8_000_000,
+                         retry_interval: float = 5.0):
+        """
+        Drain the spool oldest segment first until stop_event is set
+
+        A segment is removed after all its batches are written. Records rejected by the
+        database are dropped. If a write fails with a retryable error, the segment is
+        retried later from the beginning. Rewriting points is idempotent.
+        """
+        while not stop_event.is_set():
+            if await self._run_spool(self.spool.is_empty):
+                self._db_available = True
+            else:
+                if not await self._run_spool(self.spool.sealed_segments):
+                    await self._run_spool(self.spool.seal)
+                try:
+                    for seg_path in await self._run_spool(self.spool.sealed_segments):
+                        await self._replay_segment(seg_path, max_batch_bytes)
+                        await self._run_spool(self.spool.remove_segment, seg_path)
+                        logger.info(f"Spool segment {seg_path.name} replayed")
+                        if stop_event.is_set():
+                            break
+                    continue
+                except Exception as e:
+                    logger.warning(f"Spool replay failed, retry in {retry_interval:.0f} s: {str(e) or type(e).__name__}")
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=retry_interval)
+            except asyncio.TimeoutError:
+                pass
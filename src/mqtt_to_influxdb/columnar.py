@@ -0,0 +1,106 @@
+"""
+Compact columnar binary encoding for dataseries messages (topic encoding "pqcol")
+
+Layout, all values little-endian:
+
+    header:   magic b"PQCL", version u8, flags u8 (bit 0: body zstd compressed), reserved u16
+    body:     num_blocks u16, then per block:
+              num_samples u32, num_channels u16, delta dtype u8 (4: int32, 8: int64), reserved u8
+              start timestamp i64 (us)
+              (num_samples - 1) timestamp deltas (us)
+              per channel: name length u8, name (utf-8), value dtype u8 (4: float32, 8: float64),
+                           num_samples values
+
+All channels of a block share the timestamps of the block.
+"""
+import struct
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"PQCL"
+VERSION = 1
+FLAG_ZSTD = 0x01
+
+HEADER = struct.Struct("<4sBBH")
+BLOCK_HEADER = struct.Struct("<IHBBq")
+INT_DTYPES = {4: np.dtype("<i4"), 8: np.dtype("<i8")}
+FLOAT_DTYPES = {4: np.dtype("<f4"), 8: np.dtype("<f8")}
+
+def decode_columnar(payload: bytes) -> dict:
+    """
+    Decode columnar payload to a dataseries dict with NumPy arrays
+
+    Values are zero-copy views on the (decompressed) payload, channels of a block share
+    one timestamps array. Returns {"data": {channel: {"data": ..., "timestamps": ...}}}.
+    """
+    magic, version, flags, _ = HEADER.unpack_from(payload, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Invalid columnar payload (magic {magic!r}, version {version:d})")
+    body = memoryview(payload)[HEADER.size:]
+    if flags & FLAG_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd compressed columnar payload, but zstandard is not installed")
+        body = memoryview(zstandard.ZstdDecompressor().decompress(body))
+    (num_blocks,) = struct.unpack_from("<H", body, 0)
+    pos = 2
+    m_data = {}
+    for _ in range(num_blocks):
+        num_samples, num_channels, delta_size, _, start_ts = BLOCK_HEADER.unpack_from(body, pos)
+        pos += BLOCK_HEADER.size
+        num_deltas = max(num_samples - 1, 0)
+        deltas = np.frombuffer(body, dtype=INT_DTYPES[delta_size], count=num_deltas, offset=pos)
+        pos += num_deltas * delta_size
+        timestamps = np.empty(num_samples, dtype=np.int64)
+        if num_samples:
+            timestamps[0] = start_ts
+            np.cumsum(deltas, out=timestamps[1:])
+            timestamps[1:] += start_ts
+        for _ in range(num_channels):
+            name_length = body[pos]
+            name = bytes(body[pos + 1:pos + 1 + name_length]).decode()
+            value_size = body[pos + 1 + name_length]
+            pos += 2 + name_length
+            values = np.frombuffer(body, dtype=FLOAT_DTYPES[value_size], count=num_samples, offset=pos)
+            pos += num_samples * value_size
+            m_data[name] = {"data": values, "timestamps": timestamps}
+    return {"data": m_data}
+
+def encode_columnar(m_data: dict, float_dtype: str = "float32", compress: bool = False) -> bytes:
+    """
+    Encode dataseries channels ({channel: {"data": [...], "timestamps": [...]}}) to columnar payload
+
+    Channels with identical timestamps are put into one block.
+    """
+    blocks = []
+    for ch_name, ch_values in m_data.items():
+        timestamps = np.asarray(ch_values["timestamps"], dtype=np.int64)
+        for block in blocks:
+            if np.array_equal(block[0], timestamps):
+                block[1].append((ch_name, ch_values["data"]))
+                break
+        else:
+            blocks.append((timestamps, [(ch_name, ch_values["data"])]))
+    value_dtype = np.dtype(float_dtype).newbyteorder("<")
+    parts = [struct.pack("<H", len(blocks))]
+    for timestamps, channels in blocks:
+        deltas = np.diff(timestamps)
+        delta_size = 4 if deltas.size == 0 or (deltas.min() >= -2**31 and deltas.max() < 2**31) else 8
+        start_ts = int(timestamps[0]) if timestamps.size else 0
+        parts.append(BLOCK_HEADER.pack(timestamps.size, len(channels), delta_size, 0, start_ts))
+        parts.append(deltas.astype(INT_DTYPES[delta_size]).tobytes())
+        for ch_name, values in channels:
+            name = ch_name.encode()
+            parts.append(struct.pack("<B", len(name)) + name + struct.pack("<B", value_dtype.itemsize))
+            parts.append(np.asarray(values, dtype=value_dtype).tobytes())
+    body = b"".join(parts)
+    flags = 0
+    if compress:
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        body = zstandard.ZstdCompressor().compress(body)
+        flags |= FLAG_ZSTD
+    return HEADER.pack(MAGIC, VERSION, flags, 0) + body
@@ -1,10 +1,55 @@
 import pandas as pd
+import numpy as np
 import orjson
 import logging
 import math
+from decimal import Decimal
 
 logger = logging.getLogger(__name__)
 
+# Escaping of line protocol tag keys, tag values and field keys
+_ESCAPE_KEY = str.maketrans({",": "\\,", "=": "\\=", " ": "\\ ", "\n": "\\n", "\r": "\\r", "\t": "\\t"})
+
+# Float field formats: "fixed" is the classic 6 decimals format, "shortest" the shortest
+# representation which round-trips to the same float64 (Python repr)
+FLOAT_FORMATS = {"fixed": "%f", "shortest": "%r"}
+
+# Timestamp units per second of the InfluxDB write precisions
+PRECISIONS = {"s": 1, "ms": 1_000, "us": 1_000_000, "ns": 1_000_000_000}
+
+def resolve_float_format(float_format: str) -> str:
+    """
+    Printf style format of a float format name ("fixed", "shortest") or a spec like "%.6g"
+    """
+    float_format = FLOAT_FORMATS.get(float_format, float_format)
+    try:
+        float(float_format % 1.5)
+    except (TypeError, ValueError):
+        raise ValueError(f"Float format must be one of {list(FLOAT_FORMATS)} or a printf style spec, got {float_format}")
+    return float_format
+
+def seconds_to_precision(timestamp: float, precision: str) -> int:
+    """
+    Convert a timestamp in seconds to an integer timestamp in the write precision
+    """
+    if precision == "ns":
+        return int(timestamp*1e9)
+    return round(timestamp * PRECISIONS[precision])
+
+def _us_to_precision(timestamps: np.ndarray, precision: str) -> np.ndarray:
+    if precision == "us":
+        return timestamps
+    elif precision == "ns":
+        return timestamps * 1000
+    divisor = PRECISIONS["us"] // PRECISIONS[precision]
+    return (timestamps + divisor // 2) // divisor
+
+def tags_to_line_protocol(tags: dict) -> str:
+    """
+    Convert tags to the escaped tag set of a line ("key1=value1,key2=value2")
+    """
+    return ",".join(f"{str(k).translate(_ESCAPE_KEY)}={str(v).translate(_ESCAPE_KEY)}" for k, v in tags.items())
+
 def convert_dataseries_to_df(dataseries: dict):
     df_list = []
     for channel in dataseries:
@@ -30,8 +75,96 @@ def cbc_dict_to_line_protocol(m_data: dict, tags: dict, measurement: str = "cycl
             lines.append(line)
     return lines
 
-def agg_dict_to_line_protocol(m_data: dict, tags: dict, measurement: str = "aggregated-data"):
-    tag_str = ",".join(f"{k}={v}" for k, v in tags.items())
+def group_channels_by_timestamps(m_data: dict):
+    """
+    Group channels with identical timestamps, returns list of (channel names, timestamps, values)
+
+    A channel with different numbers of values and timestamps gets a group of its own
+    with the samples of both (one line per sample), so it doesn't break the other channels.
+    """
+    groups = []
+    mismatched_groups = []
+    for ch_name, ch_values in m_data.items():
+        timestamps = ch_values["timestamps"]
+        if len(ch_values["data"]) != len(timestamps):
+            num_samples = min(len(ch_values["data"]), len(timestamps))
+            logger.warning(f"Channel {ch_name} has {len(ch_values['data']):d} values for {len(timestamps):d} timestamps, "
+                           f"using the first {num_samples:d}")
+            mismatched_groups.append([[ch_name], None, np.asarray(timestamps[:num_samples], dtype=np.int64),
+                                      [ch_values["data"][:num_samples]]])
+            continue
+        for group in groups:
+            if group[1] is timestamps:
+                break
+        else:
+            ts_array = np.asarray(timestamps, dtype=np.int64)
+            for group in groups:
+                if np.array_equal(group[2], ts_array):
+                    break
+            else:
+                group = [[], timestamps, ts_array, []]
+                groups.append(group)
+        group[0].append(ch_name)
+        group[3].append(ch_values["data"])
+    return [(ch_names, ts_array, np.asarray(values, dtype=np.float64))
+            for ch_names, _, ts_array, values in groups + mismatched_groups]
+
+def _encode_wide_block(line_prefix: str, ch_names: list, timestamps: np.ndarray, values: np.ndarray,
+                       precision: str = "ns", float_format: str = "%f") -> str:
+    """
+    Encode one block of aligned channels to line protocol, one line per timestamp
+    """
+    timestamps = _us_to_precision(timestamps, precision)
+    num_fields = len(ch_names)
+    finite_rows = np.isfinite(values).all(axis=0)
+    if not finite_rows.all():
+        bad_rows = np.flatnonzero(~finite_rows)
+        values_ok = values[:, finite_rows]
+        timestamps_ok = timestamps[finite_rows]
+    else:
+        bad_rows = []
+        values_ok = values
+        timestamps_ok = timestamps
+    # Interleave all values and timestamps in one flat list and format the whole
+    # block with a single %-operation instead of one f-string per sample
+    num_rows = len(timestamps_ok)
+    line_template = (line_prefix.replace("%", "%%") + " "
+                     + ",".join(f"{ch_name}=".replace("%", "%%") + float_format for ch_name in ch_names) + " %d\n")
+    flat_values = [None] * (num_rows * (num_fields + 1))
+    for idx in range(num_fields):
+        flat_values[idx::num_fields + 1] = values_ok[idx].tolist()
+    flat_values[num_fields::num_fields + 1] = timestamps_ok.tolist()
+    block = (line_template * num_rows) % tuple(flat_values)
+    # Rows with NaN/Inf values: only write the finite fields
+    for row in bad_rows:
+        fields = ",".join(f"{ch_name}={float_format % float(values[idx, row])}" for idx, ch_name in enumerate(ch_names) if math.isfinite(values[idx, row]))
+        if fields:
+            block += f"{line_prefix} {fields} {timestamps[row]:d}\n"
+    return block
+
+def cbc_dict_to_line_protocol_wide(m_data: dict, tags: dict | str, measurement: str = "cycle-by-cycle",
+                                   precision: str = "ns", float_format: str = "%f", groups: list | None = None) -> bytes:
+    """
+    Convert cycle-by-cycle data to line protocol with one line per timestamp
+
+    Channels sharing the same timestamps are written as fields of one line,
+    channels with their own timestamps end up as one line per sample.
+    Tags are given as dict or as precomputed tag string (see tags_to_line_protocol).
+    Timestamps (us) are converted to the write precision, values are formatted with the
+    printf style float_format (see resolve_float_format). Already computed groups of
+    group_channels_by_timestamps(m_data) can be passed. Returns one contiguous bytes buffer.
+    """
+    tag_str = tags if isinstance(tags, str) else ",".join(f"{k}={v}" for k, v in tags.items())
+    line_prefix = f"{measurement},{tag_str}" if tag_str else measurement
+    if groups is None:
+        groups = group_channels_by_timestamps(m_data)
+    blocks = [_encode_wide_block(line_prefix, ch_names, timestamps, values, precision, float_format)
+              for ch_names, timestamps, values in groups]
+    return "".join(blocks).encode()
+
+def agg_dict_to_line_protocol(m_data: dict, tags: dict | str, measurement: str = "aggregated-data",
+                              precision: str = "ns", float_format: str = "%f"):
+    tag_str = tags if isinstance(tags, str) else ",".join(f"{k}={v}" for k, v in tags.items())
     line = ""
     line += measurement + "," + tag_str + " "
 
@@ -42,12 +175,117 @@ def agg_dict_to_line_protocol(m_data: dict, tags: dict, measurement: str = "aggr
             for idx, item in enumerate(val):
                 if (item is None) or math.isnan(item):
                     continue
-                line += f"{ch_name}_{idx:02d}={float(item):f},"
+                line += f"{ch_name}_{idx:02d}={float_format % float(item)},"
         else:
             if (val is None) or math.isnan(val):
                 continue
-            line += f"{ch_name}={float(val):f},"
+            line += f"{ch_name}={float_format % float(val)},"
     
     line = line[:-1] # replace tailing comma
-    line += f" {int(m_data['timestamp']*1e9):d}"
-    return line
\ No newline at end of file
+    line += f" {seconds_to_precision(m_data['timestamp'], precision):d}"
+    return line
+
+def agg_dicts_to_line_protocol(m_data_list: list, tags_list: list, measurement: str = "aggregated-data",
+                               precision: str = "ns", float_format: str = "%f") -> bytes:
+    """
+    Convert a batch of aggregated data packets to line protocol, one line per packet
+
+    tags_list holds the tags (dict or tag string) of each packet. The output is identical to
+    the newline terminated lines of agg_dict_to_line_protocol. NaN entries of list fields are
+    filtered with numpy and all lines are formatted with a single %-operation.
+    """
+    line_templates = []
+    values = []
+    # Field templates per channel, reused for all packets
+    field_names = {}
+    scalar_field_names = {}
+    for m_data, tags in zip(m_data_list, tags_list):
+        tag_str = tags if isinstance(tags, str) else ",".join(f"{k}={v}" for k, v in tags.items())
+        fields = []
+        for ch_name, val in m_data['data'].items():
+            if ch_name.startswith('_'):
+                continue
+            if type(val) in [list]:
+                names = field_names.get(ch_name)
+                if names is None or len(names) < len(val):
+                    names = [f"{ch_name}_{idx:02d}=".replace("%", "%%") + float_format for idx in range(len(val))]
+                    field_names[ch_name] = names
+                if len(val) < 16:
+                    # numpy call overhead exceeds the gain for short lists
+                    for idx, item in enumerate(val):
+                        if (item is None) or math.isnan(item):
+                            continue
+                        fields.append(names[idx])
+                        values.append(float(item))
+                    continue
+                val = np.asarray(val, dtype=np.float64)
+                keep = np.flatnonzero(~np.isnan(val))
+                fields.extend([names[idx] for idx in keep.tolist()])
+                values.extend(val[keep].tolist())
+            else:
+                if (val is None) or math.isnan(val):
+                    continue
+                name = scalar_field_names.get(ch_name)
+                if name is None:
+                    name = f"{ch_name}=".replace("%", "%%") + float_format
+                    scalar_field_names[ch_name] = name
+                fields.append(name)
+                values.append(float(val))
+        line_prefix = (measurement + "," + tag_str).replace("%", "%%")
+        if fields:
+            line_prefix += " " + ",".join(fields)
+        line_templates.append(f"{line_prefix} {seconds_to_precision(m_data['timestamp'], precision):d}\n")
+    return ("".join(line_templates) % tuple(values)).encode()
+
+# Escaping of the measurement and string field values as done by influxdb_client.Point
+_ESCAPE_MEASUREMENT = str.maketrans({",": "\\,", " ": "\\ ", "\n": "\\n", "\r": "\\r", "\t": "\\t"})
+_ESCAPE_STRING = str.maketrans({'"': '\\"', "\\": "\\\\"})
+
+def _escape_tag_value(value) -> str:
+    value = str(value).translate(_ESCAPE_KEY)
+    return value + " " if value.endswith("\\") else value
+
+def _format_field(key: str, value) -> str | None:
+    # Field formatting of influxdb_client.Point (floats shortest without ".0", ints with "i")
+    if value is None:
+        return None
+    if isinstance(value, (float, Decimal)) or (hasattr(value, "dtype") and np.issubdtype(value, np.floating)):
+        if not math.isfinite(value):
+            return None
+        value_str = str(value)
+        if value_str.endswith(".0"):
+            value_str = value_str[:-2]
+        return f"{key.translate(_ESCAPE_KEY)}={value_str}"
+    elif (isinstance(value, int) or (hasattr(value, "dtype") and np.issubdtype(value, np.integer))) and not isinstance(value, bool):
+        return f"{key.translate(_ESCAPE_KEY)}={value}i"
+    elif isinstance(value, bool):
+        return f"{key.translate(_ESCAPE_KEY)}={str(value).lower()}"
+    elif isinstance(value, str):
+        return f'{key.translate(_ESCAPE_KEY)}="{value.translate(_ESCAPE_STRING)}"'
+    raise ValueError(f'Type: "{type(value)}" of field: "{key}" is not supported.')
+
+def events_to_line_protocol(events: list, tags: dict, measurement: str = "event-data", precision: str = "ns") -> bytes:
+    """
+    Convert a batch of event packets to line protocol, one line per event
+
+    Each event gets the tags event_type and channel in addition to the given tags, the
+    fields of its data dict and its timestamp (s) in the write precision. The output is
+    identical to influxdb_client.Point.from_dict(...).to_line_protocol() plus newline.
+    """
+    measurement = str(measurement).translate(_ESCAPE_MEASUREMENT)
+    static_tags = [(key, _escape_tag_value(value)) for key, value in tags.items() if value is not None]
+    lines = []
+    for event in events:
+        event_tags = static_tags + [(key, _escape_tag_value(event[key])) for key in ("event_type", "channel")
+                                    if event[key] is not None]
+        tag_str = ",".join(f"{key.translate(_ESCAPE_KEY)}={value}" for key, value in sorted(event_tags)
+                           if key != "" and value != "")
+        fields = [field for field in (_format_field(key, value) for key, value in sorted(event["data"].items()))
+                  if field is not None]
+        if not fields:
+            # Point without fields results in an empty line
+            lines.append("\n")
+            continue
+        lines.append(f"{measurement}{',' if tag_str else ''}{tag_str} {','.join(fields)} "
+                     f"{seconds_to_precision(event['timestamp'], precision):d}\n")
+    return "".join(lines).encode()
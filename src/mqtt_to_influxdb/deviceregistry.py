@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+
+import orjson
+
+from dataconverter import tags_to_line_protocol
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class DeviceEntry:
+    """
+    Device configuration with precomputed line protocol tags and resolved bucket names
+    """
+    device_id: str
+    location_name: str
+    location_lat: float
+    location_lon: float
+    location_tag_str: str
+    dataseries_bucket: str
+    aggregated_bucket: str
+    event_bucket: str
+
+    @classmethod
+    def from_config(cls, device_id: str, config: dict):
+        return cls(device_id=device_id,
+                   location_name=config["location_name"],
+                   location_lat=config["location_lat"],
+                   location_lon=config["location_lon"],
+                   location_tag_str=tags_to_line_protocol({"location_name": config["location_name"],
+                                                           "location_lat": config["location_lat"],
+                                                           "location_lon": config["location_lon"]}),
+                   dataseries_bucket=config.get("db_dataseries_bucket", "short_term"),
+                   aggregated_bucket=config.get("db_aggregated_bucket", "long_term"),
+                   event_bucket=config.get("db_event_bucket", "long_term"))
+
+    @property
+    def location_tags(self) -> dict:
+        return {"location_name": self.location_name,
+                "location_lat": self.location_lat,
+                "location_lon": self.location_lon}
+
+class DeviceRegistry:
+    """
+    Registry of configured devices, optionally backed by a JSON config file
+
+    The registry holds an immutable snapshot dict of DeviceEntry objects. A reload builds
+    a complete new snapshot and swaps it in one assignment, readers never see a partial
+    configuration. If the config file is invalid, the previous snapshot stays active.
+    """
+    def __init__(self, config_path: str | None = None):
+        self.config_path = config_path
+        self.version = 0
+        self._devices = {}
+        self._file_state = None
+        if config_path:
+            self.reload()
+
+    def update(self, device_config: dict):
+        """
+        Replace all devices by the given config dict {device_id: {location_name, ...}}
+        """
+        self._devices = {device_id: DeviceEntry.from_config(device_id, config)
+                         for device_id, config in device_config.items()}
+        self.version += 1
+
+    def reload(self) -> bool:
+        """
+        Reload config file if it changed since the last load, returns True if reloaded
+        """
+        stat = os.stat(self.config_path)
+        file_state = (stat.st_mtime_ns, stat.st_size)
+        if file_state == self._file_state:
+            return False
+        with open(self.config_path) as f:
+            device_config = orjson.loads(f.read())
+        self.update(device_config)
+        self._file_state = file_state
+        logger.info(f"Device config loaded: {len(self._devices):d} devices")
+        return True
+
+    async def watch(self, stop_event: asyncio.Event, interval: float = 5.0):
+        """
+        Check the config file for changes every interval seconds until stop_event is set
+        """
+        while not stop_event.is_set():
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"Device config reload failed, keeping previous config: {str(e)}")
+
+    def get(self, device_id: str) -> DeviceEntry | None:
+        return self._devices.get(device_id)
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._devices
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def device_ids(self) -> list[str]:
+        return list(self._devices)
@@ -0,0 +1,153 @@
+import orjson
+import gzip
+import logging
+import cbor2
+from dataclasses import dataclass, field
+
+from dataconverter import cbc_dict_to_line_protocol_wide, agg_dicts_to_line_protocol, events_to_line_protocol, group_channels_by_timestamps, resolve_float_format, PRECISIONS
+from rollup import dataseries_partials
+from columnar import decode_columnar
+from deviceregistry import DeviceEntry
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class EncoderOptions:
+    """
+    Write precision per data type and float format ("fixed", "shortest" or printf style spec)
+
+    Dataseries timestamps are us on the device, so "us" keeps them without padding.
+    Aggregated data is aligned to interval boundaries and written in "s". Event
+    timestamps are fractional seconds (start of a dip etc.), "ms" keeps their resolution.
+    "shortest" float format only pays off for values with few significant digits (rounded
+    or quantized by the device), full precision doubles need up to 17 digits with it.
+    With rollup_windows (seconds), window statistics of the dataseries are computed as well.
+    With keep_dataseries, the decoded dataseries blocks are returned for the recent data buffer.
+    """
+    dataseries_precision: str = "us"
+    aggregated_precision: str = "s"
+    event_precision: str = "ms"
+    float_format: str = "fixed"
+    rollup_windows: tuple = ()
+    keep_dataseries: bool = False
+
+    def __post_init__(self):
+        for precision in (self.dataseries_precision, self.aggregated_precision, self.event_precision):
+            if precision not in PRECISIONS:
+                raise ValueError(f"Write precision must be one of {list(PRECISIONS)}, got {precision}")
+        object.__setattr__(self, "float_format", resolve_float_format(self.float_format))
+
+DEFAULT_ENCODER_OPTIONS = EncoderOptions()
+
+@dataclass
+class EncodedMessage:
+    """
+    Result of encode_message
+
+    records:           list of (bucket, write precision, line protocol bytes)
+    newest_ts:         newest sample timestamp of the message in seconds (None without samples)
+    rollup_partials:   window statistics of the dataseries (see dataseries_partials)
+    dataseries_blocks: aligned dataseries blocks (channel names, timestamps in us, values)
+    """
+    records: list = field(default_factory=list)
+    newest_ts: float | None = None
+    rollup_partials: list = field(default_factory=list)
+    dataseries_blocks: list = field(default_factory=list)
+
+def decode_payload(payload: bytes, encoding: str):
+    if encoding == "gjson":
+        payload_dict = orjson.loads(gzip.decompress(payload))
+    elif encoding == "json":
+        payload_dict = orjson.loads(payload)
+    elif encoding == "cbor":
+        payload_dict = cbor2.loads(payload)
+    elif encoding == "pqcol":
+        payload_dict = decode_columnar(payload)
+
+    return payload_dict
+
+def encode_dataseries(device: DeviceEntry, data: dict, options: EncoderOptions = DEFAULT_ENCODER_OPTIONS,
+                      groups: list | None = None):
+    precision = options.dataseries_precision
+    lp_data = cbc_dict_to_line_protocol_wide(m_data=data, tags=device.location_tag_str,
+                                             precision=precision, float_format=options.float_format, groups=groups)
+    return device.dataseries_bucket, precision, lp_data
+
+def encode_aggdata_batch(device: DeviceEntry, data_list: list, options: EncoderOptions = DEFAULT_ENCODER_OPTIONS):
+    precision = options.aggregated_precision
+    tags_list = [f"interval_sec={data['interval_sec']},{device.location_tag_str}" for data in data_list]
+    lp_data = agg_dicts_to_line_protocol(m_data_list=data_list, tags_list=tags_list, precision=precision,
+                                         float_format=options.float_format)
+    return device.aggregated_bucket, precision, lp_data
+
+def encode_aggdata(device: DeviceEntry, data: dict, options: EncoderOptions = DEFAULT_ENCODER_OPTIONS):
+    return encode_aggdata_batch(device, [data], options)
+
+def encode_eventdata_batch(device: DeviceEntry, data_list: list, options: EncoderOptions = DEFAULT_ENCODER_OPTIONS):
+    precision = options.event_precision
+    lp_data = events_to_line_protocol(events=data_list, tags=device.location_tags, precision=precision)
+    return device.event_bucket, precision, lp_data
+
+def encode_eventdata(device: DeviceEntry, data: dict, options: EncoderOptions = DEFAULT_ENCODER_OPTIONS):
+    return encode_eventdata_batch(device, [data], options)
+
+def _newest_dataseries_timestamp(data: dict) -> float | None:
+    newest_ts = max((ch_values["timestamps"][-1] for ch_values in data.values() if len(ch_values["timestamps"])), default=None)
+    return None if newest_ts is None else newest_ts / 1e6
+
+def _encode_dataseries(device: DeviceEntry, data: dict, options: EncoderOptions, result: EncodedMessage):
+    if not options.rollup_windows and not options.keep_dataseries:
+        return encode_dataseries(device, data, options)
+    groups = group_channels_by_timestamps(data)
+    if options.rollup_windows:
+        result.rollup_partials.extend(dataseries_partials(groups, options.rollup_windows))
+    if options.keep_dataseries:
+        result.dataseries_blocks.extend(groups)
+    return encode_dataseries(device, data, options, groups)
+
+def encode_message(device: DeviceEntry, data_type: str, encoding: str, payload: bytes,
+                   options: EncoderOptions = DEFAULT_ENCODER_OPTIONS):
+    """
+    Decode a message payload and convert it to line protocol, returns an EncodedMessage
+    """
+    result = EncodedMessage()
+    records = result.records
+    timestamps = []
+    data = decode_payload(payload, encoding)
+    # Multi Part (Bulk) Message = data is of type list and holds multiple messages
+    if isinstance(data, list):
+        # agg_data and event packets are collected and encoded in one batch each
+        aggdata_list = []
+        eventdata_list = []
+        for data_packet in data:
+            subtopic_parts = data_packet["subtopic"].split("/")
+            data_type = subtopic_parts[-2]
+            encoding = subtopic_parts[-1]
+            data_snippet = decode_payload(data_packet["payload"], encoding)
+            if data_type == "dataseries":
+                records.append(_encode_dataseries(device, data_snippet["data"], options, result))
+                timestamps.append(_newest_dataseries_timestamp(data_snippet["data"]))
+            elif data_type == "agg_data":
+                aggdata_list.append(data_snippet)
+                timestamps.append(data_snippet["timestamp"])
+            elif data_type == "event":
+                eventdata_list.append(data_snippet)
+                timestamps.append(data_snippet["timestamp"])
+        if aggdata_list:
+            records.append(encode_aggdata_batch(device, aggdata_list, options))
+        if eventdata_list:
+            records.append(encode_eventdata_batch(device, eventdata_list, options))
+    # Single Part Messages
+    elif data_type == "dataseries":
+        records.append(_encode_dataseries(device, data["data"], options, result))
+        timestamps.append(_newest_dataseries_timestamp(data["data"]))
+    elif data_type == "agg_data":
+        records.append(encode_aggdata(device, data, options))
+        timestamps.append(data["timestamp"])
+    elif data_type == "event":
+        records.append(encode_eventdata(device, data, options))
+        timestamps.append(data["timestamp"])
+    else:
+        logger.warning(f"Datatype {data_type} not implemented")
+    result.newest_ts = max((ts for ts in timestamps if ts is not None), default=None)
+    return result
@@ -0,0 +1,144 @@
+import asyncio
+import bisect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_ESCAPE_LABEL = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{str(value).translate(_ESCAPE_LABEL)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values = {}
+
+    def inc(self, amount: float = 1, *label_values):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_values, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+class Gauge:
+    """
+    Gauge with set values or, if given, values collected by callback() -> {label_values: value}
+    """
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.callback = callback
+        self._values = {}
+
+    def set(self, value: float, *label_values):
+        self._values[label_values] = value
+
+    def set_max(self, value: float, *label_values):
+        if value > self._values.get(label_values, float("-inf")):
+            self._values[label_values] = value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        values = self.callback() if self.callback else self._values
+        for label_values, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: list[float], label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = sorted(buckets)
+        self._values = {}
+
+    def observe(self, value: float, *label_values):
+        data = self._values.get(label_values)
+        if data is None:
+            data = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            self._values[label_values] = data
+        data["counts"][bisect.bisect_left(self.buckets, value)] += 1
+        data["sum"] += value
+        data["count"] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, data in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + [float("inf")], data["counts"]):
+                cumulative += count
+                le_label = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, label_values)} {data['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, label_values)} {data['count']}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+SIZE_BUCKETS = [1e3, 1e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7]
+
+MESSAGES = REGISTRY.register(Counter("pqopen_ingest_messages_total", "Received MQTT messages", ("data_type", "device_id")))
+DROPPED_MESSAGES = REGISTRY.register(Counter("pqopen_ingest_dropped_messages_total", "Messages dropped on full queue", ("device_id",)))
+ERRORS = REGISTRY.register(Counter("pqopen_ingest_errors_total", "Errors per stage", ("stage",)))
+DECODE_SECONDS = REGISTRY.register(Histogram("pqopen_ingest_decode_seconds", "Time to decode and convert a message", LATENCY_BUCKETS, ("data_type",)))
+WRITE_SECONDS = REGISTRY.register(Histogram("pqopen_ingest_write_seconds", "Latency of database writes", LATENCY_BUCKETS, ("bucket",)))
+WRITE_BATCH_BYTES = REGISTRY.register(Histogram("pqopen_ingest_write_batch_bytes", "Size of written batches in bytes", SIZE_BUCKETS, ("bucket",)))
+WRITE_BATCH_LINES = REGISTRY.register(Histogram("pqopen_ingest_write_batch_lines", "Number of lines of written batches", [10, 100, 500, 1000, 2500, 5000, 10000, 50000], ("bucket",)))
+SPOOLED_BYTES = REGISTRY.register(Counter("pqopen_ingest_spooled_bytes_total", "Bytes written to the spool", ("bucket",)))
+ROLLUP_LATE_SAMPLES = REGISTRY.register(Counter("pqopen_ingest_rollup_late_samples_total", "Samples dropped from rollups behind the watermark", ("device_id",)))
+QUEUE_DEPTH = REGISTRY.register(Gauge("pqopen_ingest_queue_depth", "Queued messages per worker shard", ("shard",)))
+NEWEST_SAMPLE = REGISTRY.register(Gauge("pqopen_ingest_newest_sample_timestamp_seconds", "Timestamp of the newest sample per device", ("device_id",)))
+INGEST_LAG = REGISTRY.register(Gauge("pqopen_ingest_lag_seconds", "Now minus timestamp of the newest sample per device", ("device_id",),
+                                     callback=lambda: {labels: time.time() - ts for labels, ts in NEWEST_SAMPLE._values.items()}))
+
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        if request_line.split(b" ")[1:2] == [b"/metrics"]:
+            body = REGISTRY.render().encode()
+            status = b"200 OK"
+        else:
+            body = b"Not Found\n"
+            status = b"404 Not Found"
+        writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     + f"Content-Length: {len(body):d}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except Exception as e:
+        logger.warning(f"Metrics request failed: {str(e)}")
+    finally:
+        writer.close()
+
+async def start_metrics_server(host: str, port: int) -> asyncio.Server:
+    """
+    Serve the registered metrics in Prometheus text format on http://{host}:{port}/metrics
+    """
+    server = await asyncio.start_server(_handle_request, host, port)
+    logger.info(f"Metrics endpoint on {host}:{port:d}/metrics")
+    return server
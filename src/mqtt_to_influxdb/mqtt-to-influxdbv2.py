@@ -1,20 +1,22 @@
-
 import asyncio
 import aiomqtt
 import ssl
-import orjson
-import gzip
 import logging
 import os
 import signal
-import cbor2
-import math
 from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
-from influxdb_client.client.write_api import WriteApi
 
-from dataconverter import convert_dataseries_to_df, cbc_dict_to_line_protocol, agg_dict_to_line_protocol
+from batchwriter import BatchWriter
+from deviceregistry import DeviceRegistry
+from spool import WriteSpool
+from pipeline import IngestPipeline, create_decode_executor
+from messagehandler import EncoderOptions
+from rollup import RollupAggregator
+from recentbuffer import RecentDataBuffer, start_recent_buffer_server
+from scaleout import check_scale_config, device_shard, instance_client_id, subscription_topics, topic_base
+import metrics
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=os.getenv("PQOPEN_INGEST_LOG_LEVEL", "DEBUG"), format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 app_env = os.getenv("DAQOPEN_ENV", "development")
@@ -31,53 +33,56 @@ MQTT_PASSWORD = os.getenv("PQOPEN_MQTT_PASSWORD")
 MQTT_USE_TLS = True if os.getenv("PQOPEN_MQTT_USE_TLS", "True") == "True" else False
 MQTT_TOPIC = os.getenv("PQOPEN_MQTT_TOPIC", "private/#")
 MQTT_CLIENT_ID = os.getenv("PQOPEN_MQTT_CLIENT_ID", "mqtt-to-database")
+# Scale-out: single instance, shared subscription group or device shards per instance
+SCALE_MODE = os.getenv("PQOPEN_INGEST_SCALE_MODE", "single")
+SHARE_GROUP = os.getenv("PQOPEN_INGEST_SHARE_GROUP", "mqtt-to-database")
+INSTANCE_INDEX = int(os.getenv("PQOPEN_INGEST_INSTANCE_INDEX")) if os.getenv("PQOPEN_INGEST_INSTANCE_INDEX") else None
+INSTANCE_COUNT = int(os.getenv("PQOPEN_INGEST_INSTANCE_COUNT", 1))
+# Stable id of the instance in the MQTT client id (persistent session), the instance index if not set
+INSTANCE_ID = os.getenv("PQOPEN_INGEST_INSTANCE_ID") or (str(INSTANCE_INDEX) if INSTANCE_INDEX is not None else None)
 INFLUXDB_URL = os.getenv("PQOPEN_INFLUXDB_URL", "http://localhost:8086")
 INFLUXDB_TOKEN = os.getenv("PQOPEN_INFLUXDB_TOKEN", "")
 INFLUXDB_ORG = os.getenv("PQOPEN_INFLUXDB_ORG", "pqopen")
+WRITE_GZIP = True if os.getenv("PQOPEN_INGEST_WRITE_GZIP", "True") == "True" else False
+# Line protocol encoding: timestamp precision per data type (s, ms, us, ns) and float format
+# ("fixed" 6 decimals, "shortest" round-trip representation or printf spec like "%.7g")
+PRECISION_DATASERIES = os.getenv("PQOPEN_INGEST_PRECISION_DATASERIES", "us")
+PRECISION_AGGREGATED = os.getenv("PQOPEN_INGEST_PRECISION_AGGREGATED", "s")
+PRECISION_EVENT = os.getenv("PQOPEN_INGEST_PRECISION_EVENT", "ms")
+FLOAT_FORMAT = os.getenv("PQOPEN_INGEST_FLOAT_FORMAT", "fixed")
+# Rollups (min/max/mean/stddev/count) of the dataseries per window in seconds, e.g. "1,10,60" (disabled if empty)
+ROLLUP_WINDOWS = tuple(int(window_sec) for window_sec in os.getenv("PQOPEN_INGEST_ROLLUP_WINDOWS", "").split(",") if window_sec.strip())
+ROLLUP_ALLOWED_LATENESS = float(os.getenv("PQOPEN_INGEST_ROLLUP_ALLOWED_LATENESS", 5.0))
+# Default (empty): twice the largest window plus the allowed lateness
+ROLLUP_IDLE_TIMEOUT = float(os.getenv("PQOPEN_INGEST_ROLLUP_IDLE_TIMEOUT")) if os.getenv("PQOPEN_INGEST_ROLLUP_IDLE_TIMEOUT") else None
+ROLLUP_MEASUREMENT = os.getenv("PQOPEN_INGEST_ROLLUP_MEASUREMENT", "cycle-by-cycle-rollup")
+# Ring buffer of the newest dataseries per channel, served to the API on a Unix socket (disabled with empty path)
+RECENT_BUFFER_SOCKET = os.getenv("PQOPEN_INGEST_RECENT_BUFFER_SOCKET", "")
+RECENT_BUFFER_SECONDS = float(os.getenv("PQOPEN_INGEST_RECENT_BUFFER_SECONDS", 300))
+RECENT_BUFFER_MAX_RATE = float(os.getenv("PQOPEN_INGEST_RECENT_BUFFER_MAX_RATE", 60))
+BATCH_MAX_BYTES = int(os.getenv("PQOPEN_INGEST_BATCH_MAX_BYTES", 4_000_000))
+BATCH_MAX_LINES = int(os.getenv("PQOPEN_INGEST_BATCH_MAX_LINES", 5000))
+BATCH_MAX_LATENCY = float(os.getenv("PQOPEN_INGEST_BATCH_MAX_LATENCY", 1.0))
+BATCH_MAX_PENDING_FLUSHES = int(os.getenv("PQOPEN_INGEST_BATCH_MAX_PENDING_FLUSHES", 4))
+WRITE_TIMEOUT = float(os.getenv("PQOPEN_INGEST_WRITE_TIMEOUT", 10.0))
+# Write spool directory, absolute path (empty disables)
+SPOOL_PATH = os.getenv("PQOPEN_INGEST_SPOOL_PATH", "")
+SPOOL_MAX_BYTES = int(os.getenv("PQOPEN_INGEST_SPOOL_MAX_BYTES", 1_000_000_000))
+SPOOL_SEGMENT_BYTES = int(os.getenv("PQOPEN_INGEST_SPOOL_SEGMENT_BYTES", 16_000_000))
+SPOOL_REPLAY_MAX_BYTES = int(os.getenv("PQOPEN_INGEST_SPOOL_REPLAY_MAX_BYTES", 8_000_000))
+DEVICE_CONFIG_PATH = os.getenv("PQOPEN_INGEST_DEVICE_CONFIG", "config/device_config.json")
+DEVICE_CONFIG_RELOAD_INTERVAL = float(os.getenv("PQOPEN_INGEST_DEVICE_CONFIG_RELOAD_INTERVAL", 5.0))
+METRICS_HOST = os.getenv("PQOPEN_INGEST_METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("PQOPEN_INGEST_METRICS_PORT", 0))
+INGEST_WORKERS = int(os.getenv("PQOPEN_INGEST_WORKERS", 4))
+INGEST_QUEUE_SIZE = int(os.getenv("PQOPEN_INGEST_QUEUE_SIZE", 1000))
+INGEST_QUEUE_POLICY = os.getenv("PQOPEN_INGEST_QUEUE_POLICY", "block")
+DECODE_EXECUTOR = os.getenv("PQOPEN_INGEST_DECODE_EXECUTOR", "none")
+DECODE_WORKERS = int(os.getenv("PQOPEN_INGEST_DECODE_WORKERS", 0)) or None
+DECODE_INLINE_MAX_BYTES = int(os.getenv("PQOPEN_INGEST_DECODE_INLINE_MAX_BYTES", 16384))
 
-location_cache = {}
-
-def decode_payload(payload: bytes, encoding: str):
-    if encoding == "gjson":
-        payload_dict = orjson.loads(gzip.decompress(payload))
-    elif encoding == "json":
-        payload_dict = orjson.loads(payload)
-    elif encoding == "cbor":
-        payload_dict = cbor2.loads(payload)
-
-    return payload_dict
-
-async def mqtt_listener(write_api: WriteApi, device_config: dict, stop_event: asyncio.Event):
-    async def write_dataseries(device_config, data):
-        tags = {"location_name": device_config["location_name"],
-                "location_lat": device_config["location_lat"],
-                "location_lon": device_config["location_lon"]}
-        lp_data = cbc_dict_to_line_protocol(m_data=data, tags=tags)
-        await write_api.write(bucket=device_config.get("db_dataseries_bucket", "short_term"), 
-                              record=lp_data)
-        
-    async def write_aggdata(device_config, data):
-        tags = {"interval_sec": data["interval_sec"],
-                "location_name": device_config["location_name"],
-                "location_lat": device_config["location_lat"],
-                "location_lon": device_config["location_lon"]}
-        
-        lp_data = agg_dict_to_line_protocol(m_data=data, tags=tags)
-        await write_api.write(bucket=device_config.get("db_aggregated_bucket", "long_term"),
-                              record=lp_data)
-    
-    async def write_eventdata(device_config, data):
-        json_body = {'measurement': 'event-data',
-                     'tags': {'event_type': data["event_type"],
-                              'channel': data["channel"],
-                              'location_name': device_config["location_name"],
-                              'location_lat': device_config["location_lat"],
-                              'location_lon': device_config["location_lon"]},
-                     'time': int(data['timestamp']*1e9),
-                     'fields': data["data"]}
-        await write_api.write(bucket=device_config.get("db_event_bucket", "long_term"),
-                              record=json_body)
-
+async def mqtt_listener(pipeline: IngestPipeline, device_registry: DeviceRegistry, stop_event: asyncio.Event,
+                        client_id: str):
     # Create TLS Kontext
     if MQTT_USE_TLS:
         tls_context = ssl.create_default_context()
@@ -87,57 +92,70 @@ async def mqtt_listener(write_api: WriteApi, device_config: dict, stop_event: as
         tls_context = None
         tls_insecure = None
         logger.debug("Don't use TLS")
-    async with aiomqtt.Client(MQTT_HOST, port=MQTT_PORT, username=MQTT_USERNAME, password=MQTT_PASSWORD, tls_insecure=tls_insecure, tls_context=tls_context, identifier=MQTT_CLIENT_ID, clean_session=mqtt_clean_session) as client:
-        await client.subscribe(MQTT_TOPIC, 2)
-        topic_prefix = MQTT_TOPIC.split("/#")[0]
-        topic_prefix_num_parts = len(topic_prefix.split("/"))
-        async for message in client.messages:
-            if stop_event.is_set():
-                break
-            try:
-                parts = message.topic.value.split("/") # {topic-prefix}/{device-id}/{data-type}/{encoding}
-                if len(parts) < (topic_prefix_num_parts + 3):
-                    logger.warning(f"Unerwartetes Topic-Format: {message.topic}")
-                    continue
-                device_id, data_type, encoding = parts[-3], parts[-2], parts[-1]
-                if device_id in device_config:
-                    data = decode_payload(message.payload, encoding)
-                    # Multi Part (Bulk) Message = data is of type list and holds multiple messages
-                    if isinstance(data, list):
-                        for data_packet in data:
-                            subtopic_parts = data_packet["subtopic"].split("/")
-                            data_type = subtopic_parts[-2]
-                            encoding = subtopic_parts[-1]
-                            data_snippet = decode_payload(data_packet["payload"], encoding)
-                            if data_type == "dataseries":
-                                await write_dataseries(device_config=device_config[device_id], data=data_snippet["data"])
-                                logger.debug("data Sent")
-                            elif data_type == "agg_data":
-                                await write_aggdata(device_config=device_config[device_id], data=data_snippet)
-                            elif data_type == "event":
-                                await write_eventdata(device_config=device_config[device_id], data=data_snippet)
-                    # Single Part Messages
-                    # Dataseries Message
-                    elif data_type == "dataseries":
-                        await write_dataseries(device_config=device_config[device_id], data=data["data"])
-                        logger.debug("Dataseries written to DB")
-                    # Aggregated Data Message
-                    elif data_type == "agg_data":
-                        await write_aggdata(device_config=device_config[device_id], data=data)
-                        logger.debug("Agg-Data written to DB")
-                    # Event Data Message
-                    elif data_type == "event":
-                        await write_eventdata(device_config=device_config[device_id], data=data)
-                        logger.debug("Event Data written to DB")
+    sharded = SCALE_MODE == "sharded"
+    shard_index = INSTANCE_INDEX if sharded else 0
+    logger.info(f"Scale mode {SCALE_MODE}, client id {client_id}")
+    async with aiomqtt.Client(MQTT_HOST, port=MQTT_PORT, username=MQTT_USERNAME, password=MQTT_PASSWORD, tls_insecure=tls_insecure, tls_context=tls_context, identifier=client_id, clean_session=mqtt_clean_session) as client:
+        subscribed_topics = set()
+
+        async def update_subscriptions():
+            topics = set(subscription_topics(SCALE_MODE, MQTT_TOPIC, device_registry.device_ids(), share_group=SHARE_GROUP,
+                                             instance_index=shard_index, instance_count=INSTANCE_COUNT))
+            for topic in sorted(topics - subscribed_topics):
+                await client.subscribe(topic, 2)
+            for topic in sorted(subscribed_topics - topics):
+                await client.unsubscribe(topic)
+            subscribed_topics.clear()
+            subscribed_topics.update(topics)
+            logger.info(f"Subscribed to {len(topics):d} topics")
+
+        async def watch_device_shards():
+            # Follow device config changes with the per-device subscriptions
+            registry_version = device_registry.version
+            while True:
+                await asyncio.sleep(DEVICE_CONFIG_RELOAD_INTERVAL)
+                if device_registry.version != registry_version:
+                    registry_version = device_registry.version
+                    await update_subscriptions()
+
+        if sharded:
+            # The persistent session may still hold subscriptions of other shards (changed instance count)
+            for device_id in device_registry.device_ids():
+                if device_shard(device_id, INSTANCE_COUNT) != shard_index:
+                    await client.unsubscribe(f"{topic_base(MQTT_TOPIC)}/{device_id}/#")
+        await update_subscriptions()
+        shard_task = asyncio.create_task(watch_device_shards()) if sharded else None
+        topic_prefix_num_parts = len(topic_base(MQTT_TOPIC).split("/"))
+        try:
+            async for message in client.messages:
+                if stop_event.is_set():
+                    break
+                try:
+                    parts = message.topic.value.split("/") # {topic-prefix}/{device-id}/{data-type}/{encoding}
+                    if len(parts) < (topic_prefix_num_parts + 3):
+                        logger.warning(f"Unerwartetes Topic-Format: {message.topic}")
+                        continue
+                    device_id, data_type, encoding = parts[-3], parts[-2], parts[-1]
+                    if sharded and device_shard(device_id, INSTANCE_COUNT) != shard_index:
+                        logger.warning(f"Device {device_id} not in shard {shard_index:d}")
+                    elif device_id in device_registry:
+                        await pipeline.put(device_id, data_type, encoding, message.payload)
                     else:
-                        logger.warning(f"Datatype {data_type} not implemented")
-                else:
-                    logger.warning(f"Device {device_id} not configured")
-            except Exception as e:
-                logger.error(f"Fehler bei Nachricht: {str(e)}")
+                        logger.warning(f"Device {device_id} not configured")
+                except Exception as e:
+                    metrics.ERRORS.inc(1, "receive")
+                    logger.error(f"Fehler bei Nachricht: {str(e)}")
+        finally:
+            if shard_task is not None:
+                shard_task.cancel()
 
 
 async def main():
+    # Fail at startup on scale-out configs consuming devices twice or never
+    check_scale_config(SCALE_MODE, INSTANCE_INDEX, INSTANCE_COUNT)
+    if SPOOL_PATH and not os.path.isabs(SPOOL_PATH):
+        raise ValueError(f"Spool path must be absolute, got {SPOOL_PATH}")
+    client_id = instance_client_id(MQTT_CLIENT_ID, SCALE_MODE, INSTANCE_ID, persistent_session=not mqtt_clean_session)
     stop_event = asyncio.Event()
 
     def shutdown():
@@ -151,17 +169,87 @@ async def main():
     # DB-Connection
     db_client = InfluxDBClientAsync(url=INFLUXDB_URL, 
                                     token=INFLUXDB_TOKEN, 
-                                    org=INFLUXDB_ORG)
+                                    org=INFLUXDB_ORG,
+                                    enable_gzip=WRITE_GZIP)
     write_api = db_client.write_api()
-    # Load Device Config
-    with open("config/device_config.json") as f:
-        device_config = orjson.loads(f.read())
+    # Spool for batches which can't be written to the database (disabled with empty path)
+    spool = WriteSpool(SPOOL_PATH, segment_size=SPOOL_SEGMENT_BYTES, max_bytes=SPOOL_MAX_BYTES) if SPOOL_PATH else None
+    batch_writer = BatchWriter(write_api,
+                               max_bytes=BATCH_MAX_BYTES,
+                               max_lines=BATCH_MAX_LINES,
+                               max_latency=BATCH_MAX_LATENCY,
+                               max_pending_flushes=BATCH_MAX_PENDING_FLUSHES,
+                               spool=spool,
+                               write_timeout=WRITE_TIMEOUT)
+    # Load Device Config (reloaded on changes by the watch task)
+    device_registry = DeviceRegistry(DEVICE_CONFIG_PATH)
+
+    decode_executor = create_decode_executor(DECODE_EXECUTOR, DECODE_WORKERS)
+    # In shared scale mode, an instance receives only part of the messages of a device
+    recent_buffer_enabled = bool(RECENT_BUFFER_SOCKET) and SCALE_MODE != "shared"
+    if RECENT_BUFFER_SOCKET and not recent_buffer_enabled:
+        logger.warning("Recent data buffer not available in shared scale mode, disabled")
+    # Partial rollups of several instances would overwrite each other (same series and timestamp)
+    rollup_windows = ROLLUP_WINDOWS if SCALE_MODE != "shared" else ()
+    if ROLLUP_WINDOWS and not rollup_windows:
+        logger.warning("Rollups not available in shared scale mode, disabled")
+    encoder_options = EncoderOptions(dataseries_precision=PRECISION_DATASERIES,
+                                     aggregated_precision=PRECISION_AGGREGATED,
+                                     event_precision=PRECISION_EVENT,
+                                     float_format=FLOAT_FORMAT,
+                                     rollup_windows=rollup_windows,
+                                     keep_dataseries=recent_buffer_enabled)
+    rollup = RollupAggregator(windows=rollup_windows,
+                              allowed_lateness=ROLLUP_ALLOWED_LATENESS,
+                              idle_timeout=ROLLUP_IDLE_TIMEOUT,
+                              measurement=ROLLUP_MEASUREMENT,
+                              float_format=encoder_options.float_format) if rollup_windows else None
+    recent_buffer = RecentDataBuffer(capacity=int(RECENT_BUFFER_SECONDS * RECENT_BUFFER_MAX_RATE),
+                                     float_format=encoder_options.float_format) if recent_buffer_enabled else None
+    pipeline = IngestPipeline(batch_writer, device_registry,
+                              num_workers=INGEST_WORKERS,
+                              queue_size=INGEST_QUEUE_SIZE,
+                              queue_policy=INGEST_QUEUE_POLICY,
+                              decode_executor=decode_executor,
+                              decode_inline_max_bytes=DECODE_INLINE_MAX_BYTES,
+                              encoder_options=encoder_options,
+                              rollup=rollup,
+                              recent_buffer=recent_buffer)
 
+    # Optional Prometheus metrics endpoint (disabled with port 0)
+    metrics_server = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    recent_buffer_server = await start_recent_buffer_server(recent_buffer, RECENT_BUFFER_SOCKET) if recent_buffer else None
+
+    writer_stop_event = asyncio.Event()
+    writer_task = asyncio.create_task(batch_writer.run(writer_stop_event))
+    replay_task = asyncio.create_task(batch_writer.run_replay(writer_stop_event, max_batch_bytes=SPOOL_REPLAY_MAX_BYTES)) if spool else None
+    pipeline_task = asyncio.create_task(pipeline.run(stop_event))
+    registry_task = asyncio.create_task(device_registry.watch(stop_event, interval=DEVICE_CONFIG_RELOAD_INTERVAL))
+    listener_task = asyncio.create_task(mqtt_listener(pipeline, device_registry, stop_event, client_id))
+    stop_task = asyncio.create_task(stop_event.wait())
     try:
-        await mqtt_listener(write_api, device_config, stop_event)
+        await asyncio.wait([listener_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+        if listener_task.done():
+            listener_task.result()
     except Exception as e:
         print("MQTT-Error:", e)
     finally:
+        # Stop consuming messages, process the queued messages and write the remaining buffered data
+        listener_task.cancel()
+        stop_task.cancel()
+        stop_event.set()
+        await pipeline_task
+        await registry_task
+        writer_stop_event.set()
+        if replay_task is not None:
+            await replay_task
+        await writer_task
+        if decode_executor is not None:
+            decode_executor.shutdown()
+        if metrics_server is not None:
+            metrics_server.close()
+        if recent_buffer_server is not None:
+            recent_buffer_server.close()
         await db_client.__aexit__(None, None, None)
         logger.info("Client closed.")
 
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+import zlib
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+
+from batchwriter import BatchWriter
+from deviceregistry import DeviceRegistry
+from messagehandler import encode_message, EncoderOptions, EncodedMessage, DEFAULT_ENCODER_OPTIONS
+from rollup import RollupAggregator
+from recentbuffer import RecentDataBuffer
+import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUE_POLICIES = ("block", "drop_newest", "drop_oldest")
+
+def create_decode_executor(kind: str, max_workers: int | None = None) -> Executor | None:
+    """
+    Create executor for payload decoding: "process", "thread" (for GIL releasing codecs) or "none"
+    """
+    if kind == "process":
+        return ProcessPoolExecutor(max_workers=max_workers)
+    elif kind == "thread":
+        return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="decode")
+    elif kind == "none":
+        return None
+    raise ValueError(f"Decode executor must be one of ['process', 'thread', 'none'], got {kind}")
+
+class IngestPipeline:
+    """
+    Decode/convert stage between MQTT receive loop and batch writer
+
+    Messages are sharded by device_id to num_workers bounded queues, each queue is
+    processed by one worker task. This keeps the order of messages within a device
+    while different devices are processed independently. If a queue is full, the
+    queue_policy decides: "block" waits for a free slot (backpressure to the receive
+    loop), "drop_newest" discards the incoming message, "drop_oldest" discards the
+    oldest queued message.
+
+    With a decode_executor, payloads of at least decode_inline_max_bytes are decoded and
+    converted to line protocol in the executor, so only the encoded bytes return to the
+    event loop. Smaller payloads are processed inline. encoder_options (write precisions,
+    float format) are passed to the encoder and must be picklable for a process executor.
+
+    With a rollup aggregator, the window statistics computed by the encoder (for the
+    encoder_options.rollup_windows) are merged per device and the closed windows are
+    written as well. Open windows are written when the pipeline stops. With a recent data
+    buffer, the decoded dataseries blocks (encoder_options.keep_dataseries) are added to it.
+    """
+    def __init__(self, batch_writer: BatchWriter, device_registry: DeviceRegistry, num_workers: int = 4,
+                 queue_size: int = 1000, queue_policy: str = "block",
+                 decode_executor: Executor | None = None, decode_inline_max_bytes: int = 16384,
+                 encoder_options: EncoderOptions = DEFAULT_ENCODER_OPTIONS, rollup: RollupAggregator | None = None,
+                 recent_buffer: RecentDataBuffer | None = None):
+        if queue_policy not in QUEUE_POLICIES:
+            raise ValueError(f"Queue policy must be one of {QUEUE_POLICIES}, got {queue_policy}")
+        self.batch_writer = batch_writer
+        self.device_registry = device_registry
+        self.queue_policy = queue_policy
+        self.decode_executor = decode_executor
+        self.decode_inline_max_bytes = decode_inline_max_bytes
+        self.encoder_options = encoder_options
+        self.rollup = rollup
+        self.recent_buffer = recent_buffer
+        self.queues = [asyncio.Queue(maxsize=queue_size) for _ in range(num_workers)]
+        self.num_dropped = 0
+        metrics.QUEUE_DEPTH.callback = lambda: {(str(idx),): queue.qsize() for idx, queue in enumerate(self.queues)}
+
+    def _get_queue(self, device_id: str) -> asyncio.Queue:
+        return self.queues[zlib.crc32(device_id.encode()) % len(self.queues)]
+
+    async def put(self, device_id: str, data_type: str, encoding: str, payload: bytes):
+        """
+        Receive stage: enqueue a message to the shard of the device
+        """
+        metrics.MESSAGES.inc(1, data_type, device_id)
+        queue = self._get_queue(device_id)
+        item = (device_id, data_type, encoding, payload)
+        if self.queue_policy == "block":
+            await queue.put(item)
+            return
+        if queue.full():
+            self.num_dropped += 1
+            metrics.DROPPED_MESSAGES.inc(1, device_id)
+            logger.warning(f"Queue full, dropping {self.queue_policy.split('_')[1]} message (device {device_id})")
+            if self.queue_policy == "drop_newest":
+                return
+            queue.get_nowait()
+            queue.task_done()
+        queue.put_nowait(item)
+
+    async def _encode(self, device_id: str, data_type: str, encoding: str, payload: bytes):
+        device = self.device_registry.get(device_id)
+        if device is None:
+            logger.warning(f"Device {device_id} not configured")
+            return EncodedMessage()
+        if self.decode_executor is None or len(payload) < self.decode_inline_max_bytes:
+            return encode_message(device, data_type, encoding, payload, self.encoder_options)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.decode_executor, encode_message,
+                                          device, data_type, encoding, payload, self.encoder_options)
+
+    async def _write_records(self, records: list):
+        for bucket, precision, record in records:
+            await self.batch_writer.write(bucket=bucket, record=record, precision=precision)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            device_id, data_type, encoding, payload = await queue.get()
+            try:
+                start = time.perf_counter()
+                result = await self._encode(device_id, data_type, encoding, payload)
+                metrics.DECODE_SECONDS.observe(time.perf_counter() - start, data_type)
+                if result.newest_ts is not None:
+                    metrics.NEWEST_SAMPLE.set_max(result.newest_ts, device_id)
+                records = result.records
+                device = self.device_registry.get(device_id)
+                if result.rollup_partials and self.rollup is not None and device is not None:
+                    records += self.rollup.add(device, result.rollup_partials, result.newest_ts)
+                if result.dataseries_blocks and self.recent_buffer is not None and device is not None:
+                    self.recent_buffer.add(device.dataseries_bucket, device.location_name, result.dataseries_blocks)
+                await self._write_records(records)
+            except Exception as e:
+                metrics.ERRORS.inc(1, "decode")
+                logger.error(f"Fehler bei Nachricht: {str(e)}")
+            finally:
+                queue.task_done()
+
+    async def run(self, stop_event: asyncio.Event):
+        """
+        Run the workers until stop_event is set, then process the remaining queued messages
+        """
+        workers = [asyncio.create_task(self._worker(queue)) for queue in self.queues]
+        while not stop_event.is_set():
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+            if self.rollup is not None:
+                await self._write_records(self.rollup.expire_idle())
+        for queue in self.queues:
+            await queue.join()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if self.rollup is not None:
+            await self._write_records(self.rollup.flush_all())
+        logger.info("Ingest pipeline drained.")
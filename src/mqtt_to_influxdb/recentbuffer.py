@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+
+import numpy as np
+import orjson
+
+logger = logging.getLogger(__name__)
+
+class ChannelRing:
+    """
+    Fixed size ring buffer of the newest samples (timestamps in us, values) of one channel
+
+    covered_from is the oldest timestamp from which on the ring holds every sample received
+    for the channel. It moves forward when the ring wraps or when an out-of-order sample
+    (older than the newest one) had to be dropped.
+    """
+    def __init__(self, capacity: int):
+        self.timestamps = np.empty(capacity, dtype=np.int64)
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.capacity = capacity
+        self.size = 0
+        self.end = 0
+        self.covered_from = None
+        self.newest = None
+
+    def append(self, timestamps: np.ndarray, values: np.ndarray):
+        if self.newest is not None and len(timestamps) and timestamps[0] <= self.newest:
+            # Out-of-order block: keep only the newer part, the ring is incomplete before
+            in_order = timestamps > self.newest
+            timestamps = timestamps[in_order]
+            values = values[in_order]
+            self.covered_from = self.newest + 1
+        if len(timestamps) == 0:
+            return
+        if len(timestamps) > self.capacity:
+            timestamps = timestamps[-self.capacity:]
+            values = values[-self.capacity:]
+        if self.covered_from is None:
+            self.covered_from = int(timestamps[0])
+        num_samples = len(timestamps)
+        first_part = min(num_samples, self.capacity - self.end)
+        self.timestamps[self.end:self.end + first_part] = timestamps[:first_part]
+        self.values[self.end:self.end + first_part] = values[:first_part]
+        self.timestamps[:num_samples - first_part] = timestamps[first_part:]
+        self.values[:num_samples - first_part] = values[first_part:]
+        self.end = (self.end + num_samples) % self.capacity
+        self.size = min(self.size + num_samples, self.capacity)
+        self.newest = int(timestamps[-1])
+        if self.size == self.capacity:
+            self.covered_from = max(self.covered_from, int(self.timestamps[self.end]))
+
+    def read(self, start_us: int, stop_us: int):
+        """
+        Samples with start_us <= timestamp < stop_us
+        """
+        if self.size < self.capacity:
+            timestamps, values = self.timestamps[:self.size], self.values[:self.size]
+        else:
+            timestamps = np.concatenate((self.timestamps[self.end:], self.timestamps[:self.end]))
+            values = np.concatenate((self.values[self.end:], self.values[:self.end]))
+        start_idx, stop_idx = np.searchsorted(timestamps, [start_us, stop_us])
+        return timestamps[start_idx:stop_idx], values[start_idx:stop_idx]
+
+class RecentDataBuffer:
+    """
+    Newest dataseries samples per (bucket, location) and channel, served to the API
+
+    Each channel keeps at most capacity samples in a ChannelRing. Non-finite values are
+    not stored, as they are not written to the database either. Values are read rounded
+    with the printf style float_format of the line protocol, so they are identical to
+    the values in the database.
+    """
+    def __init__(self, capacity: int, float_format: str = "%f"):
+        self.capacity = capacity
+        self.float_format = float_format
+        self._locations = {}
+
+    def add(self, bucket: str, location: str, blocks: list):
+        """
+        Add the aligned dataseries blocks (channel names, timestamps in us, values) of one message
+        """
+        channels = self._locations.setdefault((bucket, location), {})
+        for ch_names, timestamps, values in blocks:
+            finite = np.isfinite(values)
+            for ch_name, ch_values, ch_finite in zip(ch_names, values, finite):
+                ring = channels.get(ch_name)
+                if ring is None:
+                    ring = ChannelRing(self.capacity)
+                    channels[ch_name] = ring
+                if ch_finite.all():
+                    ring.append(timestamps, ch_values)
+                else:
+                    ring.append(timestamps[ch_finite], ch_values[ch_finite])
+
+    def read(self, bucket: str, location: str, channels: list, start_us: int, stop_us: int) -> list | None:
+        """
+        Samples of the channels (all channels if empty) in [start_us, stop_us)
+
+        Returns a list of (channel name, timestamps, values) or None if the buffer does not
+        hold all samples of the range for all channels.
+        """
+        location_channels = self._locations.get((bucket, location))
+        if not location_channels:
+            return None
+        ch_names = channels or sorted(location_channels)
+        result = []
+        for ch_name in ch_names:
+            ring = location_channels.get(ch_name)
+            if ring is None or ring.covered_from is None or start_us < ring.covered_from:
+                return None
+            timestamps, values = ring.read(start_us, stop_us)
+            values = np.array([float(self.float_format % value) for value in values.tolist()], dtype=np.float64)
+            result.append((ch_name, timestamps, values))
+        return result
+
+async def _handle_request(buffer: RecentDataBuffer, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    # Request: one JSON line {bucket, location, channels, start_us, stop_us}
+    # Response: JSON line {covered, channels: [[name, num_samples], ...]}, then per channel
+    # the timestamps (int64) and values (float64) as little-endian raw bytes
+    try:
+        request = orjson.loads(await reader.readline())
+        result = buffer.read(request["bucket"], request["location"], request.get("channels", []),
+                             request["start_us"], request["stop_us"])
+        if result is None:
+            writer.write(orjson.dumps({"covered": False}) + b"\n")
+        else:
+            header = {"covered": True, "channels": [[ch_name, len(timestamps)] for ch_name, timestamps, _ in result]}
+            writer.write(orjson.dumps(header) + b"\n")
+            for _, timestamps, values in result:
+                writer.write(timestamps.astype("<i8", copy=False).tobytes())
+                writer.write(values.astype("<f8", copy=False).tobytes())
+        await writer.drain()
+    except Exception as e:
+        logger.warning(f"Recent data request failed: {str(e)}")
+    finally:
+        writer.close()
+
+async def start_recent_buffer_server(buffer: RecentDataBuffer, path: str) -> asyncio.Server:
+    """
+    Serve the recent data buffer on the Unix socket at path
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(lambda reader, writer: _handle_request(buffer, reader, writer), path)
+    logger.info(f"Recent data buffer on unix socket {path}")
+    return server
@@ -0,0 +1,168 @@
+import logging
+import math
+import time
+
+import numpy as np
+
+from deviceregistry import DeviceEntry
+import metrics
+
+logger = logging.getLogger(__name__)
+
+def window_partials(timestamps: np.ndarray, values: np.ndarray, window_sec: int):
+    """
+    Statistics per time window of one block of aligned channels
+
+    timestamps are in us, values of shape (channels, samples). Returns the window start
+    timestamps in us and an array of shape (5, channels, windows) with count, mean,
+    sum of squared deviations from the mean (M2), min and max of the finite values.
+    """
+    if len(timestamps) == 0:
+        return np.empty(0, dtype=np.int64), np.empty((5, len(values), 0))
+    window_us = window_sec * 1_000_000
+    window_idx = timestamps // window_us
+    if np.any(window_idx[1:] < window_idx[:-1]):
+        order = np.argsort(window_idx, kind="stable")
+        window_idx = window_idx[order]
+        values = values[:, order]
+    starts = np.flatnonzero(np.r_[True, window_idx[1:] != window_idx[:-1]])
+    finite = np.isfinite(values)
+    values_nan = np.where(finite, values, np.nan)
+    count = np.add.reduceat(finite, starts, axis=1, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        mean = np.add.reduceat(np.where(finite, values, 0.0), starts, axis=1) / count
+    mean[count == 0] = 0.0
+    deviation = np.where(finite, values - np.repeat(mean, np.diff(np.r_[starts, len(window_idx)]), axis=1), 0.0)
+    m2 = np.add.reduceat(deviation * deviation, starts, axis=1)
+    minimum = np.fmin.reduceat(values_nan, starts, axis=1)
+    maximum = np.fmax.reduceat(values_nan, starts, axis=1)
+    return window_idx[starts] * window_us, np.stack([count, mean, m2, minimum, maximum])
+
+def dataseries_partials(groups: list, windows: tuple) -> list:
+    """
+    Window statistics of a dataseries message for all windows (seconds)
+
+    groups are the aligned channel blocks of group_channels_by_timestamps. Returns a list of
+    (window_sec, channel names, window starts in us, statistics) for RollupAggregator.add().
+    """
+    partials = []
+    for ch_names, timestamps, values in groups:
+        for window_sec in windows:
+            window_starts, stats = window_partials(timestamps, values, window_sec)
+            partials.append((window_sec, ch_names, window_starts, stats))
+    return partials
+
+class RollupAggregator:
+    """
+    Incremental min/max/mean/stddev/count of the dataseries channels per device and window
+
+    The per-message statistics (dataseries_partials) are merged into per-window accumulators
+    with the parallel algorithm of Chan et al., so the order of messages doesn't matter.
+    The watermark of a device is its newest sample timestamp minus allowed_lateness. A
+    window is closed and returned as line protocol when its end passes the watermark,
+    samples of already closed windows are dropped as late. Windows of devices without
+    dataseries for idle_timeout seconds are closed by expire_idle(). The idle timeout must
+    exceed the largest window plus allowed_lateness, otherwise devices publishing blocks
+    as long as a window get their windows closed early and their next samples dropped as
+    late. It defaults to twice the largest window plus allowed_lateness.
+    """
+    def __init__(self, windows: tuple = (1, 10, 60), allowed_lateness: float = 5.0, idle_timeout: float | None = None,
+                 measurement: str = "cycle-by-cycle-rollup", float_format: str = "%f"):
+        if not windows or any(int(window_sec) != window_sec or window_sec <= 0 for window_sec in windows):
+            raise ValueError(f"Rollup windows must be positive whole seconds, got {windows}")
+        self.windows = tuple(int(window_sec) for window_sec in windows)
+        self.allowed_lateness_us = int(allowed_lateness * 1_000_000)
+        min_idle_timeout = max(self.windows) + allowed_lateness
+        if idle_timeout is None:
+            idle_timeout = 2 * max(self.windows) + allowed_lateness
+        elif idle_timeout <= min_idle_timeout:
+            raise ValueError(f"Rollup idle timeout must exceed the largest window plus allowed lateness "
+                             f"({min_idle_timeout:g} s), got {idle_timeout:g} s")
+        self.idle_timeout = idle_timeout
+        self.measurement = measurement
+        self.float_format = float_format
+        self._devices = {}
+        self.num_late = 0
+
+    def add(self, device: DeviceEntry, partials: list, newest_ts: float | None) -> list:
+        """
+        Merge the partials of one message, returns (bucket, precision, line protocol) of closed windows
+        """
+        state = self._devices.get(device.device_id)
+        if state is None:
+            state = {"windows": {}, "watermark": 0}
+            self._devices[device.device_id] = state
+        state["device"] = device
+        state["last_seen"] = time.monotonic()
+        watermark = state["watermark"]
+        for window_sec, ch_names, window_starts, stats in partials:
+            late = window_starts + window_sec * 1_000_000 <= watermark
+            if late.any():
+                num_late = int(stats[0][:, late].sum())
+                self.num_late += num_late
+                metrics.ROLLUP_LATE_SAMPLES.inc(num_late, device.device_id)
+            for idx in np.flatnonzero(~late):
+                accumulators = state["windows"].setdefault((window_sec, int(window_starts[idx])), {})
+                for ch_name, (count, mean, m2, minimum, maximum) in zip(ch_names, stats[:, :, idx].T.tolist()):
+                    if count == 0:
+                        continue
+                    acc = accumulators.get(ch_name)
+                    if acc is None:
+                        accumulators[ch_name] = [count, mean, m2, minimum, maximum]
+                        continue
+                    total = acc[0] + count
+                    delta = mean - acc[1]
+                    acc[2] += m2 + delta * delta * acc[0] * count / total
+                    acc[1] += delta * count / total
+                    acc[0] = total
+                    acc[3] = min(acc[3], minimum)
+                    acc[4] = max(acc[4], maximum)
+        if newest_ts is not None:
+            state["watermark"] = max(watermark, int(newest_ts * 1_000_000) - self.allowed_lateness_us)
+        return self._close_windows(state, state["watermark"])
+
+    def expire_idle(self) -> list:
+        """
+        Close all windows of devices idle for more than idle_timeout seconds
+        """
+        now = time.monotonic()
+        records = []
+        for state in self._devices.values():
+            if state["windows"] and now - state["last_seen"] > self.idle_timeout:
+                records.extend(self._close_windows(state, None))
+        return records
+
+    def flush_all(self) -> list:
+        """
+        Close all open windows (at shutdown)
+        """
+        records = []
+        for state in self._devices.values():
+            records.extend(self._close_windows(state, None))
+        return records
+
+    def _close_windows(self, state: dict, watermark: int | None) -> list:
+        # Close windows ending before the watermark (all windows with watermark None)
+        closed = [key for key in state["windows"]
+                  if watermark is None or key[1] + key[0] * 1_000_000 <= watermark]
+        if not closed:
+            return []
+        device = state["device"]
+        lines = []
+        for window_sec, window_start in sorted(closed, key=lambda key: (key[1], key[0])):
+            accumulators = state["windows"].pop((window_sec, window_start))
+            # Samples of a closed window arriving later must not overwrite the written point
+            state["watermark"] = max(state["watermark"], window_start + window_sec * 1_000_000)
+            fields = []
+            for ch_name, (count, mean, m2, minimum, maximum) in accumulators.items():
+                fields.append(f"{ch_name}_count={int(count):d}i")
+                fields.append(f"{ch_name}_max={self.float_format % maximum}")
+                fields.append(f"{ch_name}_mean={self.float_format % mean}")
+                fields.append(f"{ch_name}_min={self.float_format % minimum}")
+                fields.append(f"{ch_name}_stddev={self.float_format % math.sqrt(m2 / count)}")
+            if fields:
+                lines.append(f"{self.measurement},window_sec={window_sec:d},{device.location_tag_str} "
+                             f"{','.join(fields)} {window_start // 1_000_000:d}\n")
+        if not lines:
+            return []
+        return [(device.aggregated_bucket, "s", "".join(lines).encode())]
@@ -0,0 +1,67 @@
+import socket
+import zlib
+
+SCALE_MODES = ("single", "shared", "sharded")
+
+def device_shard(device_id: str, instance_count: int) -> int:
+    """
+    Deterministic shard index of a device (same result in every instance and Python process)
+    """
+    return zlib.crc32(device_id.encode()) % instance_count
+
+def topic_base(topic: str) -> str:
+    """
+    Topic without trailing wildcard, e.g. "private/#" -> "private"
+    """
+    return topic.split("/#")[0]
+
+def check_scale_config(scale_mode: str, instance_index: int | None, instance_count: int):
+    """
+    Raise ValueError on scale-out configs which would consume devices twice or never
+    """
+    if scale_mode not in SCALE_MODES:
+        raise ValueError(f"Scale mode must be one of {SCALE_MODES}, got {scale_mode}")
+    if scale_mode == "sharded":
+        if instance_index is None:
+            raise ValueError("Sharded scale mode requires the instance index (PQOPEN_INGEST_INSTANCE_INDEX)")
+        if not 0 <= instance_index < instance_count:
+            raise ValueError(f"Instance index {instance_index} out of range for {instance_count} instances")
+
+def instance_client_id(base_client_id: str, scale_mode: str, instance_id: str | int | None = None,
+                       persistent_session: bool = True) -> str:
+    """
+    MQTT client id of this instance, unique per instance so each one keeps its own persistent session
+
+    The instance id must be stable across restarts with persistent sessions, otherwise every
+    restart leaves an orphaned session on the broker queueing messages. Only without
+    persistent session the hostname is used if no instance id is given.
+    """
+    if scale_mode == "single":
+        return base_client_id
+    if instance_id is None:
+        if persistent_session:
+            raise ValueError(f"Scale mode {scale_mode} with persistent session requires a stable instance id "
+                             "(PQOPEN_INGEST_INSTANCE_ID or PQOPEN_INGEST_INSTANCE_INDEX)")
+        instance_id = socket.gethostname()
+    return f"{base_client_id}-{instance_id}"
+
+def subscription_topics(scale_mode: str, topic: str, device_ids: list[str] = (), share_group: str = "mqtt-to-database",
+                        instance_index: int = 0, instance_count: int = 1) -> list[str]:
+    """
+    Topics to subscribe for the scale mode
+
+    single:  the configured topic
+    shared:  the configured topic in a shared subscription group, the broker delivers each
+             message to one member of the group
+    sharded: one topic per configured device of the own shard ({topic base}/{device_id}/#)
+    """
+    if scale_mode == "single":
+        return [topic]
+    elif scale_mode == "shared":
+        return [f"$share/{share_group}/{topic}"]
+    elif scale_mode == "sharded":
+        if not 0 <= instance_index < instance_count:
+            raise ValueError(f"Instance index {instance_index} out of range for {instance_count} instances")
+        return sorted(f"{topic_base(topic)}/{device_id}/#" for device_id in device_ids
+                      if device_shard(device_id, instance_count) == instance_index)
+    raise ValueError(f"Scale mode must be one of {SCALE_MODES}, got {scale_mode}")
@@ -0,0 +1,136 @@
+import logging
+import os
+import struct
+import zlib
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Record header: payload length, crc32 of precision, bucket and payload, bucket name length,
+# write precision (index in PRECISIONS)
+RECORD_HEADER = struct.Struct("<IIHB")
+PRECISIONS = ("ns", "us", "ms", "s")
+
+class WriteSpool:
+    """
+    Append-only on-disk spool for line protocol batches which could not be written
+
+    Batches are appended to the open segment {seq}.open, each record framed with a header
+    holding length and crc32. A segment is sealed (fsync and rename to {seq}.seg) when it
+    exceeds segment_size. After a crash, open segments are truncated behind the last
+    valid record and sealed. If the spool exceeds max_bytes, the oldest sealed segments
+    are dropped.
+
+    The sizes of the sealed segments are tracked in memory, the spool directory is owned
+    by one instance. The methods are not thread-safe, call them from one thread.
+    """
+    def __init__(self, path: str, segment_size: int = 16_000_000, max_bytes: int = 1_000_000_000):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self._segment_file = None
+        self._segment_path = None
+        self._recover()
+        self._sealed = {seg_path: seg_path.stat().st_size for seg_path in self.path.glob("*.seg")}
+        self._sealed_bytes = sum(self._sealed.values())
+        self._next_seq = max((int(seg_path.stem) for seg_path in self._sealed), default=0) + 1
+
+    def _recover(self):
+        for seg_path in self.path.glob("*.open"):
+            valid_size = 0
+            for _, _, _, end_pos in self._iter_records(seg_path):
+                valid_size = end_pos
+            if valid_size == 0:
+                seg_path.unlink()
+                continue
+            if valid_size < seg_path.stat().st_size:
+                logger.warning(f"Truncating torn spool segment {seg_path.name} to {valid_size:d} bytes")
+                os.truncate(seg_path, valid_size)
+            seg_path.rename(seg_path.with_suffix(".seg"))
+            logger.info(f"Recovered spool segment {seg_path.name}")
+
+    @staticmethod
+    def _iter_records(seg_path: Path):
+        try:
+            with open(seg_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            # Dropped because the spool was full
+            return
+        pos = 0
+        while pos + RECORD_HEADER.size <= len(data):
+            length, crc, bucket_length, precision_idx = RECORD_HEADER.unpack_from(data, pos)
+            start = pos + RECORD_HEADER.size
+            end = start + bucket_length + length
+            if (end > len(data) or precision_idx >= len(PRECISIONS)
+                    or zlib.crc32(data[start:end], zlib.crc32(bytes((precision_idx,)))) != crc):
+                break
+            yield data[start:start + bucket_length].decode(), PRECISIONS[precision_idx], data[start + bucket_length:end], end
+            pos = end
+
+    def append(self, bucket: str, batch: bytes, precision: str = "ns"):
+        """
+        Append one line protocol batch for the bucket and write precision
+        """
+        if self._segment_file is None:
+            self._segment_path = self.path / f"{self._next_seq:010d}.open"
+            self._segment_file = open(self._segment_path, "ab")
+            self._next_seq += 1
+        bucket_bytes = bucket.encode()
+        precision_idx = PRECISIONS.index(precision)
+        record = bucket_bytes + batch
+        crc = zlib.crc32(record, zlib.crc32(bytes((precision_idx,))))
+        self._segment_file.write(RECORD_HEADER.pack(len(batch), crc, len(bucket_bytes), precision_idx))
+        self._segment_file.write(record)
+        if self._segment_file.tell() >= self.segment_size:
+            self.seal()
+        self._enforce_max_bytes()
+
+    def seal(self):
+        """
+        Close the open segment and make it available for replay
+        """
+        if self._segment_file is None:
+            return
+        self._segment_file.flush()
+        os.fsync(self._segment_file.fileno())
+        self._segment_file.close()
+        seg_path = self._segment_path.with_suffix(".seg")
+        self._segment_path.rename(seg_path)
+        self._sealed[seg_path] = seg_path.stat().st_size
+        self._sealed_bytes += self._sealed[seg_path]
+        self._segment_file = None
+        self._segment_path = None
+
+    def _enforce_max_bytes(self):
+        open_bytes = self._segment_file.tell() if self._segment_file is not None else 0
+        segments = self.sealed_segments()
+        while segments and self._sealed_bytes + open_bytes > self.max_bytes:
+            seg_path = segments.pop(0)
+            seg_size = self._sealed[seg_path]
+            self.remove_segment(seg_path)
+            logger.error(f"Spool full, dropped segment {seg_path.name} ({seg_size:d} bytes)")
+
+    def sealed_segments(self) -> list[Path]:
+        """
+        Sealed segments, oldest first
+        """
+        return sorted(self._sealed)
+
+    def read_segment(self, seg_path: Path):
+        """
+        Iterate over (bucket, precision, batch) records of a sealed segment
+        """
+        for bucket, precision, batch, _ in self._iter_records(seg_path):
+            yield bucket, precision, batch
+
+    def remove_segment(self, seg_path: Path):
+        seg_path.unlink(missing_ok=True)
+        self._sealed_bytes -= self._sealed.pop(seg_path, 0)
+
+    def is_empty(self) -> bool:
+        return self._segment_file is None and not self._sealed
+
+    def close(self):
+        self.seal()
@@ -0,0 +1,95 @@
+import unittest
+import datetime
+import os
+import sys
+import tempfile
+from unittest.mock import patch
+
+import polars as pl
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "api"))
+
+import archiveclient
+
+DAY_1 = datetime.datetime(2025, 11, 23, tzinfo=datetime.UTC)
+DAY_2 = DAY_1 + datetime.timedelta(days=1)
+DAY_3 = DAY_2 + datetime.timedelta(days=1)
+
+def write_day(path: str, location: str, day: datetime.datetime, channels: list):
+    timestamps = pl.datetime_range(day, day + datetime.timedelta(days=1), datetime.timedelta(hours=1),
+                                   closed="left", time_unit="us", time_zone="UTC", eager=True)
+    pl_df = pl.DataFrame({"_time": timestamps})
+    for idx, channel in enumerate(channels):
+        pl_df = pl_df.with_columns(pl.lit(float(idx)).alias(channel))
+    location_path = os.path.join(path, "daily", archiveclient.clean_string(location))
+    os.makedirs(location_path, exist_ok=True)
+    pl_df.write_parquet(os.path.join(location_path, f"{day.strftime('%Y-%m-%d')}_{','.join(channels)}.parquet"))
+
+class TestArchiveClient(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        patcher = patch.multiple(archiveclient, ARCHIVE_PATH=self.tmp_dir.name, ARCHIVE_BUCKET="st",
+                                 ARCHIVE_MEASUREMENT="cycle-by-cycle")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        write_day(self.tmp_dir.name, "Graz Nord", DAY_1, ["Freq", "U1_rms"])
+        write_day(self.tmp_dir.name, "Graz Nord", DAY_2, ["Freq"])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_split_range(self):
+        start_dt = DAY_1 - datetime.timedelta(hours=2)
+        stop_dt = DAY_3 + datetime.timedelta(hours=1)
+        segments = archiveclient.split_range(start_dt, stop_dt, "Graz Nord", ["Freq"])
+        self.assertEqual([(start, stop) for start, stop, _ in segments],
+                         [(start_dt, DAY_1), (DAY_1, DAY_3), (DAY_3, stop_dt)])
+        self.assertEqual([files is None for _, _, files in segments], [True, False, True])
+        self.assertEqual(len(segments[1][2]), 2)
+        # Second day doesn't contain U1_rms
+        segments = archiveclient.split_range(DAY_1, DAY_3, "Graz Nord", ["Freq", "U1_rms"])
+        self.assertEqual([(start, stop, files is None) for start, stop, files in segments],
+                         [(DAY_1, DAY_2, False), (DAY_2, DAY_3, True)])
+        # Partial days are never read from the archive
+        segments = archiveclient.split_range(DAY_1 + datetime.timedelta(hours=1), DAY_2, "Graz Nord", ["Freq"])
+        self.assertEqual([files for _, _, files in segments], [None])
+
+    async def test_tiered(self):
+        influx_ranges = []
+
+        async def iter_influx(start_dt, stop_dt, location, bucket, measurement, channels, *args, **kwargs):
+            influx_ranges.append((start_dt, stop_dt))
+            yield pl.DataFrame({"_time": [start_dt], "Freq": [50.0], "U2_rms": [230.0]},
+                               schema={"_time": pl.Datetime("us", "UTC"), "Freq": pl.Float64, "U2_rms": pl.Float64})
+
+        start_dt = DAY_1 + datetime.timedelta(hours=20)
+        stop_dt = DAY_3 + datetime.timedelta(hours=1)
+        with patch.object(archiveclient.influx2client, "iter_data_frames_chunked", iter_influx):
+            frames = [pl_df async for pl_df in archiveclient.iter_data_frames_tiered(
+                start_dt, stop_dt, "Graz Nord", "st", "cycle-by-cycle", ["Freq"], batch_rows=10)]
+        self.assertEqual(influx_ranges, [(start_dt, DAY_2), (DAY_3, stop_dt)])
+        pl_df = pl.concat(frames)
+        self.assertEqual(pl_df.columns, ["_time", "Freq"])
+        self.assertEqual(pl_df.schema["_time"], pl.Datetime("us", "UTC"))
+        self.assertEqual(len(pl_df), 1 + 24 + 1)
+        self.assertTrue(pl_df["_time"].is_sorted())
+        self.assertTrue(all(len(frame) <= 10 for frame in frames))
+
+    async def test_not_archived(self):
+        influx_calls = []
+
+        async def iter_influx(*args, **kwargs):
+            influx_calls.append(args)
+            yield pl.DataFrame({"_time": [DAY_1]})
+
+        with patch.object(archiveclient.influx2client, "iter_data_frames_chunked", iter_influx):
+            # No explicit channels, other bucket, window aggregation
+            for bucket, channels, window_ms in [("st", [], None), ("lt", ["Freq"], None), ("st", ["Freq"], 1000)]:
+                frames = [pl_df async for pl_df in archiveclient.iter_data_frames_tiered(
+                    DAY_1, DAY_3, "Graz Nord", bucket, "cycle-by-cycle", channels, window_ms=window_ms)]
+                self.assertEqual(len(frames), 1)
+        self.assertEqual([args[:2] for args in influx_calls], [(DAY_1, DAY_3)] * 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import unittest
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "mqtt_to_influxdb"))
+
+from batchwriter import BatchWriter
+from spool import WriteSpool
+
+class ApiException(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status:d}")
+        self.status = status
+
+class FakeWriteApi:
+    def __init__(self):
+        self.batches = []
+        self.precisions = []
+        self.available = True
+        self.status = None
+
+    async def write(self, bucket, record, write_precision="ns", **kwargs):
+        if not self.available:
+            raise ConnectionError("database unavailable")
+        if self.status is not None:
+            raise ApiException(self.status)
+        if b"bad" in record:
+            raise ApiException(400)
+        self.batches.append((bucket, record))
+        self.precisions.append(write_precision)
+
+class TestBatchWriter(unittest.IsolatedAsyncioTestCase):
+    async def test_flush_on_max_lines(self):
+        write_api = FakeWriteApi()
+        batch_writer = BatchWriter(write_api, max_lines=3, max_latency=60)
+        await batch_writer.write("short_term", b"m f=1 0\nm f=2 1\n")
+        await batch_writer.write("long_term", b"m f=3 0\n")
+        await batch_writer.write("short_term", b"m f=4 2\n")
+        await asyncio.sleep(0.01)
+        self.assertEqual([("short_term", b"m f=1 0\nm f=2 1\nm f=4 2\n")], write_api.batches)
+
+    async def test_precision_buffers(self):
+        write_api = FakeWriteApi()
+        batch_writer = BatchWriter(write_api, max_latency=60)
+        await batch_writer.write("long_term", b"m f=1 0\n", precision="s")
+        await batch_writer.write("long_term", b"m f=2 0\n", precision="ms")
+        await batch_writer.write("long_term", b"m f=3 1\n", precision="s")
+        await batch_writer.flush_all()
+        self.assertEqual([("long_term", b"m f=1 0\nm f=3 1\n"), ("long_term", b"m f=2 0\n")], write_api.batches)
+        self.assertEqual(["s", "ms"], write_api.precisions)
+
+    async def test_flush_on_latency_and_stop(self):
+        write_api = FakeWriteApi()
+        batch_writer = BatchWriter(write_api, max_latency=0.05)
+        stop_event = asyncio.Event()
+        writer_task = asyncio.create_task(batch_writer.run(stop_event))
+        await batch_writer.write("short_term", b"m f=1 0\n")
+        await asyncio.sleep(0.2)
+        self.assertEqual([("short_term", b"m f=1 0\n")], write_api.batches)
+        await batch_writer.write("long_term", b"m f=2 0\n")
+        stop_event.set()
+        await writer_task
+        self.assertEqual(("long_term", b"m f=2 0\n"), write_api.batches[-1])
+
+    async def test_spool_and_replay(self):
+        write_api = FakeWriteApi()
+        write_api.available = False
+        with tempfile.TemporaryDirectory() as spool_path:
+            batch_writer = BatchWriter(write_api, max_lines=1, spool=WriteSpool(spool_path))
+            await batch_writer.write("short_term", b"m f=1 0\n")
+            await batch_writer.flush_all()
+            await batch_writer.write("short_term", b"m f=2 1\n")
+            await batch_writer.write("long_term", b"m f=3 0\n", precision="s")
+            self.assertEqual([], write_api.batches)
+            write_api.available = True
+            stop_event = asyncio.Event()
+            replay_task = asyncio.create_task(batch_writer.run_replay(stop_event, retry_interval=0.01))
+            await asyncio.sleep(0.1)
+            stop_event.set()
+            await replay_task
+            self.assertEqual([("short_term", b"m f=1 0\nm f=2 1\n"), ("long_term", b"m f=3 0\n")], write_api.batches)
+            self.assertEqual(["ns", "s"], write_api.precisions)
+            self.assertTrue(batch_writer.spool.is_empty())
+
+    async def test_rejected_batch_dropped(self):
+        write_api = FakeWriteApi()
+        with tempfile.TemporaryDirectory() as spool_path:
+            batch_writer = BatchWriter(write_api, max_lines=1, spool=WriteSpool(spool_path))
+            await batch_writer.write("short_term", b"m bad=1 0\n")
+            await batch_writer.flush_all()
+            self.assertTrue(batch_writer.spool.is_empty())
+            self.assertTrue(batch_writer._db_available)
+            # Server errors are retryable
+            write_api.status = 503
+            await batch_writer.write("short_term", b"m f=1 0\n")
+            await batch_writer.flush_all()
+            self.assertFalse(batch_writer.spool.is_empty())
+            self.assertFalse(batch_writer._db_available)
+
+    async def test_replay_skips_rejected_records(self):
+        write_api = FakeWriteApi()
+        write_api.available = False
+        with tempfile.TemporaryDirectory() as spool_path:
+            batch_writer = BatchWriter(write_api, max_lines=1, spool=WriteSpool(spool_path))
+            for record in (b"m f=1 0\n", b"m bad=2 1\n", b"m f=3 2\n"):
+                await batch_writer.write("short_term", record)
+            await batch_writer.flush_all()
+            write_api.available = True
+            stop_event = asyncio.Event()
+            replay_task = asyncio.create_task(batch_writer.run_replay(stop_event, retry_interval=0.01))
+            await asyncio.sleep(0.1)
+            stop_event.set()
+            await replay_task
+            self.assertEqual([("short_term", b"m f=1 0\n"), ("short_term", b"m f=3 2\n")], write_api.batches)
+            self.assertTrue(batch_writer.spool.is_empty())
+
+    async def test_append_during_replay(self):
+        write_api = FakeWriteApi()
+        write_api.available = False
+        with tempfile.TemporaryDirectory() as spool_path:
+            # Every batch is its own segment, the full spool drops segments while they are replayed
+            batch_writer = BatchWriter(write_api, max_lines=1, spool=WriteSpool(spool_path, segment_size=1,
+                                                                                   max_bytes=20 * 29))
+            await batch_writer.write("short_term", b"m f=0 0\n")
+            await batch_writer.flush_all()
+            write_api.available = True
+            stop_event = asyncio.Event()
+            replay_task = asyncio.create_task(batch_writer.run_replay(stop_event, retry_interval=0.01))
+            for idx in range(1, 200):
+                await batch_writer.write("short_term", f"m f={idx:d} 0\n".encode())
+                await asyncio.sleep(0)
+            await batch_writer.flush_all()
+            for _ in range(100):
+                if batch_writer._db_available:
+                    break
+                await asyncio.sleep(0.01)
+            stop_event.set()
+            await replay_task
+            self.assertTrue(batch_writer.spool.is_empty())
+            written = b"".join(batch for _, batch in write_api.batches).splitlines()
+            self.assertEqual(len(written), len(set(written)))
+            self.assertIn(b"m f=199 0", written)
+            self.assertEqual([], list(Path(spool_path).glob("*.seg")))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+import os
+import sys
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "mqtt_to_influxdb"))
+
+from columnar import encode_columnar, decode_columnar
+from dataconverter import cbc_dict_to_line_protocol_wide
+from messagehandler import decode_payload
+
+class TestColumnarEncoding(unittest.TestCase):
+    def setUp(self):
+        self.dataseries = {"CH1": {"data": [1.0, 2.0, 3.0], "timestamps": [1_700_000_000_000_000, 1_700_000_000_020_000, 1_700_000_000_040_000]},
+                           "CH2": {"data": [4.0, 5.0, 6.0], "timestamps": [1_700_000_000_000_000, 1_700_000_000_020_000, 1_700_000_000_040_000]},
+                           "CH3": {"data": [7.0], "timestamps": [1_700_000_000_010_000]}}
+
+    def test_roundtrip(self):
+        for compress in [False, True]:
+            for float_dtype in ["float32", "float64"]:
+                m_data = decode_columnar(encode_columnar(self.dataseries, float_dtype=float_dtype, compress=compress))["data"]
+                self.assertEqual(["CH1", "CH2", "CH3"], list(m_data))
+                for ch_name, ch_values in self.dataseries.items():
+                    np.testing.assert_array_equal(ch_values["timestamps"], m_data[ch_name]["timestamps"])
+                    np.testing.assert_array_equal(ch_values["data"], m_data[ch_name]["data"])
+                self.assertIs(m_data["CH1"]["timestamps"], m_data["CH2"]["timestamps"])
+
+    def test_line_protocol(self):
+        payload = encode_columnar(self.dataseries)
+        lp_data = cbc_dict_to_line_protocol_wide(decode_payload(payload, "pqcol")["data"], "tag1=value1")
+        self.assertEqual(cbc_dict_to_line_protocol_wide(self.dataseries, "tag1=value1"), lp_data)
+
+    def test_invalid_payload(self):
+        with self.assertRaises(ValueError):
+            decode_columnar(b"XXXX\x01\x00\x00\x00")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,247 @@
+"""
+Micro-benchmarks of the ingest data conversion, runs offline without broker and database
+
+    python tests/dataconverter-benchmark.py                        # run all cases
+    python tests/dataconverter-benchmark.py -k wide                # run cases containing "wide"
+    python tests/dataconverter-benchmark.py --save baseline.json   # save results as baseline
+    python tests/dataconverter-benchmark.py --compare baseline.json
+    python tests/dataconverter-benchmark.py -k wire                # only wire sizes (raw and gzip)
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+import tracemalloc
+import cbor2
+import numpy as np
+import orjson
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "mqtt_to_influxdb"))
+
+from influxdb_client import Point
+from dataconverter import cbc_dict_to_line_protocol, cbc_dict_to_line_protocol_wide, agg_dict_to_line_protocol, convert_dataseries_to_df
+from dataconverter import agg_dicts_to_line_protocol, events_to_line_protocol
+from messagehandler import decode_payload, encode_message, EncoderOptions, EncodedMessage
+from deviceregistry import DeviceEntry
+from columnar import encode_columnar
+from rollup import RollupAggregator
+
+FS = 50
+START_TS_US = 1_700_000_000_000_000
+TAGS = {"location_name": "AT/Graz", "location_lat": 47.068, "location_lon": 15.424}
+DEVICE = DeviceEntry.from_config("bench", TAGS)
+# Former line protocol (ns timestamps, 6 decimals) vs. native precision and shortest floats
+ENCODER_OPTIONS = {"ns_fixed": EncoderOptions(dataseries_precision="ns", aggregated_precision="ns", event_precision="ns"),
+                   "native_fixed": EncoderOptions(),
+                   "native_shortest": EncoderOptions(float_format="shortest"),
+                   "native_fixed_rollup": EncoderOptions(rollup_windows=(1, 10, 60))}
+
+def generate_dataseries(duration_sec: int = 10, num_channels: int = 12, seed: int = 0, decimals: int | None = None):
+    """
+    Synthetic dataseries channels with aligned 50 Hz timestamps in us, values optionally rounded
+    """
+    num_samples = duration_sec * FS
+    timestamps = (START_TS_US + np.arange(num_samples) * (1_000_000 // FS)).tolist()
+    rng = np.random.default_rng(seed)
+    data = 230 + rng.standard_normal((num_channels, num_samples))
+    if decimals is not None:
+        data = data.round(decimals)
+    return {f"CH{idx:d}": {"data": data[idx].tolist(), "timestamps": timestamps}
+            for idx in range(num_channels)}
+
+def generate_aggdata(num_channels: int = 20, num_harmonics: int = 50, seed: int = 0):
+    """
+    Synthetic agg_data message with scalar channels and harmonic lists (some NaN entries)
+    """
+    rng = np.random.default_rng(seed)
+    data = {f"CH{idx:d}": float(rng.random()) for idx in range(num_channels)}
+    for phase in range(1, 4):
+        harmonics = rng.random(num_harmonics)
+        harmonics[::7] = np.nan
+        data[f"U{phase:d}_H_rms"] = harmonics.tolist()
+        data[f"I{phase:d}_H_rms"] = rng.random(num_harmonics).tolist()
+    return {"interval_sec": 600, "timestamp": START_TS_US / 1e6, "data": data}
+
+def generate_event(seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return {"event_type": "dip", "channel": "U1", "timestamp": START_TS_US / 1e6,
+            "data": {"duration": float(rng.random()), "residual": float(rng.random() * 230)}}
+
+def encode(data, encoding: str) -> bytes:
+    if encoding == "json":
+        return orjson.dumps(data)
+    elif encoding == "gjson":
+        return gzip.compress(orjson.dumps(data))
+    elif encoding == "cbor":
+        return cbor2.dumps(data)
+    elif encoding == "pqcol":
+        return encode_columnar(data["data"])
+    raise ValueError(encoding)
+
+def generate_bulk(num_dataseries: int = 10, num_aggdata: int = 10, num_events: int = 2, duration_sec: int = 1,
+                  num_channels: int = 12, encoding: str = "cbor", decimals: int | None = None):
+    """
+    Bulk message (list of packets with subtopic and encoded payload), returned as encoded cbor
+    """
+    packets = []
+    for idx in range(num_dataseries):
+        payload = encode({"data": generate_dataseries(duration_sec, num_channels, seed=idx, decimals=decimals)}, encoding)
+        packets.append({"subtopic": f"dataseries/{encoding}", "payload": payload})
+    for idx in range(num_aggdata):
+        packets.append({"subtopic": "agg_data/cbor", "payload": cbor2.dumps(generate_aggdata(seed=idx))})
+    for idx in range(num_events):
+        packets.append({"subtopic": "event/cbor", "payload": cbor2.dumps(generate_event(seed=idx))})
+    return cbor2.dumps(packets)
+
+def count_lines(result) -> int | None:
+    """
+    Number of line protocol lines of a function result, None for non line protocol results
+    """
+    if isinstance(result, bytes):
+        return result.count(b"\n")
+    elif isinstance(result, str):
+        return result.count("\n") + 1
+    elif isinstance(result, list) and all(isinstance(line, str) for line in result):
+        return len(result)
+    elif isinstance(result, list) and all(isinstance(record, tuple) for record in result):
+        # RollupAggregator.add: [(bucket, precision, line protocol)]
+        return sum(record.count(b"\n") for _, _, record in result)
+    elif isinstance(result, EncodedMessage):
+        return sum(record.count(b"\n") for _, _, record in result.records)
+    return None
+
+def build_cases():
+    """
+    Returns list of (name, func, num_items, item_unit)
+    """
+    cases = []
+    for duration_sec in [1, 10, 60]:
+        for num_channels in [1, 12, 64]:
+            m_data = generate_dataseries(duration_sec, num_channels)
+            num_samples = duration_sec * FS * num_channels
+            shape = f"{duration_sec:d}s_x{num_channels:d}ch"
+            cases.append((f"cbc_line_protocol/{shape}", lambda m_data=m_data: cbc_dict_to_line_protocol(m_data, TAGS), num_samples, "samples"))
+            cases.append((f"cbc_line_protocol_wide/{shape}", lambda m_data=m_data: cbc_dict_to_line_protocol_wide(m_data, DEVICE.location_tag_str), num_samples, "samples"))
+            cases.append((f"cbc_line_protocol_wide_us_shortest/{shape}", lambda m_data=m_data: cbc_dict_to_line_protocol_wide(m_data, DEVICE.location_tag_str, precision="us", float_format="%r"), num_samples, "samples"))
+            cases.append((f"dataseries_to_df/{shape}", lambda m_data=m_data: convert_dataseries_to_df(m_data), num_samples, "samples"))
+    for num_harmonics in [0, 50]:
+        agg_data = generate_aggdata(num_harmonics=num_harmonics)
+        tags = {"interval_sec": agg_data["interval_sec"], **TAGS}
+        num_values = sum(len(val) if isinstance(val, list) else 1 for val in agg_data["data"].values())
+        cases.append((f"agg_line_protocol/harmonics{num_harmonics:d}", lambda agg_data=agg_data, tags=tags: agg_dict_to_line_protocol(agg_data, tags), num_values, "values"))
+        agg_data_list = [generate_aggdata(num_harmonics=num_harmonics, seed=idx) for idx in range(10)]
+        tags_list = [{"interval_sec": agg_data["interval_sec"], **TAGS}] * 10
+        cases.append((f"agg_line_protocol_batch/10x_harmonics{num_harmonics:d}", lambda agg_data_list=agg_data_list, tags_list=tags_list: agg_dicts_to_line_protocol(agg_data_list, tags_list), num_values * 10, "values"))
+    events = [generate_event(seed=idx) for idx in range(10)]
+    cases.append(("event_point/10x", lambda: [Point.from_dict({"measurement": "event-data", "tags": {"event_type": event["event_type"], "channel": event["channel"], **TAGS},
+                                                               "time": int(event["timestamp"]*1e9), "fields": event["data"]}).to_line_protocol() for event in events], 10, "events"))
+    cases.append(("event_line_protocol_batch/10x", lambda: events_to_line_protocol(events, TAGS), 10, "events"))
+    m_data = {"data": generate_dataseries(10, 12)}
+    num_samples = 10 * FS * 12
+    for encoding in ["json", "gjson", "cbor", "pqcol"]:
+        payload = encode(m_data, encoding)
+        cases.append((f"decode_payload/{encoding}_10s_x12ch", lambda payload=payload, encoding=encoding: decode_payload(payload, encoding), num_samples, "samples"))
+    for encoding in ["cbor", "pqcol"]:
+        payload = generate_bulk(encoding=encoding)
+        for options_name, options in ENCODER_OPTIONS.items():
+            cases.append((f"encode_message/bulk_{encoding}_{options_name}", lambda payload=payload, options=options: encode_message(DEVICE, "bulk", "cbor", payload, options), 22, "packets"))
+    for duration_sec in [1, 10]:
+        payload = encode({"data": generate_dataseries(duration_sec, 12)}, "cbor")
+        options = ENCODER_OPTIONS["native_fixed_rollup"]
+        result = encode_message(DEVICE, "dataseries", "cbor", payload, options)
+        # New aggregator per call, otherwise all further calls only drop late samples
+        cases.append((f"rollup_merge/{duration_sec:d}s_x12ch", lambda result=result: RollupAggregator(windows=options.rollup_windows).add(DEVICE, result.rollup_partials, result.newest_ts),
+                      duration_sec * FS * 12, "samples"))
+    return cases
+
+def build_wire_cases():
+    """
+    Returns list of (name, line protocol bytes) of one bulk message per encoder option,
+    with full precision values and with values rounded to 3 decimals
+    """
+    cases = []
+    for values_name, decimals in [("full", None), ("round3", 3)]:
+        payload = generate_bulk(decimals=decimals)
+        for options_name, options in ENCODER_OPTIONS.items():
+            if options.rollup_windows:
+                continue
+            result = encode_message(DEVICE, "bulk", "cbor", payload, options)
+            cases.append((f"wire/bulk_{values_name}_{options_name}", b"".join(record for _, _, record in result.records)))
+    return cases
+
+def run_case(func, min_time: float = 0.5, repeat: int = 5):
+    """
+    Returns best time per call in seconds and peak memory of one call in bytes
+    """
+    func()
+    start = time.perf_counter()
+    func()
+    num_calls = max(1, int(min_time / repeat / max(time.perf_counter() - start, 1e-9)))
+    best_time = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(num_calls):
+            func()
+        best_time = min(best_time, (time.perf_counter() - start) / num_calls)
+    tracemalloc.start()
+    func()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best_time, peak_memory
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the ingest data conversion functions.")
+    parser.add_argument("-k", dest="keyword", default="", help="Only run cases containing this keyword")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Min. run time per case in seconds")
+    parser.add_argument("--save", help="Save results as JSON baseline to this path")
+    parser.add_argument("--compare", help="Compare results against JSON baseline at this path")
+    args = parser.parse_args()
+
+    baseline = {}
+    baseline_wire_sizes = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline_file = json.load(f)
+        baseline = baseline_file["results"]
+        baseline_wire_sizes = baseline_file.get("wire_sizes", {})
+
+    results = {}
+    wire_sizes = {}
+    for name, batch in build_wire_cases():
+        if args.keyword not in name:
+            continue
+        raw_bytes = len(batch)
+        gzip_bytes = len(gzip.compress(batch))
+        num_lines = batch.count(b"\n")
+        wire_sizes[name] = {"raw_bytes": raw_bytes, "gzip_bytes": gzip_bytes, "lines": num_lines}
+        report = (f"{name:40s} {raw_bytes:12,d} B raw {gzip_bytes:12,d} B gzip "
+                  f"{raw_bytes / num_lines:8.1f} B/line {gzip_bytes / num_lines:8.1f} B/line gzip")
+        if name in baseline_wire_sizes:
+            report += f"  x{baseline_wire_sizes[name]['gzip_bytes'] / gzip_bytes:5.2f} vs. baseline"
+        print(report)
+
+    for name, func, num_items, item_unit in build_cases():
+        if args.keyword not in name:
+            continue
+        run_time, peak_memory = run_case(func, min_time=args.min_time)
+        lines = count_lines(func())
+        lines_per_sec = lines / run_time if lines is not None else None
+        results[name] = {"seconds": run_time, "items_per_sec": num_items / run_time, "item_unit": item_unit,
+                         "lines_per_sec": lines_per_sec, "peak_memory_bytes": peak_memory}
+        lines_report = f"{lines_per_sec:12,.0f} lines/s" if lines_per_sec is not None else f"{'-':>12s} lines/s"
+        report = (f"{name:40s} {num_items / run_time:14,.0f} {item_unit + '/s':10s} {lines_report} "
+                  f"{run_time * 1e3:9.3f} ms {peak_memory / 1e6:8.2f} MB")
+        if name in baseline:
+            report += f"  x{baseline[name]['seconds'] / run_time:5.2f} vs. baseline"
+        print(report)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": sys.version, "numpy": np.__version__, "results": results, "wire_sizes": wire_sizes}, f, indent=2)
+        print(f"Baseline saved to {args.save}")
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,13 @@ import unittest
 import os
 import sys
 import pandas as pd
+from influxdb_client import Point
 from pandas.testing import assert_frame_equal
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.dirname(SCRIPT_DIR))
 
-from src.mqtt_to_influxdb.dataconverter import convert_dataseries_to_df, cbc_dict_to_line_protocol, agg_dict_to_line_protocol
+from src.mqtt_to_influxdb.dataconverter import convert_dataseries_to_df, cbc_dict_to_line_protocol, cbc_dict_to_line_protocol_wide, agg_dict_to_line_protocol, resolve_float_format, agg_dicts_to_line_protocol, events_to_line_protocol
 
 class TestDataseriesConverter(unittest.TestCase):
     def test_dataseries_simple(self):
@@ -34,6 +35,71 @@ class TestDataseriesToLineConverter(unittest.TestCase):
         lp_data = cbc_dict_to_line_protocol(dataseries, tags)
         self.assertEqual(expected_lp, lp_data)
 
+class TestDataseriesToWideLineConverter(unittest.TestCase):
+    def test_dataseries_aligned(self):
+        dataseries = {"CH1": {"data": [1.0,2.0], "timestamps": [0,1]},
+                      "CH2": {"data": [6.0,7.0], "timestamps": [0,1]}}
+        tags = {"tag1": "value1"}
+        expected_lp = (b"cycle-by-cycle,tag1=value1 CH1=1.000000,CH2=6.000000 0\n"
+                       b"cycle-by-cycle,tag1=value1 CH1=2.000000,CH2=7.000000 1000\n")
+        lp_data = cbc_dict_to_line_protocol_wide(dataseries, tags)
+        self.assertEqual(expected_lp, lp_data)
+
+    def test_dataseries_unaligned(self):
+        dataseries = {"CH1": {"data": [1.0,2.0], "timestamps": [0,1]},
+                      "CH2": {"data": [6.0,7.0], "timestamps": [0,2]},
+                      "CH3": {"data": [8.0,9.0], "timestamps": [0,1]}}
+        tags = {"tag1": "value1"}
+        expected_lp = (b"cycle-by-cycle,tag1=value1 CH1=1.000000,CH3=8.000000 0\n"
+                       b"cycle-by-cycle,tag1=value1 CH1=2.000000,CH3=9.000000 1000\n"
+                       b"cycle-by-cycle,tag1=value1 CH2=6.000000 0\n"
+                       b"cycle-by-cycle,tag1=value1 CH2=7.000000 2000\n")
+        lp_data = cbc_dict_to_line_protocol_wide(dataseries, tags)
+        self.assertEqual(expected_lp, lp_data)
+
+    def test_dataseries_nan(self):
+        dataseries = {"CH1": {"data": [1.0,float("nan"),float("nan")], "timestamps": [0,1,2]},
+                      "CH2": {"data": [6.0,7.0,None], "timestamps": [0,1,2]}}
+        expected_lp = (b"cycle-by-cycle CH1=1.000000,CH2=6.000000 0\n"
+                       b"cycle-by-cycle CH2=7.000000 1000\n")
+        lp_data = cbc_dict_to_line_protocol_wide(dataseries, {})
+        self.assertEqual(expected_lp, lp_data)
+
+    def test_dataseries_percent_in_names(self):
+        dataseries = {"THD_%": {"data": [1.0,2.0], "timestamps": [0,1]},
+                      "CH2": {"data": [6.0,7.0], "timestamps": [0,1]}}
+        expected_lp = (b"cycle-by-cycle,location_name=Lab_100% THD_%=1.000000,CH2=6.000000 0\n"
+                       b"cycle-by-cycle,location_name=Lab_100% THD_%=2.000000,CH2=7.000000 1000\n")
+        lp_data = cbc_dict_to_line_protocol_wide(dataseries, "location_name=Lab_100%")
+        self.assertEqual(expected_lp, lp_data)
+
+    def test_dataseries_length_mismatch(self):
+        dataseries = {"CH1": {"data": [1.0,2.0,3.0], "timestamps": [0,1]},
+                      "CH2": {"data": [6.0,7.0], "timestamps": [0,1]}}
+        expected_lp = (b"cycle-by-cycle CH2=6.000000 0\n"
+                       b"cycle-by-cycle CH2=7.000000 1000\n"
+                       b"cycle-by-cycle CH1=1.000000 0\n"
+                       b"cycle-by-cycle CH1=2.000000 1000\n")
+        with self.assertLogs("src.mqtt_to_influxdb.dataconverter", "WARNING"):
+            lp_data = cbc_dict_to_line_protocol_wide(dataseries, {})
+        self.assertEqual(expected_lp, lp_data)
+
+    def test_dataseries_precision_and_float_format(self):
+        dataseries = {"CH1": {"data": [1.0,0.1], "timestamps": [1_000_400,2_000_600]},
+                      "CH2": {"data": [230.123456789,float("nan")], "timestamps": [1_000_400,2_000_600]}}
+        expected_lp = (b"cycle-by-cycle CH1=1.0,CH2=230.123456789 1000400\n"
+                       b"cycle-by-cycle CH1=0.1 2000600\n")
+        lp_data = cbc_dict_to_line_protocol_wide(dataseries, {}, precision="us", float_format=resolve_float_format("shortest"))
+        self.assertEqual(expected_lp, lp_data)
+        expected_lp = (b"cycle-by-cycle CH1=1,CH2=230.1 1000\n"
+                       b"cycle-by-cycle CH1=0.1 2001\n")
+        lp_data = cbc_dict_to_line_protocol_wide(dataseries, {}, precision="ms", float_format="%.4g")
+        self.assertEqual(expected_lp, lp_data)
+
+    def test_invalid_float_format(self):
+        with self.assertRaises(ValueError):
+            resolve_float_format("short")
+
 class TestAggDataToLineConverter(unittest.TestCase):
     def test_aggdata_simple(self):
         m_data = {"interval_sec": 1, "timestamp": 1.0, "data": {"CH1": 1.0, "CH2": [2.0, 3.0, 4.0]}}
@@ -42,5 +108,35 @@ class TestAggDataToLineConverter(unittest.TestCase):
         lp_data = agg_dict_to_line_protocol(m_data, tags)
         self.assertEqual(expected_lp, lp_data)
 
+    def test_aggdata_precision_seconds(self):
+        m_data = {"interval_sec": 600, "timestamp": 1_700_000_400.0000002, "data": {"CH1": 0.1, "CH2": [None, 3.0]}}
+        expected_lp = "aggregated-data,interval_sec=600 CH1=0.1,CH2_01=3.0 1700000400"
+        lp_data = agg_dict_to_line_protocol(m_data, "interval_sec=600", precision="s", float_format="%r")
+        self.assertEqual(expected_lp, lp_data)
+
+class TestBatchEncoders(unittest.TestCase):
+    def test_aggdata_batch_identical(self):
+        m_data_list = [{"interval_sec": 1, "timestamp": 1.5, "data": {"CH1": 1.0, "CH2": [2.0, None, float("nan"), 4], "_meta": 1, "CH%": 7}},
+                       {"interval_sec": 600, "timestamp": 600.0, "data": {"CH1": float("nan"), "CH3": float("inf")}},
+                       {"interval_sec": 600, "timestamp": 1200.0, "data": {"CH1": None}}]
+        tags_list = ["interval_sec=1,location_name=Graz", {"interval_sec": 600}, "interval_sec=600"]
+        for precision, float_format in [("ns", "%f"), ("s", "%r")]:
+            expected_lp = "".join(agg_dict_to_line_protocol(m_data, tags, precision=precision, float_format=float_format) + "\n"
+                                  for m_data, tags in zip(m_data_list, tags_list)).encode()
+            lp_data = agg_dicts_to_line_protocol(m_data_list, tags_list, precision=precision, float_format=float_format)
+            self.assertEqual(expected_lp, lp_data)
+
+    def test_events_identical_to_point(self):
+        tags = {"location_name": "AT/Graz Süd", "location_lat": 47.068, "location_lon": None}
+        events = [{"event_type": "dip", "channel": "U1", "timestamp": 1.25,
+                   "data": {"duration": 0.1, "residual": 200.0, "num=cycles": 3, "flag": True, "note": 'a "b" \\', "nan": float("nan")}},
+                  {"event_type": "swell", "channel": "U 2,", "timestamp": 2.0, "data": {"peak": 250}},
+                  {"event_type": "interruption", "channel": "U3", "timestamp": 3.0, "data": {"missing": None}}]
+        expected_lp = "".join(Point.from_dict({"measurement": "event-data",
+                                               "tags": {"event_type": event["event_type"], "channel": event["channel"], **tags},
+                                               "time": int(event["timestamp"]*1e9),
+                                               "fields": event["data"]}).to_line_protocol() + "\n" for event in events).encode()
+        self.assertEqual(expected_lp, events_to_line_protocol(events, tags))
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,73 @@
+import unittest
+import datetime
+import io
+import os
+import sys
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "api"))
+
+from datastream import iter_slices, open_data_stream, OutputOptions
+
+async def collect(parquet_stream) -> bytes:
+    return b"".join([chunk async for chunk in parquet_stream])
+
+class TestDataStream(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        start_dt = datetime.datetime(2025, 11, 23, tzinfo=datetime.UTC)
+        self.pl_df = pl.DataFrame({"_time": pl.datetime_range(start_dt, start_dt + datetime.timedelta(seconds=99.9),
+                                                              "100ms", eager=True, time_unit="us"),
+                                   "P1": [idx + 0.1 for idx in range(1000)]})
+
+    async def test_row_groups(self):
+        pl_df = self.pl_df
+        chunks = [chunk async for chunk in await open_data_stream(iter_slices(pl_df, 300))]
+        # One chunk per row group and the footer
+        self.assertEqual(5, len(chunks))
+        parquet_file = pq.ParquetFile(io.BytesIO(b"".join(chunks)))
+        self.assertEqual(4, parquet_file.num_row_groups)
+        self.assertTrue(pl_df.equals(pl.read_parquet(io.BytesIO(b"".join(chunks)))))
+
+    async def test_empty(self):
+        data = await collect(await open_data_stream(iter_slices(pl.DataFrame(), 300)))
+        self.assertEqual(["_time"], pl.read_parquet(io.BytesIO(data)).columns)
+
+    async def test_error_before_stream(self):
+        async def failing_frames():
+            raise ConnectionError("InfluxDB not available")
+            yield
+        with self.assertRaises(ConnectionError):
+            await open_data_stream(failing_frames())
+
+    async def test_arrow_float32_seconds(self):
+        options = OutputOptions(format="arrow", compression="lz4", float32=True, time_unit="s")
+        data = await collect(await open_data_stream(iter_slices(self.pl_df, 300), options))
+        table = pa.ipc.open_stream(data).read_all()
+        self.assertEqual(pa.float32(), table.schema.field("P1").type)
+        self.assertEqual(pa.timestamp("s", tz="UTC"), table.schema.field("_time").type)
+        self.assertEqual(1000, len(table))
+        self.assertAlmostEqual(0.1, table["P1"][0].as_py(), places=6)
+        self.assertEqual("application/vnd.apache.arrow.stream", options.media_type)
+        self.assertEqual("agg.lz4.arrows", options.file_name("agg"))
+
+    async def test_compressed_csv(self):
+        options = OutputOptions(format="csv", compression="zstd", compression_level=19)
+        data = await collect(await open_data_stream(iter_slices(self.pl_df, 300), options))
+        # One zstd frame per batch, decompressed as one stream
+        csv_data = pa.CompressedInputStream(pa.py_buffer(data), "zstd").read()
+        pl_df = pl.read_csv(csv_data, try_parse_dates=True)
+        self.assertEqual(self.pl_df["P1"].to_list(), pl_df["P1"].to_list())
+        self.assertEqual("cbc.csv.zst", options.file_name("cbc"))
+        self.assertEqual("application/zstd", options.media_type)
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            OutputOptions(format="xlsx")
+        with self.assertRaises(ValueError):
+            OutputOptions(compression="lz4", compression_level=22)
+
+if __name__ == "__main__":
+    unittest.main()
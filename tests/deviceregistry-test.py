@@ -0,0 +1,41 @@
+import unittest
+import os
+import sys
+import tempfile
+import orjson
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "mqtt_to_influxdb"))
+
+from deviceregistry import DeviceRegistry
+
+class TestDeviceRegistry(unittest.TestCase):
+    def test_entry(self):
+        registry = DeviceRegistry()
+        registry.update({"dev1": {"location_name": "DE/Bad Homburg", "location_lat": 50.2, "location_lon": 8.6,
+                                  "db_dataseries_bucket": "test"}})
+        device = registry.get("dev1")
+        self.assertEqual("location_name=DE/Bad\\ Homburg,location_lat=50.2,location_lon=8.6", device.location_tag_str)
+        self.assertEqual(("test", "long_term", "long_term"), (device.dataseries_bucket, device.aggregated_bucket, device.event_bucket))
+        self.assertIsNone(registry.get("dev2"))
+
+    def test_reload(self):
+        with tempfile.TemporaryDirectory() as config_dir:
+            config_path = os.path.join(config_dir, "device_config.json")
+            with open(config_path, "wb") as f:
+                f.write(orjson.dumps({"dev1": {"location_name": "Graz", "location_lat": 47.068, "location_lon": 15.424}}))
+            registry = DeviceRegistry(config_path)
+            self.assertFalse(registry.reload())
+            with open(config_path, "wb") as f:
+                f.write(orjson.dumps({"dev1": {"location_name": "Graz", "location_lat": 47.068, "location_lon": 15.424},
+                                      "dev2": {"location_name": "Berlin", "location_lat": 52.52, "location_lon": 13.405}}))
+            self.assertTrue(registry.reload())
+            self.assertIn("dev2", registry)
+            with open(config_path, "wb") as f:
+                f.write(b"{invalid")
+            with self.assertRaises(orjson.JSONDecodeError):
+                registry.reload()
+            self.assertEqual(2, len(registry))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import datetime
+import os
+import sys
+from unittest.mock import patch
+import numpy as np
+import polars as pl
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "api"))
+
+import downsampling
+from downsampling import window_ms, lttb_indices, lttb_pl, window_pl, iter_lttb
+
+START_DT = datetime.datetime(2025, 11, 23, tzinfo=datetime.UTC)
+
+class TestLttb(unittest.TestCase):
+    def test_indices(self):
+        x = np.arange(1000)
+        y = np.zeros(1000)
+        y[500] = 10.0
+        y[200] = -5.0
+        indices = lttb_indices(x, y, 20)
+        self.assertEqual(20, len(indices))
+        self.assertEqual([0, 999], [indices[0], indices[-1]])
+        self.assertTrue(np.all(np.diff(indices) > 0))
+        # Spikes are kept
+        self.assertIn(500, indices)
+        self.assertIn(200, indices)
+        self.assertEqual(list(range(10)), lttb_indices(x[:10], y[:10], 20).tolist())
+
+    def test_dataframe(self):
+        values = np.sin(np.arange(100) / 5.0)
+        pl_df = pl.DataFrame({"_time": pl.datetime_range(START_DT, START_DT + datetime.timedelta(seconds=99), "1s",
+                                                         eager=True, time_unit="us"),
+                              "P1": values,
+                              "P2": [None if idx < 50 else 1.0 for idx in range(100)]})
+        reduced = lttb_pl(pl_df, 10)
+        # Union of the points selected per field, with the original values
+        self.assertLessEqual(len(reduced), 20)
+        self.assertGreaterEqual(len(reduced), 10)
+        self.assertIn(START_DT + datetime.timedelta(seconds=50), reduced["_time"].to_list())
+        self.assertTrue(reduced["_time"].is_sorted())
+        self.assertTrue(pl_df.join(reduced, on="_time").select(pl.col("P1") == pl.col("P1_right")).to_series().all())
+
+class TestIterLttb(unittest.IsolatedAsyncioTestCase):
+    async def test_staged(self):
+        num_rows = 10_000
+        values = np.sin(np.arange(num_rows) / 100.0)
+        values[7777] = 5.0
+        pl_df = pl.DataFrame({"_time": pl.datetime_range(START_DT, START_DT + datetime.timedelta(seconds=num_rows - 1),
+                                                         "1s", eager=True, time_unit="us"),
+                              "P1": values})
+        reduced_rows = []
+
+        def lttb_counted(pl_df, max_points):
+            reduced_rows.append(len(pl_df))
+            return lttb_pl(pl_df, max_points)
+
+        async def frames():
+            for offset in range(0, num_rows, 100):
+                yield pl_df.slice(offset, 100)
+
+        with patch.object(downsampling, "lttb_pl", lttb_counted):
+            reduced = pl.concat([frame async for frame in iter_lttb(frames(), 50, batch_rows=20)])
+        # Reduced in stages of 200 points, never all rows at once
+        self.assertGreater(len(reduced_rows), 10)
+        self.assertLessEqual(max(reduced_rows), 200 + 2 * 200)
+        self.assertEqual(50, len(reduced))
+        self.assertTrue(reduced["_time"].is_sorted())
+        self.assertIn(5.0, reduced["P1"].to_list())
+        self.assertEqual(pl_df["_time"][0], reduced["_time"][0])
+        self.assertEqual(pl_df["_time"][-1], reduced["_time"][-1])
+
+class TestWindow(unittest.TestCase):
+    def test_window_ms(self):
+        self.assertEqual(86_400, window_ms(86_400, 1000))
+        self.assertEqual(1, window_ms(0.5, 1000))
+
+    def test_window_pl(self):
+        pl_df = pl.DataFrame({"_time": pl.datetime_range(START_DT, START_DT + datetime.timedelta(seconds=9), "1s",
+                                                         eager=True, time_unit="us"),
+                              "P1": [float(idx) for idx in range(10)]})
+        windows = window_pl(pl_df, 5000, "max")
+        self.assertEqual([START_DT, START_DT + datetime.timedelta(seconds=5)], windows["_time"].to_list())
+        self.assertEqual([4.0, 9.0], windows["P1"].to_list())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import unittest
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import polars as pl
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "api"))
+
+import exportjobs
+from datastream import OutputOptions
+from exportjobs import ExportManager, QueueFullError, is_job_owner, parse_range
+
+START_DT = datetime.datetime(2025, 11, 23, tzinfo=datetime.UTC)
+STOP_DT = START_DT + datetime.timedelta(hours=4)
+
+async def frames(num_frames: int = 4, fail: bool = False, delay: float = 0):
+    for idx in range(num_frames):
+        await asyncio.sleep(delay)
+        yield pl.DataFrame({"_time": [START_DT + datetime.timedelta(hours=idx + 1)], "P1": [float(idx)]},
+                           schema={"_time": pl.Datetime("us", "UTC"), "P1": pl.Float64})
+    if fail:
+        raise ConnectionError("InfluxDB not available")
+
+class TestParseRange(unittest.TestCase):
+    def test_ranges(self):
+        self.assertIsNone(parse_range(None, 100))
+        self.assertEqual(parse_range("bytes=0-9", 100), (0, 10))
+        self.assertEqual(parse_range("bytes=90-", 100), (90, 10))
+        self.assertEqual(parse_range("bytes=90-200", 100), (90, 10))
+        self.assertEqual(parse_range("bytes=-30", 100), (70, 30))
+        # Ignored: malformed and multiple ranges
+        self.assertIsNone(parse_range("bytes=9-0", 100))
+        self.assertIsNone(parse_range("bytes=0-1,5-6", 100))
+        self.assertIsNone(parse_range("items=0-1", 100))
+        with self.assertRaises(ValueError):
+            parse_range("bytes=100-", 100)
+
+class TestExportManager(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.manager = ExportManager(self.tmp_dir.name, num_workers=1, max_queued=2, max_age_sec=3600,
+                                     max_bytes=1 << 20)
+
+    async def asyncTearDown(self):
+        await self.manager.close()
+        self.tmp_dir.cleanup()
+
+    async def wait_finished(self, job_id: str) -> exportjobs.ExportJob:
+        for _ in range(200):
+            job = self.manager.get(job_id)
+            if job is None or job.state in exportjobs.FINISHED_STATES:
+                return job
+            await asyncio.sleep(0.01)
+        self.fail(f"Export {job_id} not finished")
+
+    async def test_export(self):
+        job = self.manager.submit("key", frames(), OutputOptions(), "agg.parquet", START_DT, STOP_DT)
+        self.assertEqual(self.manager.get(job.job_id).state, "queued")
+        self.manager.start()
+        job = await self.wait_finished(job.job_id)
+        self.assertEqual(job.state, "done")
+        self.assertEqual(job.rows, 4)
+        self.assertEqual(job.progress, 1.0)
+        self.assertEqual(job.size, os.path.getsize(self.manager.result_path(job.job_id)))
+        pl_df = pl.read_parquet(self.manager.result_path(job.job_id))
+        self.assertEqual(pl_df["P1"].to_list(), [0.0, 1.0, 2.0, 3.0])
+        self.assertIsNotNone(self.manager.status(job)["expires_at"])
+        self.assertEqual([name for name in os.listdir(self.tmp_dir.name) if name.endswith(".tmp")], [])
+
+    async def test_owner_digest(self):
+        job = self.manager.submit("secret-key", frames(), OutputOptions(), "agg.parquet", START_DT, STOP_DT)
+        self.assertTrue(is_job_owner(self.manager.get(job.job_id), "secret-key"))
+        self.assertFalse(is_job_owner(self.manager.get(job.job_id), "other-key"))
+        with open(os.path.join(self.tmp_dir.name, f"{job.job_id}.json")) as f:
+            self.assertNotIn("secret-key", f.read())
+
+    async def test_progress(self):
+        job = self.manager.submit("key", frames(delay=0.05), OutputOptions(), "agg.parquet", START_DT, STOP_DT)
+        self.manager.start()
+        progress = set()
+        while (state := self.manager.get(job.job_id)).state not in exportjobs.FINISHED_STATES:
+            progress.add(state.progress)
+            await asyncio.sleep(0.01)
+        self.assertTrue(progress & {0.25, 0.5, 0.75})
+
+    async def test_failed(self):
+        job = self.manager.submit("key", frames(fail=True), OutputOptions(), "agg.parquet", START_DT, STOP_DT)
+        self.manager.start()
+        job = await self.wait_finished(job.job_id)
+        self.assertEqual(job.state, "failed")
+        self.assertIn("InfluxDB not available", job.error)
+        self.assertFalse(os.path.exists(self.manager.result_path(job.job_id)))
+
+    async def test_delete_running(self):
+        job = self.manager.submit("key", frames(num_frames=100, delay=0.01), OutputOptions(), "agg.parquet",
+                                  START_DT, STOP_DT)
+        self.manager.start()
+        while self.manager.get(job.job_id).state == "queued":
+            await asyncio.sleep(0.01)
+        self.manager.delete(job.job_id)
+        await asyncio.wait_for(self.manager._queue.join(), 5)
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+    async def test_queue_full(self):
+        self.manager.submit("key", frames(), OutputOptions(), "agg.parquet", START_DT, STOP_DT)
+        self.manager.submit("key", frames(), OutputOptions(), "agg.parquet", START_DT, STOP_DT)
+        with self.assertRaises(QueueFullError):
+            self.manager.submit("key", frames(), OutputOptions(), "agg.parquet", START_DT, STOP_DT)
+
+    async def test_gc(self):
+        self.manager.start()
+        job_ids = []
+        for _ in range(3):
+            job = self.manager.submit("key", frames(), OutputOptions(), "agg.parquet", START_DT, STOP_DT)
+            job_ids.append((await self.wait_finished(job.job_id)).job_id)
+        # First job expired, the results of the others exceed the size limit
+        expired = self.manager.get(job_ids[0])
+        expired.finished_at = time.time() - 7200
+        self.manager._save(expired)
+        self.manager.max_bytes = self.manager.get(job_ids[2]).size
+        self.manager.gc()
+        self.assertEqual([self.manager.get(job_id) is not None for job_id in job_ids], [False, False, True])
+        self.assertTrue(os.path.exists(self.manager.result_path(job_ids[2])))
+
+    async def test_gc_interrupted(self):
+        own_job = self.manager.submit("key", frames(), OutputOptions(), "agg.parquet", START_DT, STOP_DT)
+        other_manager = ExportManager(self.tmp_dir.name, max_queued=2)
+        stale_job = other_manager.submit("key", frames(), OutputOptions(), "agg.parquet", START_DT, STOP_DT)
+        alive_job = other_manager.submit("key", frames(), OutputOptions(), "agg.parquet", START_DT, STOP_DT)
+        for job in (own_job, stale_job):
+            job.updated_at = time.time() - 7200
+            self.manager._save(job)
+        self.manager.gc()
+        # Heartbeat of the own queued job, the other worker restarted (no heartbeat) or is alive
+        self.assertEqual("queued", self.manager.get(own_job.job_id).state)
+        self.assertGreater(self.manager.get(own_job.job_id).updated_at, time.time() - 60)
+        self.assertEqual(("failed", "Export interrupted"),
+                         (self.manager.get(stale_job.job_id).state, self.manager.get(stale_job.job_id).error))
+        self.assertEqual("queued", self.manager.get(alive_job.job_id).state)
+
+    def test_invalid_job_id(self):
+        self.assertIsNone(self.manager.get("../keys"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+import unittest
+import asyncio
+import datetime
+import json
+import os
+import re
+import sys
+import httpx
+import polars as pl
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "api"))
+
+import influx2client
+
+SCHEMA_CSV = b""",result,table,_value
+,_result,0,P1
+,_result,0,P2
+"""
+
+DATA_CSV = (b"#datatype,string,long,dateTime:RFC3339,double,double\r\n"
+            b",result,table,_time,P1,P2\r\n"
+            + b"".join(f",_result,0,2025-11-23T00:00:{idx:02d}Z,{idx:d}.5,{'' if idx % 2 else '1'}\r\n".encode()
+                       for idx in range(10))
+            + b"\r\n")
+
+class TestAnnotatedCsvParser(unittest.TestCase):
+    def test_chunk_boundaries(self):
+        # Every split position gives the same data
+        for chunk_size in (1, 7, 50, len(DATA_CSV)):
+            parser = influx2client.AnnotatedCsvParser()
+            frames = []
+            for offset in range(0, len(DATA_CSV), chunk_size):
+                frames += parser.feed(DATA_CSV[offset:offset + chunk_size])
+            pl_df = pl.concat(frames)
+            self.assertEqual(["_time", "P1", "P2"], pl_df.columns)
+            self.assertEqual([idx + 0.5 for idx in range(10)], pl_df["P1"].to_list())
+            self.assertEqual([1.0, None] * 5, pl_df["P2"].to_list())
+            self.assertEqual(datetime.datetime(2025, 11, 23, 0, 0, 9, tzinfo=datetime.UTC), pl_df["_time"][-1])
+
+    def test_error_table(self):
+        parser = influx2client.AnnotatedCsvParser()
+        with self.assertRaises(RuntimeError):
+            parser.feed(b"#datatype,string,string\r\n,error,reference\r\n,query timeout,\r\n\r\n")
+
+class TestBuildDataQuery(unittest.TestCase):
+    def test_window(self):
+        start_dt = datetime.datetime(2025, 11, 23, tzinfo=datetime.UTC)
+        query = influx2client.build_data_query(start_dt, start_dt + datetime.timedelta(days=7), "Graz", "test",
+                                               "cycle-by-cycle", ["Freq"], window_ms=604_800, window_fn="max")
+        self.assertIn('aggregateWindow(every: 604800ms, fn: max, timeSrc: "_start", createEmpty: false)', query)
+        self.assertLess(query.index("aggregateWindow"), query.index("pivot("))
+        self.assertNotIn("aggregateWindow", influx2client.build_data_query(start_dt, start_dt, "Graz", "test"))
+
+    def test_locations(self):
+        start_dt = datetime.datetime(2025, 11, 23, tzinfo=datetime.UTC)
+        query = influx2client.build_data_query(start_dt, start_dt, ["AT/Graz", "DE/Berlin"], "test",
+                                               "cycle-by-cycle", ["Freq"])
+        self.assertIn('contains(value: r["location_name"], set: ["AT/Graz", "DE/Berlin"])', query)
+        self.assertIn('pivot(rowKey: ["_time", "location_name"], columnKey: ["_field"]', query)
+        query = influx2client.build_data_query(start_dt, start_dt, ["AT/Graz", "DE/Berlin"], "test",
+                                               "cycle-by-cycle", ["Freq"], layout="wide")
+        self.assertIn('pivot(rowKey: ["_time"], columnKey: ["location_name", "_field"]', query)
+        query = influx2client.build_data_query(start_dt, start_dt, "AT/Graz", "test", layout="wide")
+        self.assertIn('r["location_name"] == "AT/Graz"', query)
+        self.assertIn('keep(columns: ["_time", "_field", "_value"])', query)
+
+    def test_sorted_interleaved_series(self):
+        # Series of several fields and locations come out of group() interleaved, sorted after the pivot
+        start_dt = datetime.datetime(2025, 11, 23, tzinfo=datetime.UTC)
+        for location, layout, sort in (("AT/Graz", "long", '["_time"]'),
+                                       (["AT/Graz", "DE/Berlin"], "wide", '["_time"]'),
+                                       (["AT/Graz", "DE/Berlin"], "long", '["_time", "location_name"]')):
+            query = influx2client.build_data_query(start_dt, start_dt, location, "test", "cycle-by-cycle",
+                                                   ["Freq", "U1_rms"], window_ms=200, layout=layout)
+            self.assertIn(f"|> sort(columns: {sort})", query)
+            self.assertLess(query.index("pivot("), query.index("sort("))
+
+class TestRunQuery(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.requests = []
+        self.responses = []
+        self.retry_backoff = influx2client.INFLUXDB_RETRY_BACKOFF
+        influx2client.INFLUXDB_RETRY_BACKOFF = 0.0
+
+    async def asyncTearDown(self):
+        await influx2client.close_client()
+        influx2client.INFLUXDB_RETRY_BACKOFF = self.retry_backoff
+
+    def use_transport(self):
+        def handler(request: httpx.Request):
+            self.requests.append(request)
+            response = self.responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        influx2client._client = httpx.AsyncClient(base_url=influx2client.INFLUXDB_URL,
+                                                  params={"org": influx2client.INFLUXDB_ORG},
+                                                  transport=httpx.MockTransport(handler))
+
+    async def test_retry_transient_errors(self):
+        self.responses = [httpx.Response(503), httpx.ConnectError("refused"), httpx.Response(200, content=SCHEMA_CSV)]
+        self.use_transport()
+        fields = await influx2client.read_fields("test")
+        self.assertEqual({"fields": ["P1", "P2"]}, fields)
+        self.assertEqual(3, len(self.requests))
+        self.assertEqual("/api/v2/query", self.requests[0].url.path)
+
+    async def test_retries_exhausted(self):
+        self.responses = [httpx.Response(429)] * (influx2client.INFLUXDB_RETRIES + 1)
+        self.use_transport()
+        with self.assertRaises(ConnectionError):
+            await influx2client.run_query("buckets()")
+        self.assertEqual(influx2client.INFLUXDB_RETRIES + 1, len(self.requests))
+
+    async def test_no_retry_on_client_error(self):
+        self.responses = [httpx.Response(400)]
+        self.use_transport()
+        with self.assertRaises(httpx.HTTPStatusError):
+            await influx2client.run_query("invalid")
+        self.assertEqual(1, len(self.requests))
+
+    async def test_iter_data_frames(self):
+        self.responses = [httpx.Response(200, content=DATA_CSV)]
+        self.use_transport()
+        start_dt = datetime.datetime(2025, 11, 23, tzinfo=datetime.UTC)
+        frames = [pl_df async for pl_df in influx2client.iter_data_frames(start_dt, start_dt + datetime.timedelta(hours=1),
+                                                                          "Graz", "test", channels=["P1", "P2"],
+                                                                          batch_rows=4)]
+        self.assertEqual([4, 4, 2], [len(pl_df) for pl_df in frames])
+        query = json.loads(self.requests[0].content)
+        self.assertEqual(["datatype"], query["dialect"]["annotations"])
+        self.assertIn("pivot(", query["query"])
+
+    async def test_iter_data_frames_chunked(self):
+        async def handler(request: httpx.Request):
+            query = json.loads(request.content)["query"]
+            start, stop = [datetime.datetime.fromisoformat(ts) for ts in
+                           re.search(r"range\(start: (\S+), stop: (\S+)\)", query).groups()]
+            self.requests.append(start)
+            # Later chunks answer faster, P2 only in the first chunk
+            await asyncio.sleep(0.05 if start.second == 0 else 0.0)
+            header = ",result,table,_time,P1,P2\r\n" if start.second == 0 else ",result,table,_time,P1\r\n"
+            rows = ""
+            for second in range(start.second, stop.second):
+                rows += f",_result,0,2025-11-23T00:00:{second:02d}Z,{second:d}.0{',1.0' if start.second == 0 else ''}\r\n"
+            datatypes = "#datatype,string,long,dateTime:RFC3339" + ",double" * header.count("P")
+            return httpx.Response(200, content=f"{datatypes}\r\n{header}{rows}\r\n".encode())
+        influx2client._client = httpx.AsyncClient(base_url=influx2client.INFLUXDB_URL,
+                                                  transport=httpx.MockTransport(handler))
+        start_dt = datetime.datetime(2025, 11, 23, tzinfo=datetime.UTC)
+        frames = [pl_df async for pl_df in influx2client.iter_data_frames_chunked(
+            start_dt, start_dt + datetime.timedelta(seconds=10), "Graz", "test", columns=["P2", "P1"],
+            chunk_sec=3, concurrency=2)]
+        self.assertEqual(4, len(self.requests))
+        pl_df = pl.concat(frames)
+        self.assertEqual(["_time", "P2", "P1"], pl_df.columns)
+        self.assertEqual([float(second) for second in range(10)], pl_df["P1"].to_list())
+        self.assertEqual([1.0] * 3 + [None] * 7, pl_df["P2"].to_list())
+
+    async def test_chunks_window_aligned(self):
+        ranges = []
+
+        def handler(request: httpx.Request):
+            query = json.loads(request.content)["query"]
+            ranges.append(re.search(r"range\(start: (\S+), stop: (\S+)\)", query).groups())
+            return httpx.Response(200, content=b"")
+        influx2client._client = httpx.AsyncClient(base_url=influx2client.INFLUXDB_URL,
+                                                  transport=httpx.MockTransport(handler))
+        start_dt = datetime.datetime(2025, 11, 23, 0, 0, 7, tzinfo=datetime.UTC)
+        frames = [pl_df async for pl_df in influx2client.iter_data_frames_chunked(
+            start_dt, start_dt + datetime.timedelta(seconds=60), "Graz", "test", chunk_sec=12, window_ms=2500)]
+        self.assertEqual([], frames)
+        # Chunks rounded up to 15 s (whole 2.5 s windows and seconds) on the epoch grid
+        self.assertEqual([("2025-11-23T00:00:07Z", "2025-11-23T00:00:15Z"),
+                          ("2025-11-23T00:00:15Z", "2025-11-23T00:00:30Z"),
+                          ("2025-11-23T00:00:30Z", "2025-11-23T00:00:45Z"),
+                          ("2025-11-23T00:00:45Z", "2025-11-23T00:01:00Z"),
+                          ("2025-11-23T00:01:00Z", "2025-11-23T00:01:07Z")], sorted(ranges))
+
+if __name__ == "__main__":
+    unittest.main()
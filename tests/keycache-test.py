@@ -0,0 +1,136 @@
+import unittest
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+
+from sqlalchemy import create_engine
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "api"))
+
+import keycache
+import keydatabase
+from keycache import ApiKeyCache, TokenBucket
+
+KEY_ROW = {"key_hash": "key1", "owner": "tester", "allowed_bucket_st": "st", "allowed_bucket_lt": "lt",
+           "is_active": True, "rate_limit_counter": 0, "rate_limit_reseted_at": None}
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.monotonic = keycache.time.monotonic
+        keycache.time.monotonic = lambda: self.now
+
+    def tearDown(self):
+        keycache.time.monotonic = self.monotonic
+
+    def test_refill(self):
+        bucket = TokenBucket(capacity=2, refill_per_sec=0.5)
+        self.assertEqual([0.0, 0.0], [bucket.acquire(), bucket.acquire()])
+        self.assertEqual(2.0, bucket.acquire())
+        self.now += 2.0
+        self.assertEqual(0.0, bucket.acquire())
+        self.now += 100.0
+        self.assertEqual([0.0, 0.0], [bucket.acquire(), bucket.acquire()])
+        self.assertGreater(bucket.acquire(), 0)
+
+class TestApiKeyCache(unittest.IsolatedAsyncioTestCase):
+    async def test_lookup_and_usage(self):
+        loads = []
+        written = []
+        def load_key(key_hash):
+            loads.append(key_hash)
+            return KEY_ROW if key_hash == "key1" else None
+        def record_usage(usage, key_hashes):
+            written.append(usage)
+            return {}
+        api_keys = ApiKeyCache(rate_limit_per_hour=3, load_key=load_key, record_usage=record_usage)
+        key_info = await api_keys.lookup("key1")
+        self.assertEqual("lt", key_info.allowed_bucket_lt)
+        self.assertIs(key_info, await api_keys.lookup("key1"))
+        # Unknown keys are not cached
+        self.assertIsNone(await api_keys.lookup("other"))
+        self.assertIsNone(await api_keys.lookup("other"))
+        self.assertEqual(["key1", "other", "other"], loads)
+        self.assertEqual([0.0] * 3, [api_keys.acquire(key_info) for _ in range(3)])
+        self.assertAlmostEqual(1200.0, api_keys.acquire(key_info), delta=1.0)
+        await api_keys.flush()
+        self.assertEqual(1, len(written))
+        self.assertEqual(3, written[0]["key1"][0])
+        # Only the counters are read without new requests
+        await api_keys.flush()
+        self.assertEqual({}, written[1])
+        await api_keys.close()
+
+    async def test_counted_requests_reduce_tokens(self):
+        row = {**KEY_ROW, "rate_limit_counter": 2,
+               "rate_limit_reseted_at": datetime.datetime.now(datetime.UTC).replace(tzinfo=None)}
+        api_keys = ApiKeyCache(rate_limit_per_hour=3, load_key=lambda key_hash: row,
+                               record_usage=lambda usage, key_hashes: {})
+        key_info = await api_keys.lookup("key1")
+        self.assertEqual(0.0, api_keys.acquire(key_info))
+        self.assertGreater(api_keys.acquire(key_info), 0)
+
+    async def test_shared_counter(self):
+        # Other workers used the limit since the last writeback
+        now = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+        counters = {"key1": (10, now)}
+        api_keys = ApiKeyCache(rate_limit_per_hour=10, load_key=lambda key_hash: KEY_ROW,
+                               record_usage=lambda usage, key_hashes: counters)
+        key_info = await api_keys.lookup("key1")
+        self.assertEqual(0.0, api_keys.acquire(key_info))
+        await api_keys.flush()
+        self.assertGreater(api_keys.acquire(key_info), 0)
+        # New counting hour
+        counters["key1"] = (0, now - datetime.timedelta(hours=2))
+        await api_keys.flush()
+        self.assertEqual(0.0, api_keys.acquire(key_info))
+
+    async def test_writeback_failure_keeps_usage(self):
+        written = []
+        def record_usage(usage, key_hashes):
+            if not written:
+                written.append(None)
+                raise OSError("database is locked")
+            written.append(usage)
+            return {}
+        api_keys = ApiKeyCache(rate_limit_per_hour=10, load_key=lambda key_hash: KEY_ROW, record_usage=record_usage)
+        key_info = await api_keys.lookup("key1")
+        api_keys.acquire(key_info)
+        with self.assertLogs(keycache.logger, "WARNING"):
+            await api_keys.flush()
+        api_keys.acquire(key_info)
+        await api_keys.flush()
+        self.assertEqual(2, written[1]["key1"][0])
+
+class TestRecordUsage(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.engine = keydatabase.engine
+        keydatabase.engine = create_engine(f"sqlite:///{self.tmp_dir.name}/keys.db")
+        keydatabase.Base.metadata.create_all(bind=keydatabase.engine)
+        with keydatabase.engine.begin() as connection:
+            connection.execute(keydatabase.ApiKey.__table__.insert(), {**KEY_ROW, "rate_limit_counter": 5})
+
+    def tearDown(self):
+        keydatabase.engine.dispose()
+        keydatabase.engine = self.engine
+        self.tmp_dir.cleanup()
+
+    def test_increment(self):
+        last_used = datetime.datetime(2025, 11, 23, 12, 0)
+        # Counter restarted (no counting hour yet), then incremented
+        keydatabase.record_usage({"key1": (3, last_used)})
+        counters = keydatabase.record_usage({"key1": (2, last_used)}, ["key2"])
+        self.assertEqual({"key1"}, set(counters))
+        self.assertEqual(5, counters["key1"][0])
+        row = keydatabase.load_active_key("key1")
+        self.assertEqual(5, row["rate_limit_counter"])
+        self.assertEqual(last_used, row["last_used"])
+        self.assertIsNotNone(row["rate_limit_reseted_at"])
+        self.assertIsNone(keydatabase.load_active_key("unknown"))
+
+if __name__ == "__main__":
+    unittest.main()
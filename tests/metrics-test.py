@@ -0,0 +1,45 @@
+import unittest
+import asyncio
+import os
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "mqtt_to_influxdb"))
+
+import metrics
+
+class TestMetrics(unittest.TestCase):
+    def test_render(self):
+        registry = metrics.MetricsRegistry()
+        counter = registry.register(metrics.Counter("test_total", "Test counter", ("device_id",)))
+        histogram = registry.register(metrics.Histogram("test_seconds", "Test histogram", [0.1, 1]))
+        counter.inc(2, 'dev"1')
+        histogram.observe(0.1)
+        histogram.observe(5)
+        expected = ("# HELP test_total Test counter\n"
+                    "# TYPE test_total counter\n"
+                    'test_total{device_id="dev\\"1"} 2\n'
+                    "# HELP test_seconds Test histogram\n"
+                    "# TYPE test_seconds histogram\n"
+                    'test_seconds_bucket{le="0.1"} 1\n'
+                    'test_seconds_bucket{le="1"} 1\n'
+                    'test_seconds_bucket{le="+Inf"} 2\n'
+                    "test_seconds_sum 5.1\n"
+                    "test_seconds_count 2\n")
+        self.assertEqual(expected, registry.render())
+
+class TestMetricsServer(unittest.IsolatedAsyncioTestCase):
+    async def test_endpoint(self):
+        metrics.ERRORS.inc(1, "test")
+        server = await metrics.start_metrics_server("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        server.close()
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+        self.assertIn(b'pqopen_ingest_errors_total{stage="test"} 1', response)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import asyncio
+import os
+import sys
+import orjson
+from concurrent.futures import ProcessPoolExecutor
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "mqtt_to_influxdb"))
+
+from pipeline import IngestPipeline
+from deviceregistry import DeviceRegistry
+from messagehandler import EncoderOptions
+from rollup import RollupAggregator
+from recentbuffer import RecentDataBuffer
+
+DEVICE_CONFIG = DeviceRegistry()
+DEVICE_CONFIG.update({"dev1": {"location_name": "Graz", "location_lat": 47.068, "location_lon": 15.424},
+                      "dev2": {"location_name": "Berlin", "location_lat": 52.52, "location_lon": 13.405}})
+
+class FakeBatchWriter:
+    def __init__(self):
+        self.records = []
+        self.precisions = []
+
+    async def write(self, bucket, record, precision="ns"):
+        self.records.append((bucket, record))
+        self.precisions.append(precision)
+
+def agg_payload(timestamp: float):
+    return orjson.dumps({"interval_sec": 1, "timestamp": timestamp, "data": {"CH1": 1.0}})
+
+class TestIngestPipeline(unittest.IsolatedAsyncioTestCase):
+    async def test_order_within_device(self):
+        batch_writer = FakeBatchWriter()
+        pipeline = IngestPipeline(batch_writer, DEVICE_CONFIG, num_workers=3)
+        stop_event = asyncio.Event()
+        pipeline_task = asyncio.create_task(pipeline.run(stop_event))
+        for idx in range(20):
+            await pipeline.put("dev1", "agg_data", "json", agg_payload(idx))
+            await pipeline.put("dev2", "agg_data", "json", agg_payload(idx))
+        stop_event.set()
+        await pipeline_task
+        self.assertEqual(40, len(batch_writer.records))
+        for location in ["Graz", "Berlin"]:
+            timestamps = [int(record.split()[-1]) for _, record in batch_writer.records if location.encode() in record]
+            self.assertEqual(list(range(20)), timestamps)
+        self.assertEqual({"s"}, set(batch_writer.precisions))
+
+    async def test_drop_oldest(self):
+        batch_writer = FakeBatchWriter()
+        pipeline = IngestPipeline(batch_writer, DEVICE_CONFIG, num_workers=1, queue_size=2, queue_policy="drop_oldest")
+        for idx in range(5):
+            await pipeline.put("dev1", "agg_data", "json", agg_payload(idx))
+        self.assertEqual(3, pipeline.num_dropped)
+        stop_event = asyncio.Event()
+        stop_event.set()
+        await pipeline.run(stop_event)
+        timestamps = [int(record.split()[-1]) for _, record in batch_writer.records]
+        self.assertEqual([3, 4], timestamps)
+
+    async def test_decode_executor(self):
+        batch_writer = FakeBatchWriter()
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            pipeline = IngestPipeline(batch_writer, DEVICE_CONFIG, decode_executor=executor, decode_inline_max_bytes=0,
+                                      encoder_options=EncoderOptions(aggregated_precision="ms"))
+            stop_event = asyncio.Event()
+            pipeline_task = asyncio.create_task(pipeline.run(stop_event))
+            for idx in range(5):
+                await pipeline.put("dev1", "agg_data", "json", agg_payload(idx))
+            stop_event.set()
+            await pipeline_task
+        timestamps = [int(record.split()[-1]) for _, record in batch_writer.records]
+        self.assertEqual([idx * 1_000 for idx in range(5)], timestamps)
+
+    async def test_rollup_flush_on_stop(self):
+        batch_writer = FakeBatchWriter()
+        pipeline = IngestPipeline(batch_writer, DEVICE_CONFIG, encoder_options=EncoderOptions(rollup_windows=(1,)),
+                                  rollup=RollupAggregator(windows=(1,)))
+        payload = orjson.dumps({"data": {"U1": {"data": [1.0, 3.0], "timestamps": [0, 20_000]}}})
+        await pipeline.put("dev1", "dataseries", "json", payload)
+        stop_event = asyncio.Event()
+        stop_event.set()
+        await pipeline.run(stop_event)
+        self.assertEqual(["short_term", "long_term"], [bucket for bucket, _ in batch_writer.records])
+        self.assertEqual(["us", "s"], batch_writer.precisions)
+        self.assertIn(b"U1_count=2i,U1_max=3.000000,U1_mean=2.000000,U1_min=1.000000,U1_stddev=1.000000 0", batch_writer.records[1][1])
+
+    async def test_recent_buffer_with_decode_executor(self):
+        batch_writer = FakeBatchWriter()
+        recent_buffer = RecentDataBuffer(capacity=100)
+        payload = orjson.dumps({"data": {"U1": {"data": [1.0, 3.0], "timestamps": [0, 20_000]}}})
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            pipeline = IngestPipeline(batch_writer, DEVICE_CONFIG, decode_executor=executor, decode_inline_max_bytes=0,
+                                      encoder_options=EncoderOptions(keep_dataseries=True), recent_buffer=recent_buffer)
+            await pipeline.put("dev1", "dataseries", "json", payload)
+            stop_event = asyncio.Event()
+            stop_event.set()
+            await pipeline.run(stop_event)
+        [(ch_name, timestamps, values)] = recent_buffer.read("short_term", "Graz", [], 0, 1_000_000)
+        self.assertEqual(("U1", [0, 20_000], [1.0, 3.0]), (ch_name, timestamps.tolist(), values.tolist()))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "mqtt_to_influxdb"))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "api"))
+
+from recentbuffer import ChannelRing, RecentDataBuffer, start_recent_buffer_server
+import recentbufferclient
+
+class TestChannelRing(unittest.TestCase):
+    def test_wrap_and_coverage(self):
+        ring = ChannelRing(capacity=5)
+        ring.append(np.arange(3), np.arange(3) * 1.0)
+        self.assertEqual(0, ring.covered_from)
+        ring.append(np.arange(3, 7), np.arange(3, 7) * 1.0)
+        self.assertEqual(2, ring.covered_from)
+        timestamps, values = ring.read(0, 100)
+        self.assertEqual([2, 3, 4, 5, 6], timestamps.tolist())
+        self.assertEqual([4.0, 5.0], ring.read(4, 6)[1].tolist())
+
+    def test_out_of_order(self):
+        ring = ChannelRing(capacity=10)
+        ring.append(np.array([10, 20]), np.array([1.0, 2.0]))
+        ring.append(np.array([15, 30]), np.array([1.5, 3.0]))
+        self.assertEqual(21, ring.covered_from)
+        self.assertEqual([10, 20, 30], ring.read(0, 100)[0].tolist())
+
+class TestRecentDataBuffer(unittest.IsolatedAsyncioTestCase):
+    async def test_read_via_socket(self):
+        buffer = RecentDataBuffer(capacity=1000)
+        start_us = 1_700_000_000_000_000
+        timestamps = start_us + np.arange(200) * 20_000
+        values = np.vstack([np.arange(200) * 1.0, np.arange(200) * 2.0])
+        values[1, 5] = np.nan
+        buffer.add("short_term", "Graz", [(["U2", "U1"], timestamps, values)])
+        with tempfile.TemporaryDirectory() as tmp_path:
+            socket_path = os.path.join(tmp_path, "recent.sock")
+            server = await start_recent_buffer_server(buffer, socket_path)
+            recentbufferclient.RECENT_BUFFER_SOCKETS = [socket_path]
+            try:
+                start_dt = datetime.datetime.fromtimestamp(1_700_000_001, tz=datetime.UTC)
+                stop_dt = datetime.datetime.fromtimestamp(1_700_000_002, tz=datetime.UTC)
+                # Without channels from the database (the buffer knows only the channels seen so far)
+                self.assertIsNone(await recentbufferclient.read_data_pl(start_dt, stop_dt, "Graz", "short_term"))
+                df = await recentbufferclient.read_data_pl(start_dt, stop_dt, "Graz", "short_term", ["U2", "U1"])
+                self.assertEqual(["_time", "U1", "U2"], df.columns)
+                self.assertEqual(50, len(df))
+                self.assertEqual(start_dt, df["_time"][0])
+                self.assertEqual(list(range(50, 100)), df["U2"].to_list())
+                # Range before the first buffered sample and foreign bucket are not covered
+                early_dt = datetime.datetime.fromtimestamp(1_699_999_999, tz=datetime.UTC)
+                self.assertIsNone(await recentbufferclient.read_data_pl(early_dt, stop_dt, "Graz", "short_term", ["U1"]))
+                self.assertIsNone(await recentbufferclient.read_data_pl(start_dt, stop_dt, "Graz", "other", ["U1"]))
+                df = await recentbufferclient.read_data_pl(datetime.datetime.fromtimestamp(1_700_000_000, tz=datetime.UTC),
+                                             start_dt, "Graz", "short_term", ["U1"])
+                self.assertEqual(49, len(df))
+            finally:
+                server.close()
+                await server.wait_closed()
+
+    def test_float_format(self):
+        # Values rounded like the line protocol written to the database
+        timestamps = np.array([10, 20])
+        values = np.array([[230.123456789, 0.1 + 0.2]])
+        for float_format, expected in (("%f", [230.123457, 0.3]), ("%.4g", [230.1, 0.3]),
+                                       ("%r", [230.123456789, 0.1 + 0.2])):
+            buffer = RecentDataBuffer(capacity=10, float_format=float_format)
+            buffer.add("short_term", "Graz", [(["U1"], timestamps, values)])
+            self.assertEqual(expected, buffer.read("short_term", "Graz", ["U1"], 10, 100)[0][2].tolist())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "api"))
+
+from resultcache import ResultCache, etag_matches
+
+START_DT = datetime.datetime(2025, 11, 23, tzinfo=datetime.UTC)
+STOP_DT = datetime.datetime(2025, 11, 24, tzinfo=datetime.UTC)
+
+async def chunks(data: list, fail: bool = False):
+    for chunk in data:
+        yield chunk
+    if fail:
+        raise ConnectionError("InfluxDB not available")
+
+async def collect(data_stream) -> bytes:
+    return b"".join([chunk async for chunk in data_stream])
+
+class TestResultCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(self.tmp_dir.name, max_bytes=100, settled_sec=3600)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_key(self):
+        key = ResultCache.make_key("lt", "aggregated-data", "Graz", ["P2", "P1"], 600, START_DT,
+                                   STOP_DT + datetime.timedelta(microseconds=10), {"format": "parquet"})
+        self.assertEqual(key, ResultCache.make_key("lt", "aggregated-data", "Graz", ["P1", "P2"], 600, START_DT,
+                                                   STOP_DT, {"format": "parquet"}))
+        self.assertNotEqual(key, ResultCache.make_key("lt", "aggregated-data", "Graz", ["P1", "P2"], 600, START_DT,
+                                                      STOP_DT, {"format": "csv"}))
+
+    def test_settled(self):
+        self.assertTrue(self.cache.is_settled(STOP_DT))
+        self.assertFalse(self.cache.is_settled(datetime.datetime.now(tz=datetime.UTC) - datetime.timedelta(minutes=10)))
+
+    def test_etag_matches(self):
+        etag = ResultCache.etag("abc", 1000.5)
+        self.assertEqual('"abc-1000"', etag)
+        self.assertTrue(etag_matches('"xyz", W/"abc-1000"', etag))
+        self.assertTrue(etag_matches("*", etag))
+        self.assertFalse(etag_matches('"xyz"', etag))
+        self.assertFalse(etag_matches(None, etag))
+
+    async def test_store_and_evict(self):
+        self.assertIsNone(self.cache.open("a"))
+        created = time.time()
+        self.assertEqual(b"x" * 60, await collect(self.cache.store_stream("a", chunks([b"x" * 30, b"x" * 30]), created)))
+        entry_file, entry_created = self.cache.open("a")
+        self.assertEqual(int(created), int(entry_created))
+        self.assertEqual(b"x" * 60, await collect(self.cache.iter_file(entry_file)))
+        os.utime(os.path.join(self.tmp_dir.name, "a.bin"), (0, created))
+        await collect(self.cache.store_stream("b", chunks([b"y" * 50]), time.time()))
+        # Least recently used entry evicted
+        self.assertIsNone(self.cache.open("a"))
+        self.assertEqual(b"y" * 50, await collect(self.cache.iter_file(self.cache.open("b")[0])))
+
+    async def test_max_age(self):
+        await collect(self.cache.store_stream("a", chunks([b"x" * 10]), time.time() - 7200))
+        await collect(self.cache.store_stream("b", chunks([b"y" * 10]), time.time() - 7200))
+        self.cache.max_age_sec = 3600
+        # Expired entries are misses and deleted on access or eviction
+        self.assertIsNone(self.cache.open("a"))
+        self.assertEqual(["b.bin"], os.listdir(self.tmp_dir.name))
+        self.cache.evict()
+        self.assertEqual([], os.listdir(self.tmp_dir.name))
+
+    async def test_not_stored(self):
+        # Incomplete and too big responses are passed through only
+        with self.assertRaises(ConnectionError):
+            await collect(self.cache.store_stream("a", chunks([b"x" * 10], fail=True), time.time()))
+        self.assertEqual(b"x" * 120, await collect(self.cache.store_stream("b", chunks([b"x" * 60, b"x" * 60]),
+                                                                           time.time())))
+        self.assertIsNone(self.cache.open("a"))
+        self.assertIsNone(self.cache.open("b"))
+        self.assertEqual([], os.listdir(self.tmp_dir.name))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import os
+import sys
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "mqtt_to_influxdb"))
+
+from rollup import window_partials, dataseries_partials, RollupAggregator
+from dataconverter import group_channels_by_timestamps
+from deviceregistry import DeviceEntry
+
+DEVICE = DeviceEntry.from_config("dev1", {"location_name": "Graz", "location_lat": 47.068, "location_lon": 15.424})
+
+def parse_fields(record: bytes) -> list[dict]:
+    rows = []
+    for line in record.decode().splitlines():
+        _, fields, timestamp = line.split(" ")
+        row = {"timestamp": int(timestamp)}
+        for field in fields.split(","):
+            key, value = field.split("=")
+            row[key] = int(value[:-1]) if value.endswith("i") else float(value)
+        rows.append(row)
+    return rows
+
+class TestWindowPartials(unittest.TestCase):
+    def test_partials(self):
+        timestamps = np.array([0, 500_000, 1_000_000, 1_500_000, 2_500_000])
+        values = np.array([[1.0, 3.0, 2.0, np.nan, 5.0]])
+        window_starts, stats = window_partials(timestamps, values, 1)
+        self.assertEqual([0, 1_000_000, 2_000_000], window_starts.tolist())
+        count, mean, m2, minimum, maximum = stats[:, 0, :]
+        self.assertEqual([2, 1, 1], count.tolist())
+        self.assertEqual([2.0, 2.0, 5.0], mean.tolist())
+        self.assertEqual([2.0, 0.0, 0.0], m2.tolist())
+        self.assertEqual([1.0, 2.0, 5.0], minimum.tolist())
+        self.assertEqual([3.0, 2.0, 5.0], maximum.tolist())
+
+class TestRollupAggregator(unittest.TestCase):
+    def test_merge_out_of_order(self):
+        rng = np.random.default_rng(0)
+        timestamps = np.arange(0, 20_000_000, 20_000)
+        values = 230 + rng.standard_normal(len(timestamps))
+        rollup = RollupAggregator(windows=(10,), allowed_lateness=1.0)
+        records = []
+        # Messages of 2 s, second and third message swapped
+        for idx in [0, 2, 1, 3, 4, 5, 6, 7, 8, 9]:
+            part = slice(idx * 100, (idx + 1) * 100)
+            m_data = {"U1": {"data": values[part].tolist(), "timestamps": timestamps[part].tolist()}}
+            partials = dataseries_partials(group_channels_by_timestamps(m_data), rollup.windows)
+            records += rollup.add(DEVICE, partials, timestamps[part][-1] / 1e6)
+        records += rollup.flush_all()
+        self.assertEqual(["long_term", "long_term"], [bucket for bucket, _, _ in records])
+        self.assertEqual(["s", "s"], [precision for _, precision, _ in records])
+        self.assertTrue(records[0][2].startswith(b"cycle-by-cycle-rollup,window_sec=10,location_name=Graz,"))
+        rows = parse_fields(b"".join(record for _, _, record in records))
+        for row, window_values in zip(rows, [values[:500], values[500:]]):
+            self.assertEqual(500, row["U1_count"])
+            self.assertAlmostEqual(window_values.mean(), row["U1_mean"], places=5)
+            self.assertAlmostEqual(window_values.std(), row["U1_stddev"], places=5)
+            self.assertAlmostEqual(window_values.min(), row["U1_min"], places=5)
+            self.assertAlmostEqual(window_values.max(), row["U1_max"], places=5)
+        self.assertEqual([0, 10], [row["timestamp"] for row in rows])
+
+    def test_late_samples_dropped(self):
+        rollup = RollupAggregator(windows=(1,), allowed_lateness=0.5)
+        m_data = {"U1": {"data": [1.0, 2.0], "timestamps": [0, 2_000_000]}}
+        records = rollup.add(DEVICE, dataseries_partials(group_channels_by_timestamps(m_data), (1,)), 2.0)
+        self.assertEqual([{"timestamp": 0, "U1_count": 1, "U1_max": 1.0, "U1_mean": 1.0, "U1_min": 1.0, "U1_stddev": 0.0}],
+                         parse_fields(records[0][2]))
+        m_data = {"U1": {"data": [3.0], "timestamps": [500_000]}}
+        records = rollup.add(DEVICE, dataseries_partials(group_channels_by_timestamps(m_data), (1,)), 0.5)
+        self.assertEqual([], records)
+        self.assertEqual(1, rollup.num_late)
+
+    def test_invalid_windows(self):
+        with self.assertRaises(ValueError):
+            RollupAggregator(windows=(0.5,))
+
+    def test_idle_timeout(self):
+        self.assertEqual(125.0, RollupAggregator(windows=(1, 60), allowed_lateness=5.0).idle_timeout)
+        self.assertEqual(66.0, RollupAggregator(windows=(1, 60), allowed_lateness=5.0, idle_timeout=66.0).idle_timeout)
+        # Would close the windows of devices publishing 60 s blocks early
+        with self.assertRaises(ValueError):
+            RollupAggregator(windows=(1, 60), allowed_lateness=5.0, idle_timeout=60.0)
+
+if __name__ == "__main__":
+    unittest.main()
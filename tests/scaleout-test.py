@@ -0,0 +1,99 @@
+"""
+Scale-out tests, the broker tests run against a local broker with shared subscription
+support (e.g. mosquitto >= 1.6) when PQOPEN_TEST_MQTT_HOST is set (optional
+PQOPEN_TEST_MQTT_PORT, default 1883)
+"""
+import unittest
+import asyncio
+import os
+import sys
+import uuid
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "mqtt_to_influxdb"))
+
+from scaleout import check_scale_config, device_shard, instance_client_id, subscription_topics
+
+TEST_MQTT_HOST = os.getenv("PQOPEN_TEST_MQTT_HOST")
+TEST_MQTT_PORT = int(os.getenv("PQOPEN_TEST_MQTT_PORT", 1883))
+
+DEVICE_IDS = [str(uuid.UUID(int=idx)) for idx in range(40)]
+
+class TestSubscriptionTopics(unittest.TestCase):
+    def test_single_and_shared(self):
+        self.assertEqual(["private/#"], subscription_topics("single", "private/#"))
+        self.assertEqual(["$share/ingest/private/#"], subscription_topics("shared", "private/#", share_group="ingest"))
+        self.assertEqual("mqtt-to-database", instance_client_id("mqtt-to-database", "single", 3))
+        self.assertEqual("mqtt-to-database-3", instance_client_id("mqtt-to-database", "sharded", 3))
+
+    def test_sharded_disjoint(self):
+        instance_count = 3
+        topics = [subscription_topics("sharded", "private/#", DEVICE_IDS, instance_index=idx, instance_count=instance_count)
+                  for idx in range(instance_count)]
+        all_topics = [topic for shard_topics in topics for topic in shard_topics]
+        self.assertEqual(sorted(f"private/{device_id}/#" for device_id in DEVICE_IDS), sorted(all_topics))
+        self.assertTrue(all(shard_topics for shard_topics in topics))
+        self.assertEqual(device_shard(DEVICE_IDS[0], 3), device_shard(DEVICE_IDS[0], 3))
+
+    def test_invalid_index(self):
+        with self.assertRaises(ValueError):
+            subscription_topics("sharded", "private/#", DEVICE_IDS, instance_index=2, instance_count=2)
+
+    def test_check_scale_config(self):
+        check_scale_config("single", None, 1)
+        check_scale_config("shared", None, 1)
+        check_scale_config("sharded", 1, 2)
+        for instance_index, instance_count in ((None, 2), (2, 2), (-1, 2)):
+            with self.assertRaises(ValueError):
+                check_scale_config("sharded", instance_index, instance_count)
+        with self.assertRaises(ValueError):
+            check_scale_config("sharding", 0, 1)
+
+    def test_stable_client_id(self):
+        self.assertEqual("mqtt-to-database-ingest-a", instance_client_id("mqtt-to-database", "shared", "ingest-a"))
+        with self.assertRaises(ValueError):
+            instance_client_id("mqtt-to-database", "shared")
+        self.assertTrue(instance_client_id("mqtt-to-database", "shared", persistent_session=False)
+                        .startswith("mqtt-to-database-"))
+
+@unittest.skipUnless(TEST_MQTT_HOST, "PQOPEN_TEST_MQTT_HOST not set")
+class TestLocalBroker(unittest.IsolatedAsyncioTestCase):
+    async def receive_all(self, scale_mode: str, instance_count: int = 2):
+        import aiomqtt
+        topic = f"test-{uuid.uuid4().hex[:8]}/#"
+        received = {idx: [] for idx in range(instance_count)}
+        async def instance(idx, subscribed):
+            async with aiomqtt.Client(TEST_MQTT_HOST, port=TEST_MQTT_PORT,
+                                      identifier=instance_client_id("pqopen-test", scale_mode, idx)) as client:
+                for instance_topic in subscription_topics(scale_mode, topic, DEVICE_IDS, share_group="pqopen-test",
+                                                          instance_index=idx, instance_count=instance_count):
+                    await client.subscribe(instance_topic, 1)
+                subscribed.set()
+                async for message in client.messages:
+                    received[idx].append(message.topic.value)
+        subscribed = [asyncio.Event() for _ in range(instance_count)]
+        tasks = [asyncio.create_task(instance(idx, subscribed[idx])) for idx in range(instance_count)]
+        await asyncio.wait_for(asyncio.gather(*(event.wait() for event in subscribed)), timeout=10)
+        async with aiomqtt.Client(TEST_MQTT_HOST, port=TEST_MQTT_PORT) as publisher:
+            for device_id in DEVICE_IDS:
+                await publisher.publish(f"{topic.split('/#')[0]}/{device_id}/agg_data/json", b"{}", qos=1)
+        await asyncio.sleep(1)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return received
+
+    async def test_shared_subscription(self):
+        received = await self.receive_all("shared")
+        all_topics = received[0] + received[1]
+        self.assertEqual(len(DEVICE_IDS), len(all_topics))
+        self.assertEqual(len(DEVICE_IDS), len(set(all_topics)))
+
+    async def test_sharded_subscription(self):
+        received = await self.receive_all("sharded")
+        for idx, topics in received.items():
+            self.assertTrue(all(device_shard(topic.split("/")[1], 2) == idx for topic in topics))
+        self.assertEqual(len(DEVICE_IDS), len(received[0]) + len(received[1]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "mqtt_to_influxdb"))
+
+from spool import WriteSpool
+
+class TestWriteSpool(unittest.TestCase):
+    def test_append_and_read(self):
+        with tempfile.TemporaryDirectory() as spool_path:
+            spool = WriteSpool(spool_path, segment_size=20)
+            spool.append("short_term", b"m f=1 0\n")
+            spool.append("long_term", b"m f=2 0\n", "s")
+            spool.close()
+            records = [record for seg_path in spool.sealed_segments() for record in spool.read_segment(seg_path)]
+            self.assertEqual([("short_term", "ns", b"m f=1 0\n"), ("long_term", "s", b"m f=2 0\n")], records)
+            self.assertEqual(2, len(spool.sealed_segments()))
+
+    def test_recover_torn_segment(self):
+        with tempfile.TemporaryDirectory() as spool_path:
+            spool = WriteSpool(spool_path)
+            spool.append("short_term", b"m f=1 0\n")
+            spool.append("short_term", b"m f=2 1\n")
+            spool._segment_file.flush()
+            # Simulate crash during the last append
+            seg_path = spool._segment_path
+            os.truncate(seg_path, seg_path.stat().st_size - 3)
+            recovered_spool = WriteSpool(spool_path)
+            segments = recovered_spool.sealed_segments()
+            self.assertEqual([Path(spool_path) / "0000000001.seg"], segments)
+            self.assertEqual([("short_term", "ns", b"m f=1 0\n")], list(recovered_spool.read_segment(segments[0])))
+            recovered_spool.append("short_term", b"m f=3 2\n")
+            self.assertEqual("0000000002.open", recovered_spool._segment_path.name)
+
+    def test_max_bytes(self):
+        with tempfile.TemporaryDirectory() as spool_path:
+            spool = WriteSpool(spool_path, segment_size=1, max_bytes=70)
+            for idx in range(5):
+                spool.append("short_term", f"m f={idx:d} 0\n".encode())
+            segments = spool.sealed_segments()
+            self.assertEqual(["0000000004.seg", "0000000005.seg"], [seg_path.name for seg_path in segments])
+
+if __name__ == "__main__":
+    unittest.main()
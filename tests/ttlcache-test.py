@@ -0,0 +1,75 @@
+import unittest
+import asyncio
+import os
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "src", "api"))
+
+import ttlcache
+from ttlcache import TtlCache
+
+class Loader:
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.fail:
+            raise ConnectionError("InfluxDB not available")
+        return {"fields": [f"P{self.calls:d}"]}
+
+async def run_background_tasks():
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+class TestTtlCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.monotonic = ttlcache.time.monotonic
+        ttlcache.time.monotonic = lambda: self.now
+
+    def tearDown(self):
+        ttlcache.time.monotonic = self.monotonic
+
+    async def test_concurrent_load(self):
+        cache = TtlCache(ttl=10, max_stale=100)
+        loader = Loader()
+        loader.release.clear()
+        waiting = [asyncio.create_task(cache.get("fields", loader)) for _ in range(3)]
+        await asyncio.sleep(0)
+        loader.release.set()
+        self.assertEqual([{"fields": ["P1"]}] * 3, await asyncio.gather(*waiting))
+        self.assertEqual(1, loader.calls)
+
+    async def test_stale_while_revalidate(self):
+        cache = TtlCache(ttl=10, max_stale=100)
+        loader = Loader()
+        await cache.get("fields", loader)
+        self.now += 5
+        self.assertEqual({"fields": ["P1"]}, await cache.get("fields", loader))
+        self.assertEqual(1, loader.calls)
+        # Stale value returned, reloaded in the background
+        self.now += 10
+        self.assertEqual({"fields": ["P1"]}, await cache.get("fields", loader))
+        await run_background_tasks()
+        self.assertEqual({"fields": ["P2"]}, await cache.get("fields", loader))
+        # Failed reload keeps the stale value
+        self.now += 20
+        loader.fail = True
+        with self.assertLogs(ttlcache.logger, "WARNING"):
+            self.assertEqual({"fields": ["P2"]}, await cache.get("fields", loader))
+            await run_background_tasks()
+        self.assertEqual({"fields": ["P2"]}, await cache.get("fields", loader))
+        # Too old to be returned
+        self.now += 200
+        with self.assertRaises(ConnectionError):
+            await cache.get("fields", loader)
+        await cache.close()
+
+if __name__ == "__main__":
+    unittest.main()